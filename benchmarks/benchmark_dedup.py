@@ -0,0 +1,68 @@
+"""
+Benchmark the hashed `latest_per_key` dedup against sorting on DateModified and dropping duplicates.
+
+Usage (from the repository root):
+    python -m benchmarks.benchmark_dedup --rows 2000000 --updates-per-key 5
+"""
+import argparse
+import time
+import tracemalloc
+
+import numpy as np
+import pandas as pd
+
+from src.open_house_processor import OpenHouseProcessor
+
+
+def make_updates(rows, updates_per_key, seed=0):
+    """
+    Build cleaned records with on average `updates_per_key` updates for each OpenHouseKey.
+
+    Args:
+        rows (int): The number of records.
+        updates_per_key (int): The average number of records sharing a key.
+        seed (int, optional): The random seed. Defaults to 0.
+
+    Returns:
+        pandas.DataFrame: Records with `OpenHouseKey` and a UTC `DateModified`.
+    """
+    rng = np.random.default_rng(seed)
+    keys = rng.integers(0, max(1, rows // updates_per_key), size=rows)
+    return pd.DataFrame({
+        'OpenHouseKey': pd.Series(keys).map('{:032x}'.format),
+        'DateModified': pd.to_datetime(rng.integers(0, 30 * 24 * 3600, size=rows), unit='s', utc=True),
+        'Zipcode': '92630',
+    })
+
+
+def benchmark(df):
+    """
+    Time each dedup strategy and trace the peak memory it allocates.
+
+    Args:
+        df (pandas.DataFrame): The records to dedup.
+
+    Returns:
+        dict: Seconds and peak traced MiB for each strategy.
+    """
+    results = {}
+    for dedup in ('sort', 'hash'):
+        processor = OpenHouseProcessor('', '', dedup=dedup)
+        data = df.copy()
+        tracemalloc.start()
+        start = time.perf_counter()
+        processor.keep_latest(data)
+        elapsed = time.perf_counter() - start
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        results[dedup] = {'seconds': round(elapsed, 3), 'peak_mib': round(peak / 2 ** 20, 1)}
+    return results
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--rows', type=int, default=2_000_000)
+    parser.add_argument('--updates-per-key', type=int, default=5)
+    args = parser.parse_args()
+    for name, result in benchmark(make_updates(args.rows, args.updates_per_key)).items():
+        print(f'{name}: {result["seconds"]}s, peak {result["peak_mib"]} MiB')
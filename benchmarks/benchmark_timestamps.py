@@ -0,0 +1,72 @@
+"""
+Benchmark the strict timestamp parser against the format inferring `pd.to_datetime` path.
+
+Usage (from the repository root):
+    python -m benchmarks.benchmark_timestamps --rows 1000000 --bad-fraction 0.1
+"""
+import argparse
+import time
+
+import numpy as np
+import pandas as pd
+
+from src.open_house_processor import parse_timestamps
+
+
+def make_timestamps(rows, bad_fraction, seed=0):
+    """
+    Build a column of timestamps shaped like the feed, with a fraction of `HH:MM` values mixed in.
+
+    Args:
+        rows (int): The number of values.
+        bad_fraction (float): The fraction of values replaced by `HH:MM` strings.
+        seed (int, optional): The random seed. Defaults to 0.
+
+    Returns:
+        pandas.Series: The raw timestamp strings.
+    """
+    rng = np.random.default_rng(seed)
+    start = np.datetime64('2023-01-01T00:00:00.000')
+    offsets = rng.integers(0, 365 * 24 * 3600 * 1000, size=rows).astype('timedelta64[ms]')
+    values = pd.Series(np.datetime_as_string(start + offsets, unit='ms')) + 'Z'
+    bad = rng.random(rows) < bad_fraction
+    values[bad] = pd.Series(rng.integers(0, 24, size=rows)).map('{:02d}:00'.format)[bad]
+    return values
+
+
+def benchmark(values, repeat=3):
+    """
+    Time both parsers on the same values.
+
+    Args:
+        values (pandas.Series): The raw timestamp strings.
+        repeat (int, optional): The number of timed runs, the fastest is kept. Defaults to 3.
+
+    Returns:
+        dict: Rows per second and rejected values for each parser.
+    """
+    parsers = {
+        'to_datetime': lambda: pd.to_datetime(values, utc=True, errors='coerce'),
+        'parse_timestamps': lambda: parse_timestamps(values),
+    }
+    results = {}
+    for name, parse in parsers.items():
+        timings = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            parsed = parse()
+            timings.append(time.perf_counter() - start)
+        results[name] = {
+            'rows_per_second': round(len(values) / min(timings)),
+            'rejected': int(parsed.isna().sum()),
+        }
+    return results
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--rows', type=int, default=1_000_000)
+    parser.add_argument('--bad-fraction', type=float, default=0.1)
+    args = parser.parse_args()
+    for name, result in benchmark(make_timestamps(args.rows, args.bad_fraction)).items():
+        print(f'{name}: {result["rows_per_second"]:,} rows/s, {result["rejected"]:,} rejected')
@@ -0,0 +1,160 @@
+"""
+Generate a seeded, synthetic open house feed shaped like `data/openhouses.json`, at any size.
+
+The feed keeps the quirks of the real one: records with a null OpenHouseKey, `HH:MM` start and end
+times, several updates per OpenHouseKey and ZIP+4 zip codes. Records are built and written in
+chunks with numpy, so 100M records never have to fit in memory.
+
+Usage (from the repository root):
+    python -m benchmarks.generate_openhouses data/synthetic_1m.json --records 1000000 --seed 7
+"""
+import argparse
+
+import numpy as np
+import pandas as pd
+
+# Share of records carrying each quirk, roughly matching the sample feed
+NULL_KEY_RATE = 0.001
+BAD_TIME_RATE = 0.001
+ZIP_PLUS_FOUR_RATE = 0.012
+VIRTUAL_RATE = 0.05
+
+# Average number of records per OpenHouseKey and OpenHouseKeys per ListingKey
+UPDATES_PER_KEY = 1.2
+OPEN_HOUSES_PER_LISTING = 2.6
+
+STATES = np.array(['CA', 'TX', 'FL', 'NY', 'WA', 'AZ', 'CO', 'NV'])
+STATE_WEIGHTS = np.array([0.35, 0.2, 0.15, 0.1, 0.06, 0.06, 0.05, 0.03])
+
+FEED_START = np.datetime64('2023-01-01T00:00:00.000')
+FEED_DAYS = 365
+CHUNK_SIZE = 250_000
+
+# Records are drawn in blocks of this size, each from its own generator seeded with the feed's seed and the
+# block's index, so the feed does not depend on the chunk size it is generated in
+BLOCK_SIZE = 50_000
+
+
+def _hex_keys(ids, salt):
+    """
+    Turn integer ids into stable 32 character hex keys, like the MD5 keys of the real feed.
+    """
+    # splitmix64 scrambles the ids so consecutive ids give unrelated looking keys
+    with np.errstate(over='ignore'):
+        words = []
+        for round_salt in (salt, salt ^ 0x5851F42D4C957F2D):
+            z = ids.astype(np.uint64) + np.uint64(round_salt) * np.uint64(0x9E3779B97F4A7C15)
+            z = (z ^ (z >> np.uint64(30))) * np.uint64(0xBF58476D1CE4E5B9)
+            z = (z ^ (z >> np.uint64(27))) * np.uint64(0x94D049BB133111EB)
+            words.append(z ^ (z >> np.uint64(31)))
+    raw = np.column_stack(words).astype('>u8').tobytes().hex()
+    return np.frombuffer(raw.encode(), dtype='S32').astype('U32')
+
+
+def _iso(timestamps):
+    """
+    Format datetime64 values the way the feed does, `YYYY-MM-DDTHH:MM:SS.sssZ`.
+    """
+    return np.char.add(np.datetime_as_string(timestamps, unit='ms'), 'Z')
+
+
+def generate_chunk(rng, size, key_count):
+    """
+    Generate one chunk of raw open house records.
+
+    Args:
+        rng (numpy.random.Generator): The seeded random generator of the chunk.
+        size (int): The number of records.
+        key_count (int): The number of distinct OpenHouseKeys in the whole feed.
+
+    Returns:
+        pandas.DataFrame: Raw records with the feed's columns, all as strings or None.
+    """
+    key_ids = rng.integers(0, key_count, size=size)
+    listing_ids = (key_ids / OPEN_HOUSES_PER_LISTING).astype(np.int64)
+
+    # Everything describing the open house itself derives from the key, so updates stay consistent
+    day = (key_ids * 2654435761 % (FEED_DAYS * 1000)) // 1000
+    date = FEED_START.astype('datetime64[D]') + day
+    start = date.astype('datetime64[ms]') + (16 + key_ids % 6).astype('timedelta64[h]')
+    end = start + (2 + key_ids % 2).astype('timedelta64[h]')
+    state_index = np.searchsorted(np.cumsum(STATE_WEIGHTS), (listing_ids % 1000) / 1000, side='right')
+    zipcode = (10000 + (listing_ids * 7919) % 89999).astype('U5')
+    zip_plus_four = (listing_ids * 2654435761 % 1000) < ZIP_PLUS_FOUR_RATE * 1000
+    zipcode = np.where(zip_plus_four, np.char.add(np.char.add(zipcode, '-'), (1000 + listing_ids % 9000).astype('U4')), zipcode)
+
+    # Updates land in the weeks before the open house, later updates simply have a later DateModified
+    modified = start - rng.integers(1, 21 * 24 * 3600 * 1000, size=size).astype('timedelta64[ms]')
+    start_text, end_text = _iso(start), _iso(end)
+    bad_time = rng.random(size) < BAD_TIME_RATE
+    start_text = np.where(bad_time, np.char.add((16 + key_ids % 6).astype('U2'), ':00'), start_text)
+    end_text = np.where(bad_time, np.char.add((18 + key_ids % 6).astype('U2'), ':00'), end_text)
+
+    keys = _hex_keys(key_ids, salt=1).astype(object)
+    keys[rng.random(size) < NULL_KEY_RATE] = None
+    return pd.DataFrame({
+        'OpenHouseMethod': np.where(rng.random(size) < VIRTUAL_RATE, 'Virtual', 'In Person'),
+        'OpenHouseEndTime': end_text,
+        'ListingKey': _hex_keys(listing_ids, salt=2),
+        'OpenHouseKey': keys,
+        'OpenHouseStartTime': start_text,
+        'OpenHouseDate': np.datetime_as_string(date, unit='D'),
+        'State': STATES[np.minimum(state_index, len(STATES) - 1)],
+        'Zipcode': zipcode,
+        'DateModified': _iso(modified),
+    })
+
+
+def generate_chunks(records, seed=0, chunk_size=CHUNK_SIZE):
+    """
+    Generate a synthetic feed of `records` raw records in chunks.
+
+    Args:
+        records (int): The total number of records.
+        seed (int, optional): The random seed, the same seed always gives the same feed, whatever the
+            chunk size. Defaults to 0.
+        chunk_size (int, optional): The number of records per chunk. Defaults to CHUNK_SIZE.
+
+    Yields:
+        pandas.DataFrame: Chunks of raw records.
+    """
+    key_count = max(1, int(records / UPDATES_PER_KEY))
+    blocks = (generate_chunk(np.random.default_rng([seed, index]), min(BLOCK_SIZE, records - offset), key_count)
+              for index, offset in enumerate(range(0, records, BLOCK_SIZE)))
+    pending = pd.DataFrame()
+    for block in blocks:
+        pending = pd.concat([pending, block], ignore_index=True) if len(pending) else block
+        while len(pending) >= chunk_size:
+            yield pending.iloc[:chunk_size]
+            pending = pending.iloc[chunk_size:].reset_index(drop=True)
+    if len(pending):
+        yield pending
+
+
+def write_feed(path, records, seed=0, chunk_size=CHUNK_SIZE):
+    """
+    Write a synthetic feed to `path` as a JSON array, like `data/openhouses.json`.
+
+    Args:
+        path (str): The output JSON file.
+        records (int): The total number of records.
+        seed (int, optional): The random seed. Defaults to 0.
+        chunk_size (int, optional): The number of records generated and written at a time.
+    """
+    with open(path, 'w') as file:
+        file.write('[')
+        for i, chunk in enumerate(generate_chunks(records, seed, chunk_size)):
+            if i:
+                file.write(',')
+            file.write(chunk.to_json(orient='records')[1:-1])
+        file.write(']')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('path', help='The JSON file to write.')
+    parser.add_argument('--records', type=int, default=1_000_000)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+    write_feed(args.path, args.records, args.seed)
+    print(f'Wrote {args.records} synthetic records to `{args.path}`.')
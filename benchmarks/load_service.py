@@ -0,0 +1,182 @@
+"""
+Load test the open house HTTP service with concurrent keep-alive clients, reporting latency and throughput.
+
+With `--data-path` the service is started in a child process on that data, so a run is self-contained
+and the clients do not share an event loop or the GIL with the service; otherwise the service already
+listening on `--host` and `--port` is loaded. Each client sends its next request as soon as the previous
+one is answered, cycling through the paths, until the duration is up.
+
+Usage (from the repository root):
+    python -m benchmarks.load_service --data-path data/processed_openhouses.parquet --concurrency 32
+    python -m benchmarks.load_service --port 8000 --duration 30 --paths '/top_zip_codes?n=10&state=CA'
+"""
+import argparse
+import asyncio
+import contextlib
+import itertools
+import json
+import signal
+import sys
+import time
+from collections import Counter
+
+import numpy as np
+
+DEFAULT_PATHS = [
+    '/week_most_open_houses',
+    '/top_zip_codes?n=5',
+    '/daily_cumulative_total',
+    '/top_zip_codes?n=10&state=CA',
+    '/week_most_open_houses?start_date=2023-03-01&end_date=2023-03-31',
+    '/daily_cumulative_total?zip_prefix=9',
+]
+
+
+async def request(reader, writer, host, path):
+    """
+    Send one GET request on an open keep-alive connection and read the response.
+
+    Args:
+        reader (asyncio.StreamReader): The connection's reader.
+        writer (asyncio.StreamWriter): The connection's writer.
+        host (str): The Host header.
+        path (str): The request target.
+
+    Returns:
+        tuple: The status code and the response body.
+    """
+    writer.write(f'GET {path} HTTP/1.1\r\nHost: {host}\r\n\r\n'.encode('latin-1'))
+    await writer.drain()
+    head = await reader.readuntil(b'\r\n\r\n')
+    status_line, *header_lines = head.decode('latin-1').split('\r\n')
+    headers = dict(line.split(':', 1) for line in header_lines if ':' in line)
+    headers = {name.strip().lower(): value.strip() for name, value in headers.items()}
+    body = await reader.readexactly(int(headers.get('content-length', 0)))
+    return int(status_line.split(' ')[1]), body
+
+
+async def _client(host, port, paths, offset, deadline, latencies, statuses):
+    reader, writer = await asyncio.open_connection(host, port)
+    try:
+        for i in itertools.count(offset):
+            start = time.perf_counter()
+            if start >= deadline:
+                return
+            status, _ = await request(reader, writer, host, paths[i % len(paths)])
+            latencies.append(time.perf_counter() - start)
+            statuses[status] += 1
+    finally:
+        writer.close()
+        await writer.wait_closed()
+
+
+async def run_load(host, port, paths=DEFAULT_PATHS, concurrency=16, duration=10.0):
+    """
+    Load a service with `concurrency` clients for `duration` seconds.
+
+    Args:
+        host (str): The service's host.
+        port (int): The service's port.
+        paths (list, optional): The request targets, spread over the clients. Defaults to DEFAULT_PATHS.
+        concurrency (int, optional): The number of clients, each with one request in flight. Defaults to 16.
+        duration (float, optional): The number of seconds to send requests for. Defaults to 10.0.
+
+    Returns:
+        dict: The number of requests, their rate, the p50, p99 and max latency and the count per status code.
+    """
+    latencies, statuses = [], Counter()
+    start = time.perf_counter()
+    await asyncio.gather(*(_client(host, port, paths, offset, start + duration, latencies, statuses)
+                           for offset in range(concurrency)))
+    seconds = time.perf_counter() - start
+    latencies_ms = np.array(latencies or [np.nan]) * 1000
+    return {
+        'requests': len(latencies),
+        'concurrency': concurrency,
+        'seconds': round(seconds, 3),
+        'requests_per_second': round(len(latencies) / seconds, 1),
+        'p50_ms': round(float(np.percentile(latencies_ms, 50)), 3),
+        'p99_ms': round(float(np.percentile(latencies_ms, 99)), 3),
+        'max_ms': round(float(latencies_ms.max()), 3),
+        'statuses': {str(status): count for status, count in sorted(statuses.items())},
+    }
+
+
+@contextlib.asynccontextmanager
+async def service_process(data_path, host='127.0.0.1', scan=False, workers=4):
+    """
+    Run the service on a free port in a child process, interrupting it on exit.
+
+    Args:
+        data_path (str): The cleaned open house data in Parquet format.
+        host (str, optional): The host to listen on. Defaults to '127.0.0.1'.
+        scan (bool, optional): Whether the service scans the Parquet data. Defaults to False.
+        workers (int, optional): The number of queries the service runs at once. Defaults to 4.
+
+    Yields:
+        int: The port the service listens on.
+    """
+    command = [sys.executable, '-u', '-m', 'src.open_house_service', data_path, '--host', host, '--port', '0',
+               '--workers', str(workers)] + (['--scan'] if scan else [])
+    process = await asyncio.create_subprocess_exec(*command, stdout=asyncio.subprocess.PIPE)
+    output = None
+    try:
+        line = b''
+        while not line.startswith(b'Serving'):
+            line = await process.stdout.readline()
+            if not line:
+                raise RuntimeError(f'The service exited with code {await process.wait()} before listening.')
+        # Keep reading what the service prints, so it never blocks on a full pipe
+        output = asyncio.create_task(process.stdout.read())
+        yield int(line.rsplit(b':', 1)[1])
+    finally:
+        if process.returncode is None:
+            process.send_signal(signal.SIGINT)
+        await process.wait()
+        if output is not None:
+            await output
+
+
+async def _load(args, port):
+    # Send each request once before timing, so loading the data does not dominate the tail latency
+    reader, writer = await asyncio.open_connection(args.host, port)
+    try:
+        for path in args.paths:
+            await request(reader, writer, args.host, path)
+        report = await run_load(args.host, port, args.paths, args.concurrency, args.duration)
+        if args.data_path:
+            report['service'] = json.loads((await request(reader, writer, args.host, '/stats'))[1])
+    finally:
+        writer.close()
+        await writer.wait_closed()
+    return report
+
+
+async def main(args):
+    if not args.data_path:
+        return await _load(args, args.port)
+    async with service_process(args.data_path, args.host, args.scan, args.workers) as port:
+        return await _load(args, port)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--data-path', help='Start the service in a child process on this data.')
+    parser.add_argument('--scan', action='store_true', help='Have the started service scan the Parquet data.')
+    parser.add_argument('--workers', type=int, default=4, help='Query workers of the started service.')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8000, help='The port of an already running service.')
+    parser.add_argument('--paths', nargs='+', default=DEFAULT_PATHS)
+    parser.add_argument('--concurrency', type=int, default=16)
+    parser.add_argument('--duration', type=float, default=10.0)
+    parser.add_argument('--output', help='A JSON file to save the report to.')
+    cli_args = parser.parse_args()
+
+    load_report = asyncio.run(main(cli_args))
+    print(f'{load_report["requests"]} requests in {load_report["seconds"]}s from {cli_args.concurrency} clients: '
+          f'{load_report["requests_per_second"]} req/s, p50 {load_report["p50_ms"]} ms, '
+          f'p99 {load_report["p99_ms"]} ms, max {load_report["max_ms"]} ms, statuses {load_report["statuses"]}')
+    if cli_args.output:
+        with open(cli_args.output, 'w') as file:
+            json.dump(load_report, file, indent=2)
+        print(f'Saved report to `{cli_args.output}`.')
@@ -0,0 +1,224 @@
+"""
+Benchmark OpenHouseProcessor and the OpenHouseDashboard queries on synthetic feeds of growing size.
+
+For each size a seeded feed is generated (and reused on later runs), then the read, process and
+write stages and each dashboard query are timed. Every measurement records wall time, throughput
+and the peak RSS of the process while it ran. Results are saved as JSON and can be compared with
+the results of another commit.
+
+Each stage holds the feed or the cleaned records in memory, as does the pandas dashboard, so sizes
+are bounded by the memory of the machine, even with the duckdb engine.
+
+Usage (from the repository root):
+    python -m benchmarks.run_benchmarks --sizes 1000000 10000000 --output results.json
+    python -m benchmarks.run_benchmarks --sizes 1000000 --compare baseline.json
+"""
+import argparse
+import datetime
+import json
+import os
+import platform
+import subprocess
+import threading
+import time
+
+import pandas as pd
+
+from benchmarks.generate_openhouses import write_feed
+from src.open_house_dashboard import OpenHouseDashboard
+from src.open_house_processor import OpenHouseProcessor, current_rss
+
+DEFAULT_SIZES = [1_000_000, 10_000_000]
+
+
+class Measure:
+    """
+    A context manager timing a block and sampling the peak RSS of the process while it runs.
+
+    Attributes:
+        seconds (float): The wall time of the block.
+        peak_rss (int): The highest RSS sampled during the block, in bytes.
+    """
+
+    def __init__(self, interval=0.01):
+        """
+        Initialize the Measure.
+
+        Args:
+            interval (float, optional): Seconds between RSS samples. Defaults to 0.01.
+        """
+        self.interval = interval
+        self.seconds = None
+        self.peak_rss = 0
+        self._done = threading.Event()
+
+    def _sample(self):
+        while not self._done.wait(self.interval):
+            self.peak_rss = max(self.peak_rss, current_rss())
+
+    def __enter__(self):
+        self.peak_rss = current_rss()
+        self._thread = threading.Thread(target=self._sample, daemon=True)
+        self._thread.start()
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.seconds = time.perf_counter() - self._start
+        self._done.set()
+        self._thread.join()
+        self.peak_rss = max(self.peak_rss, current_rss())
+
+
+def _result(name, rows, measure):
+    return {
+        'name': name,
+        'rows': rows,
+        'seconds': round(measure.seconds, 4),
+        'rows_per_second': round(rows / measure.seconds) if measure.seconds else None,
+        'peak_rss_mib': round(measure.peak_rss / 2 ** 20, 1),
+    }
+
+
+def benchmark_size(records, work_dir, seed=0, **processor_options):
+    """
+    Benchmark the processor stages and the dashboard queries on one synthetic feed.
+
+    Args:
+        records (int): The number of raw records in the feed.
+        work_dir (str): The directory holding generated feeds and outputs.
+        seed (int, optional): The feed's random seed. Defaults to 0.
+        **processor_options: Extra keyword arguments for OpenHouseProcessor, e.g. `workers`.
+
+    Returns:
+        list: One result per stage and query.
+    """
+    input_path = os.path.join(work_dir, f'openhouses_{records}_{seed}.json')
+    if not os.path.exists(input_path):
+        write_feed(input_path, records, seed)
+    output_path = os.path.join(work_dir, f'processed_{records}_{seed}.parquet')
+    processor = OpenHouseProcessor(input_path, output_path, **processor_options)
+
+    results = []
+    if processor.engine == 'duckdb':
+        # The out-of-core engine reads, cleans and writes in one pass, so it is timed as a whole
+        with Measure() as measure:
+            processor.process_out_of_core()
+        results.append(_result('process_out_of_core', records, measure))
+        cleaned = pd.read_parquet(output_path)
+    else:
+        with Measure() as measure:
+            data = processor.read_table() if processor.engine == 'arrow' else processor.read_data()
+        results.append(_result('read', records, measure))
+        with Measure() as measure:
+            if processor.engine == 'arrow':
+                cleaned = processor.process_table(data)
+            elif processor.workers > 1:
+                cleaned = processor.process_data_parallel(data)
+            else:
+                cleaned = processor.process_data(data)
+        results.append(_result('process', records, measure))
+        del data
+        with Measure() as measure:
+            processor.write_data(cleaned)
+        results.append(_result('write', len(cleaned), measure))
+    with Measure() as measure:
+        processor.write_sketches(cleaned)
+    results.append(_result('sketches', len(cleaned), measure))
+    del cleaned
+
+    # The output was just rewritten, so any snapshot of an earlier run is stale until one is written here
+    for mode in ('pandas', 'scan', 'snapshot'):
+        if mode == 'snapshot':
+            with Measure() as measure:
+                processor.write_snapshot()
+            results.append(_result('snapshot', records, measure))
+        with Measure() as measure:
+            dashboard = OpenHouseDashboard(output_path, scan=mode == 'scan', approximate=True)
+        results.append(_result(f'dashboard_{mode}_load', records, measure))
+        queries = {
+            'week_most_open_houses': (dashboard.get_week_most_open_houses_query(), None),
+            'top_zip_codes': dashboard.get_top_zip_codes_query(zip5=dashboard.compact),
+            'daily_cumulative_total': (dashboard.get_daily_cumulative_total_query(), None),
+            'distinct_listings': dashboard.get_distinct_listings_query(zip5=dashboard.compact),
+        }
+        for name, (sql, params) in queries.items():
+            with Measure() as measure:
+                dashboard._query(sql, params)
+            results.append(_result(f'dashboard_{mode}_{name}', records, measure))
+        approximate = {
+            'top_zip_codes_approximate': dashboard.get_top_zip_codes_approximate,
+            'distinct_listings_approximate': dashboard.get_distinct_listings_approximate,
+        }
+        for name, answer in approximate.items():
+            with Measure() as measure:
+                answer()
+            results.append(_result(f'dashboard_{mode}_{name}', records, measure))
+        dashboard.close()
+
+    for result in results:
+        result['records'] = records
+    return results
+
+
+def _git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(current, baseline):
+    """
+    Print the wall time of each benchmark relative to a baseline run.
+
+    Args:
+        current (dict): The results of this run.
+        baseline (dict): The results of an earlier run, e.g. from another commit.
+    """
+    previous = {(r['records'], r['name']): r for r in baseline['results']}
+    print(f'Compared with commit {baseline.get("commit")}:')
+    for result in current['results']:
+        before = previous.get((result['records'], result['name']))
+        if before and before['seconds']:
+            ratio = result['seconds'] / before['seconds']
+            print(f'  {result["records"]:>11,} {result["name"]:<45} {before["seconds"]:>9.3f}s -> '
+                  f'{result["seconds"]:>9.3f}s ({ratio:.2f}x)')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--sizes', type=int, nargs='+', default=DEFAULT_SIZES)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--workers', type=int, default=1)
+    parser.add_argument('--compact', action='store_true', help='Process into the compact schema.')
+    parser.add_argument('--engine', choices=['pandas', 'arrow', 'duckdb'], default='pandas')
+    parser.add_argument('--memory-limit', default='1GB', help='DuckDB\'s memory limit in the duckdb engine.')
+    parser.add_argument('--work-dir', default=os.path.join('data', 'benchmarks'))
+    parser.add_argument('--output', default='benchmark_results.json')
+    parser.add_argument('--compare', help='A results JSON file from an earlier run to compare against.')
+    args = parser.parse_args()
+
+    os.makedirs(args.work_dir, exist_ok=True)
+    report = {
+        'commit': _git_commit(),
+        'created': datetime.datetime.now(datetime.timezone.utc).isoformat(),
+        'python': platform.python_version(),
+        'cpu_count': os.cpu_count(),
+        'results': [],
+    }
+    for size in args.sizes:
+        options = {'workers': args.workers, 'compact': args.compact, 'engine': args.engine}
+        if args.engine == 'duckdb':
+            options['memory_limit'] = args.memory_limit
+        for result in benchmark_size(size, args.work_dir, args.seed, **options):
+            report['results'].append(result)
+            print(f'{size:>11,} {result["name"]:<45} {result["seconds"]:>9.3f}s '
+                  f'{result["peak_rss_mib"]:>9.1f} MiB')
+    with open(args.output, 'w') as file:
+        json.dump(report, file, indent=2)
+    print(f'Saved results to `{args.output}`.')
+
+    if args.compare:
+        with open(args.compare) as file:
+            compare(report, json.load(file))
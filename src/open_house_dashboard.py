@@ -1,9 +1,670 @@
+import argparse
+import functools
+import hashlib
+import json
 import os
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from concurrent.futures import Future, ThreadPoolExecutor, as_completed
 
 import duckdb
+import numpy as np
 import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
 import streamlit as st
 
+try:
+    from src.open_house_layout import (
+        DATA_FILES_KEY, DISTINCT_LISTINGS_FILE, MONTH_COLUMN, SNAPSHOT_FILE, TOP_ZIPCODES_FILE, ZIP_PLUS4_COLUMN,
+        data_fingerprint, is_current, parquet_files, read_manifest, rollup_path,
+    )
+except ImportError:  # Run by `streamlit run` from this directory, which puts only the directory itself on the path
+    from open_house_layout import (
+        DATA_FILES_KEY, DISTINCT_LISTINGS_FILE, MONTH_COLUMN, SNAPSHOT_FILE, TOP_ZIPCODES_FILE, ZIP_PLUS4_COLUMN,
+        data_fingerprint, is_current, parquet_files, read_manifest, rollup_path,
+    )
+
+# Columns of the cleaned data the dashboard's queries use, which a dataset without any files yet is given
+QUERIED_COLUMNS = ['OpenHouseDate', 'State', 'Zipcode', 'ListingKey']
+
+# Parquet data larger than this is scanned by the app rather than loaded into memory, see `prefers_scan`
+SCAN_THRESHOLD_BYTES = 256 * 2 ** 20
+
+
+def load_snapshot(data_path):
+    """
+    Memory-map the processor's Arrow IPC snapshot of a dataset, if it was taken from the current data files.
+
+    The returned table references the mapped file rather than copying it, so loading takes no time
+    whatever the size of the data, and processes mapping the same snapshot share its pages in the page cache.
+
+    Args:
+        data_path (str): The path to a single Parquet file or a dataset directory.
+
+    Returns:
+        pyarrow.Table: The snapshot, or None if it is missing or stale.
+    """
+    path = os.path.join(rollup_path(data_path), SNAPSHOT_FILE)
+    if not os.path.exists(path):
+        return None
+    reader = pa.ipc.open_file(pa.memory_map(path))
+    taken_from = (reader.schema.metadata or {}).get(DATA_FILES_KEY.encode())
+    if taken_from is None or json.loads(taken_from) != data_fingerprint(data_path):
+        return None
+    return reader.read_all()
+
+
+def dataset_version(data_path):
+    """
+    Fingerprint the files behind a dataset path, including its rollups and snapshot, from their names, sizes
+    and mtimes.
+
+    Any write by the processor changes at least one of these, so the fingerprint changes with every refresh.
+
+    Args:
+        data_path (str): The path to a single Parquet file or a dataset directory.
+
+    Returns:
+        str: A hex digest identifying the current version of the dataset.
+    """
+    files = parquet_files(data_path)
+    if os.path.isdir(rollup_path(data_path)):
+        files += parquet_files(rollup_path(data_path))
+        snapshot = os.path.join(rollup_path(data_path), SNAPSHOT_FILE)
+        if os.path.exists(snapshot):
+            files.append(snapshot)
+    digest = hashlib.sha1()
+    for path in files:
+        stat = os.stat(path)
+        digest.update(f'{path}:{stat.st_size}:{stat.st_mtime_ns};'.encode())
+    return digest.hexdigest()
+
+
+class QueryCache:
+    """
+    A thread-safe, size bounded LRU cache of query results keyed by SQL text, parameters and dataset version.
+
+    One cache is meant to be shared by every dashboard in the process, so concurrent viewers of the same
+    dataset version run each query once: a lookup of a query that is already running waits for its result
+    instead of running it again. When a dashboard on a new version registers it with `set_version`, the
+    entries of the old version are dropped, and results of any other version than the registered one are
+    handed to their callers but not kept.
+
+    Attributes:
+        maxsize (int): The maximum number of results kept.
+        version (str): The latest dataset version registered with the cache.
+        hits (int): The number of lookups answered from the cache.
+        misses (int): The number of lookups that had to run the query.
+        coalesced (int): The number of lookups that waited for the same query already running.
+        evictions (int): The number of results dropped to stay within `maxsize`.
+        invalidations (int): The number of results dropped because a new dataset version landed.
+    """
+
+    def __init__(self, maxsize=128):
+        """
+        Initialize an empty QueryCache.
+
+        Args:
+            maxsize (int, optional): The maximum number of results kept. Defaults to 128.
+        """
+        self.maxsize = maxsize
+        self.version = None
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.evictions = 0
+        self.invalidations = 0
+        self._entries = OrderedDict()
+        self._in_flight = {}
+        self._lock = threading.Lock()
+
+    def set_version(self, version):
+        """
+        Register the current dataset version, dropping cached results of any other version.
+
+        Args:
+            version (str): The dataset version, e.g. from `dataset_version`.
+        """
+        with self._lock:
+            if version == self.version:
+                return
+            self.version = version
+            stale = [key for key in self._entries if key[0] != version]
+            for key in stale:
+                del self._entries[key]
+            self.invalidations += len(stale)
+
+    def get_or_compute(self, version, sql, params, compute):
+        """
+        Return the cached result for a query, running `compute` to produce it on a miss, or waiting for the
+        caller already running it.
+
+        Args:
+            version (str): The dataset version the query runs against.
+            sql (str): The SQL query text.
+            params (list): The bound parameters of the query, or None.
+            compute (callable): A function with no arguments that runs the query and returns a DataFrame.
+
+        Returns:
+            pandas.DataFrame: A copy of the query result.
+
+        Raises:
+            Exception: Whatever `compute` raised, to its caller and to every lookup waiting for it.
+        """
+        key = (version, sql, tuple(params) if params is not None else None)
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return self._entries[key].copy()
+            future = self._in_flight.get(key)
+            running = future is None
+            if running:
+                self.misses += 1
+                future = self._in_flight[key] = Future()
+            else:
+                self.coalesced += 1
+        if not running:
+            return future.result().copy()
+
+        try:
+            result = compute()
+        except BaseException as error:
+            with self._lock:
+                del self._in_flight[key]
+            future.set_exception(error)
+            raise
+        with self._lock:
+            del self._in_flight[key]
+            # A result of a version replaced while the query ran is not kept, it would never be looked up again
+            if version == self.version:
+                self._entries[key] = result
+                self._entries.move_to_end(key)
+                while len(self._entries) > self.maxsize:
+                    self._entries.popitem(last=False)
+                    self.evictions += 1
+        future.set_result(result)
+        return result.copy()
+
+    def stats(self):
+        """
+        Get the cache counters.
+
+        Returns:
+            dict: The hits, misses, coalesced lookups, evictions, invalidations and current size of the cache.
+        """
+        with self._lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'coalesced': self.coalesced,
+                'evictions': self.evictions,
+                'invalidations': self.invalidations,
+                'size': len(self._entries),
+            }
+
+
+class QueryMetrics:
+    """
+    A query hook recording the latency of each dashboard query, exportable as a Prometheus textfile.
+
+    Register it with `OpenHouseDashboard.add_query_hook`. One instance can be shared by many dashboards.
+
+    Attributes:
+        latencies (dict): For each query name, its count, total seconds and max seconds.
+    """
+
+    def __init__(self):
+        """
+        Initialize empty QueryMetrics.
+        """
+        self.latencies = {}
+        self._lock = threading.Lock()
+
+    def __call__(self, name, sql, seconds):
+        """
+        Record one query execution.
+
+        Args:
+            name (str): The query name.
+            sql (str): The SQL text of the query.
+            seconds (float): The latency of the query, including cache lookups.
+        """
+        with self._lock:
+            latency = self.latencies.setdefault(name, {'count': 0, 'seconds': 0.0, 'max_seconds': 0.0})
+            latency['count'] += 1
+            latency['seconds'] += seconds
+            latency['max_seconds'] = max(latency['max_seconds'], seconds)
+
+    def write_prometheus(self, path, prefix='openhouse_dashboard'):
+        """
+        Atomically write the query latencies in the Prometheus text format, for the node exporter's textfile collector.
+
+        Args:
+            path (str): The `.prom` file to write.
+            prefix (str, optional): The metric name prefix. Defaults to 'openhouse_dashboard'.
+        """
+        with self._lock:
+            latencies = {name: dict(latency) for name, latency in self.latencies.items()}
+        lines = [f'# HELP {prefix}_query_seconds Latency of dashboard queries.',
+                 f'# TYPE {prefix}_query_seconds summary']
+        for name, latency in sorted(latencies.items()):
+            lines += [f'{prefix}_query_seconds_count{{query="{name}"}} {latency["count"]}',
+                      f'{prefix}_query_seconds_sum{{query="{name}"}} {latency["seconds"]}']
+        lines += [f'# HELP {prefix}_query_max_seconds Slowest run of each dashboard query.',
+                  f'# TYPE {prefix}_query_max_seconds gauge']
+        lines += [f'{prefix}_query_max_seconds{{query="{name}"}} {latency["max_seconds"]}'
+                  for name, latency in sorted(latencies.items())]
+        with open(f'{path}.tmp', 'w') as file:
+            file.write('\n'.join(lines) + '\n')
+        os.replace(f'{path}.tmp', path)
+
+
+def parquet_scan(data_path):
+    """
+    Build a DuckDB `read_parquet` table function call over the Parquet data behind a dataset path.
+
+    Hive partition directories (like `State=CA`) are exposed as columns so filters on them prune files.
+    The files are listed when the call is built, so a view over it reads the same files until it is
+    rebuilt. A dataset without any files yet is scanned as an empty relation with the queried columns.
+
+    Args:
+        data_path (str): The path to a single Parquet file or a dataset directory.
+
+    Returns:
+        str: The SQL table function call, or subquery if there are no files.
+    """
+    files = parquet_files(data_path)
+    if not files:
+        columns = ', '.join(f'CAST(NULL AS VARCHAR) AS {column}' for column in QUERIED_COLUMNS)
+        return f'(SELECT {columns} WHERE FALSE)'
+    file_list = ', '.join("'{}'".format(path.replace("'", "''")) for path in files)
+    hive = any('=' in os.path.relpath(path, data_path) for path in files)
+    return f'read_parquet([{file_list}], hive_partitioning={int(hive)})'
+
+
+def prefers_scan(data_path, threshold_bytes=SCAN_THRESHOLD_BYTES):
+    """
+    Decide whether a dataset is better scanned from Parquet than loaded into memory.
+
+    Filters on a hive partitioned dataset skip whole partitions only when it is scanned, and a large dataset
+    would take its size in memory several times over once loaded into pandas.
+
+    Args:
+        data_path (str): The path to a single Parquet file or a dataset directory.
+        threshold_bytes (int, optional): The size of Parquet data above which it is scanned.
+            Defaults to SCAN_THRESHOLD_BYTES.
+
+    Returns:
+        bool: Whether the dataset is partitioned or its data files are larger than `threshold_bytes`.
+    """
+    files = [path for path in parquet_files(data_path) if os.path.exists(path)]
+    if any('=' in os.path.relpath(path, data_path) for path in files):
+        return True
+    return sum(os.path.getsize(path) for path in files) > threshold_bytes
+
+
+def app_dataset_manager(argv=None, data_path=None):
+    """
+    Create the DatasetManager of the Streamlit app from its command line, given after `--`, as in
+    `streamlit run src/open_house_dashboard.py -- data/processed --scan on`.
+
+    `--scan auto`, the default, scans the data when `prefers_scan` says so, `on` and `off` force either mode.
+
+    Args:
+        argv (list, optional): The command line arguments. Defaults to None, which reads `sys.argv`.
+        data_path (str, optional): The data used when the command line names none. Defaults to None.
+
+    Returns:
+        DatasetManager: The manager of the chosen data, in the chosen mode.
+    """
+    parser = argparse.ArgumentParser(description='Open House Dashboard')
+    parser.add_argument('data_path', nargs='?', default=data_path,
+                        help='The cleaned open house data in Parquet format.')
+    parser.add_argument('--scan', choices=['auto', 'on', 'off'], default='auto',
+                        help='Scan the Parquet data instead of loading it, by default when partitioned or large.')
+    args = parser.parse_args(argv)
+    scan = prefers_scan(args.data_path) if args.scan == 'auto' else args.scan == 'on'
+    return DatasetManager(args.data_path, scan=scan)
+
+
+def hll_estimate(registers, precision):
+    """
+    Estimate distinct counts from sparse HyperLogLog registers, with the small range correction.
+
+    Args:
+        registers (pandas.DataFrame): The highest `Rank` of each set `Register`, per group of `Dimension`
+            and `Value`. Registers that are not listed are zero.
+        precision (int): The number of register bits the registers were built with.
+
+    Returns:
+        pandas.Series: The estimated distinct count per `Dimension` and `Value`.
+    """
+    m = 1 << precision
+    alpha = 0.7213 / (1 + 1.079 / m)
+    weights = registers.assign(Weight=np.exp2(-registers['Rank'].astype(np.float64)))
+    stats = weights.groupby(['Dimension', 'Value'])['Weight'].agg(['size', 'sum'])
+    zeros = m - stats['size']
+    raw = alpha * m * m / (zeros + stats['sum'])
+    # Linear counting is more accurate while many registers are still empty
+    small = (raw <= 2.5 * m) & (zeros > 0)
+    linear = m * np.log(m / zeros.clip(lower=1))
+    return raw.where(~small, linear).round().astype(np.int64)
+
+
+class Sketches:
+    """
+    The processor's sketches of a dataset, loaded into memory once so approximate queries never touch the data.
+
+    Attributes:
+        top_zipcodes (pandas.DataFrame): The `OpenHouseCount` of each counted 5-digit `Zipcode`, most frequent
+            first, with `MinOpenHouseCount`. The true count lies between the two.
+        total (int): The number of open houses the zip code counters summarize.
+        floor (int): The most open houses a zip code without a counter can have.
+        distinct_listings (dict): For `Zipcode` and `StartOfWeek`, the estimated `DistinctListings` per value,
+            largest first.
+        relative_error (float): The standard error of the distinct listing estimates, relative to the count.
+    """
+
+    def __init__(self, top_zipcodes_path, distinct_listings_path):
+        """
+        Load the sketches and work out every answer they hold.
+
+        Args:
+            top_zipcodes_path (str): The path to the Space-Saving zip code counters.
+            distinct_listings_path (str): The path to the sparse HyperLogLog registers of distinct listings.
+        """
+        table = pq.read_table(top_zipcodes_path)
+        self.total = int(table.schema.metadata[b'total'])
+        self.floor = int(table.schema.metadata[b'floor'])
+        counters = table.to_pandas()
+        self.top_zipcodes = pd.DataFrame({
+            'Zipcode': counters['Value'],
+            'OpenHouseCount': counters['Count'],
+            'MinOpenHouseCount': counters['Count'] - counters['Error'],
+        })
+
+        table = pq.read_table(distinct_listings_path)
+        precision = int(table.schema.metadata[b'precision'])
+        self.relative_error = 1.04 / np.sqrt(1 << precision)
+        estimates = hll_estimate(table.to_pandas(), precision).rename('DistinctListings')
+        self.distinct_listings = {
+            dimension: (estimates.xs(dimension, level='Dimension').rename_axis(dimension).reset_index()
+                        .sort_values(['DistinctListings', dimension], ascending=[False, True], ignore_index=True))
+            for dimension in ('Zipcode', 'StartOfWeek')
+            if dimension in estimates.index.get_level_values('Dimension')
+        }
+
+
+class OpenHouseDataset:
+    """
+    One loaded version of the cleaned open house data: a DuckDB database with the `openhouses` view and
+    any rollup views, plus a bounded pool of cursors on it.
+
+    Loading is the expensive part of a dashboard, so a dataset is meant to be shared, either owned by a
+    single dashboard or handed out to many by a DatasetManager.
+
+    Attributes:
+        data_path (str): The path to the cleaned open house data in Parquet format.
+        scan (bool): Whether DuckDB scans the Parquet data directly instead of loading it into pandas.
+        version (str): The version of the data that was loaded, or last scanned, if it was fingerprinted.
+        con (duckdb.DuckDBPyConnection): The connection owning the database.
+        df (pandas.DataFrame): The loaded data, or None in scan mode or when loaded from a snapshot.
+        snapshot (pyarrow.Table): The memory-mapped snapshot of the data, if a current one was found.
+        columns (list): The columns of the `openhouses` view.
+        compact (bool): Whether the data uses the processor's compact schema, with 5-digit zip codes.
+        rollups (bool): Whether current pre-aggregated rollups were found next to the data and are queried
+            instead, loaded into tables unless the data is scanned.
+        sketches (Sketches): The processor's sketches of the current data found next to it, if any.
+        max_cursors (int): The most cursors in use at once; further requests wait for one to be returned.
+        users (int): The number of dashboards a DatasetManager has handed this dataset to and not got back.
+        retired (bool): Whether a DatasetManager has swapped in a newer version, so the dataset is closed
+            once its last user releases it.
+    """
+
+    # Rollup files the processor writes and the views they are exposed as
+    ROLLUP_VIEWS = {
+        'daily': 'openhouses_daily',
+        'weekly': 'openhouses_weekly',
+        'zipcode': 'openhouses_zipcode',
+    }
+
+    def __init__(self, data_path, scan=False, max_cursors=4, version=None):
+        """
+        Load the cleaned open house data into a new in-memory DuckDB database.
+
+        Args:
+            data_path (str): The path to the cleaned open house data in Parquet format, either a single
+                file or a dataset directory written by the processor.
+            scan (bool, optional): Whether to point the `openhouses` view at the Parquet data through
+                DuckDB's native scanner. Queries then only read the columns and row groups they need
+                and nothing is materialized up front. Defaults to False, which memory-maps the processor's
+                snapshot with `load_snapshot` when it is current, and otherwise loads it into pandas.
+            max_cursors (int, optional): The size of the cursor pool. Defaults to 4.
+            version (str, optional): The `dataset_version` of the data, taken by the caller before
+                loading so a refresh landing mid-load is never mistaken for this version.
+        """
+        if max_cursors < 1:
+            raise ValueError(f'max_cursors must be at least 1, got {max_cursors}.')
+        self.data_path = data_path
+        self.scan = scan
+        self.version = version
+        self.max_cursors = max_cursors
+        self.users = 0
+        self.retired = False
+        self.con = duckdb.connect(database=':memory:', read_only=False)
+        self.df = None
+        self.snapshot = None if scan else load_snapshot(data_path)
+        if scan:
+            self.con.execute(f'CREATE VIEW openhouses AS SELECT * FROM {parquet_scan(data_path)}')
+        elif self.snapshot is not None:
+            self.con.register("openhouses", self.snapshot)
+        else:
+            # The files of an incremental dataset come from its manifest, other datasets are read whole so
+            # their hive partition directories become columns
+            incremental = os.path.isdir(data_path) and read_manifest(data_path) is not None
+            self.df = pd.read_parquet(parquet_files(data_path) if incremental else data_path)
+            # DuckDB rebuilds an ENUM from a registered categorical on every query, which for thousands of
+            # zip codes costs more than scanning strings, so compact data is queried as plain strings
+            for column in self.df.select_dtypes('category'):
+                self.df[column] = self.df[column].astype(object)
+            self.con.register("openhouses", self.df)
+        self.columns = [row[0] for row in self.con.execute('DESCRIBE openhouses').fetchall()]
+        self.compact = ZIP_PLUS4_COLUMN in self.columns
+
+        # Answer the dashboard from the processor's rollups when they summarize the current data files
+        rollup_files = {name: os.path.join(rollup_path(data_path), f'{name}.parquet') for name in self.ROLLUP_VIEWS}
+        self.rollups = all(os.path.exists(path) for path in rollup_files.values())
+        if self.rollups:
+            fingerprint = data_fingerprint(data_path)
+            self.rollups = all(is_current(path, fingerprint) for path in rollup_files.values())
+        if self.rollups:
+            # Rollups are rewritten in place, so a loaded version keeps its own copy
+            relation = 'VIEW' if scan else 'TABLE'
+            for name, view in self.ROLLUP_VIEWS.items():
+                self.con.execute(f'CREATE {relation} {view} AS SELECT * FROM {parquet_scan(rollup_files[name])}')
+        sketch_files = [os.path.join(rollup_path(data_path), name)
+                        for name in (TOP_ZIPCODES_FILE, DISTINCT_LISTINGS_FILE)]
+        self.sketches = None
+        if all(os.path.exists(path) for path in sketch_files):
+            fingerprint = data_fingerprint(data_path)
+            if all(is_current(path, fingerprint) for path in sketch_files):
+                self.sketches = Sketches(*sketch_files)
+
+        self._slots = threading.BoundedSemaphore(max_cursors)
+        self._idle = []
+        self._lock = threading.Lock()
+
+    def rescan(self):
+        """
+        Point the `openhouses` view of a scanned dataset at the data files as they are now.
+
+        The view reads the files listed when it was created, so once the processor replaces them, e.g.
+        when an incremental dataset merges its part files, queries fail until the view is rebuilt. The
+        version is taken again first, if the dataset was fingerprinted.
+        """
+        with self._lock:
+            if self.version is not None:
+                self.version = dataset_version(self.data_path)
+            self.con.execute(f'CREATE OR REPLACE VIEW openhouses AS SELECT * FROM {parquet_scan(self.data_path)}')
+
+    @contextmanager
+    def cursor(self):
+        """
+        Borrow a cursor from the pool for the duration of a `with` block, waiting while all are in use.
+
+        Cursors are kept open and reused, so a registered DataFrame is only registered once per cursor.
+
+        Yields:
+            duckdb.DuckDBPyConnection: A cursor on the dataset's database, for use by one thread at a time.
+        """
+        self._slots.acquire()
+        try:
+            with self._lock:
+                cursor = self._idle.pop() if self._idle else None
+            if cursor is None:
+                cursor = self.con.cursor()
+                # Views are shared by every cursor on the database, but a registered DataFrame only by its connection
+                if self.df is not None:
+                    cursor.register("openhouses", self.df)
+                elif self.snapshot is not None:
+                    cursor.register("openhouses", self.snapshot)
+            try:
+                yield cursor
+            finally:
+                with self._lock:
+                    self._idle.append(cursor)
+        finally:
+            self._slots.release()
+
+    def close(self):
+        """
+        Close the pooled cursors and the DuckDB connection.
+        """
+        with self._lock:
+            for cursor in self._idle:
+                cursor.close()
+            self._idle = []
+        self.con.close()
+
+
+class DatasetManager:
+    """
+    A process-wide holder of the loaded open house data, shared by every dashboard in the process.
+
+    The data is loaded once and handed to each dashboard as it starts, rather than loaded per session.
+    Queries run on cursors from the dataset's bounded pool, so the number of queries running at once in
+    the process is capped however many sessions are open. When the processor writes a new version of
+    the data, the next dashboard to start loads it and swaps it in; a replaced version is closed once its
+    last dashboard is done. A loaded dataset holds its data, rollups and sketches in memory, so dashboards
+    already running keep querying the version they started with. A scanned one reads the Parquet files on
+    every query, so dashboards already running move on to the new files, see `OpenHouseDashboard._query`.
+
+    Attributes:
+        data_path (str): The path to the cleaned open house data in Parquet format.
+        scan (bool): Whether datasets are scanned from Parquet instead of loaded into pandas.
+        max_cursors (int): The size of each dataset's cursor pool.
+        check_interval (float): The least number of seconds between checks for a new version of the data.
+        loads (int): The number of versions loaded so far.
+    """
+
+    def __init__(self, data_path, scan=False, max_cursors=4, check_interval=1.0):
+        """
+        Initialize the DatasetManager. Nothing is loaded until the first `acquire`.
+
+        Args:
+            data_path (str): The path to the cleaned open house data in Parquet format.
+            scan (bool, optional): Whether to scan the Parquet data instead of loading it into pandas.
+                Defaults to False.
+            max_cursors (int, optional): The most queries running at once on a dataset. Defaults to 4.
+            check_interval (float, optional): The least number of seconds between checks for a new
+                version of the data, which lists and stats every file. Defaults to 1.0.
+        """
+        self.data_path = data_path
+        self.scan = scan
+        self.max_cursors = max_cursors
+        self.check_interval = check_interval
+        self.loads = 0
+        self._current = None
+        self._checked = None
+        self._lock = threading.Lock()
+        self._load_lock = threading.Lock()
+
+    def acquire(self, check=True):
+        """
+        Hand out the latest loaded dataset, loading it first if there is none or the data has changed.
+
+        Args:
+            check (bool, optional): Whether to check for a new version of the data first, see `refresh`.
+                Defaults to True; callers running `refresh` on a timer of their own pass False, which
+                only loads the data if nothing is loaded yet.
+
+        Returns:
+            OpenHouseDataset: The dataset, to be given back with `release` when done.
+        """
+        if check or self._current is None:
+            self.refresh()
+        with self._lock:
+            dataset = self._current
+            dataset.users += 1
+        return dataset
+
+    def release(self, dataset):
+        """
+        Give back a dataset from `acquire`, closing it if it was replaced and this was its last user.
+
+        Args:
+            dataset (OpenHouseDataset): The dataset to release.
+        """
+        with self._lock:
+            dataset.users -= 1
+            closing = dataset.retired and dataset.users == 0
+        if closing:
+            dataset.close()
+
+    def refresh(self):
+        """
+        Load the data and swap it in if it changed since the last check, checking at most every
+        `check_interval` seconds.
+        """
+        now = time.monotonic()
+        with self._lock:
+            if self._current is not None and now - self._checked < self.check_interval:
+                return
+            self._checked = now
+        # One thread loads a new version while the others keep using the current one, if there is one yet
+        if not self._load_lock.acquire(blocking=self._current is None):
+            return
+        try:
+            # Fingerprint before loading, so a refresh landing mid-load is picked up by the next check
+            version = dataset_version(self.data_path)
+            if self._current is not None and self._current.version == version:
+                return
+            dataset = OpenHouseDataset(self.data_path, self.scan, self.max_cursors, version)
+            with self._lock:
+                previous, self._current = self._current, dataset
+                self.loads += 1
+                if previous is not None:
+                    previous.retired = True
+                    closing = previous.users == 0
+            print(f'Loaded version {version[:12]} of `{self.data_path}`.')
+            if previous is not None and closing:
+                previous.close()
+        finally:
+            self._load_lock.release()
+
+    def close(self):
+        """
+        Close the current dataset. Dashboards must not be using it any more.
+        """
+        with self._lock:
+            dataset, self._current = self._current, None
+        if dataset is not None:
+            dataset.close()
+
 
 class OpenHouseDashboard:
     """
@@ -11,31 +672,155 @@ class OpenHouseDashboard:
 
     Attributes:
         data_path (str): The path to the cleaned open house data in Parquet format.
+        scan (bool): Whether DuckDB scans the Parquet data directly instead of loading it into pandas.
+        rollups (bool): Whether current pre-aggregated rollups were found next to the data and are queried instead.
+        cache (QueryCache): The shared result cache used by `_query`, if any.
+        version (str): The version of the dataset this dashboard queries, set when a cache or manager is used.
+        dataset (OpenHouseDataset): The loaded data the dashboard queries.
+        manager (DatasetManager): The manager the dataset came from, if any.
+        owned (bool): Whether the dashboard loaded or acquired the dataset itself, and closes or releases it.
+        query_hooks (list): Callables invoked with the name, SQL and latency of every `_query`.
+        compact (bool): Whether the data uses the processor's compact schema, with 5-digit zip codes.
+        sketches (Sketches): The processor's sketches of the current data, if it wrote any.
+        approximate (bool): Whether panels are answered from the sketches instead of queries.
     """
 
-    def __init__(self, data_path):
+    def __init__(self, data_path, scan=False, cache=None, manager=None, approximate=False, dataset=None):
         """
         Initialize the OpenHouseDashboard with the path to the cleaned open house data.
 
         Args:
-            data_path (str): The path to the cleaned open house data in Parquet format.
+            data_path (str): The path to the cleaned open house data in Parquet format, either a single
+                file or a dataset directory written by the processor.
+            scan (bool, optional): Whether to point the `openhouses` view at the Parquet data through
+                DuckDB's native scanner. Queries then only read the columns and row groups they need
+                and nothing is materialized up front. Defaults to False, which memory-maps the processor's
+                snapshot when it is current, and otherwise loads it into pandas.
+            cache (QueryCache, optional): A result cache, usually shared across dashboards, consulted by
+                `_query`. Defaults to None, which runs every query.
+            manager (DatasetManager, optional): A process-wide manager to take the loaded data from, in
+                which case `data_path` and `scan` are the manager's. Defaults to None, which loads the
+                data for this dashboard alone.
+            approximate (bool, optional): Whether to answer the top zip codes from the processor's sketches
+                and show distinct listings per zip code, if the sketches exist. Defaults to False.
+            dataset (OpenHouseDataset, optional): A dataset already loaded, e.g. acquired from a manager,
+                to query instead, in which case `data_path` and `scan` are the dataset's. The caller keeps
+                ownership, `close` leaves it open. Defaults to None.
         """
         self.data_path = data_path
-        self.df = pd.read_parquet(data_path)
-        self.con = duckdb.connect(database=':memory:', read_only=False)
-        self.con.register("openhouses", self.df)
+        self.scan = scan
+        self.cache = cache
+        self.manager = manager
+        self.owned = dataset is None
+        if dataset is not None:
+            self.dataset = dataset
+        elif manager is not None:
+            self.dataset = manager.acquire()
+        else:
+            # Fingerprint before loading, so a refresh landing mid-load is never cached under this version
+            version = dataset_version(data_path) if cache is not None else None
+            self.dataset = OpenHouseDataset(data_path, scan, version=version)
+        self.version = self.dataset.version
+        self.con = self.dataset.con
+        self.df = self.dataset.df
+        self.columns = self.dataset.columns
+        self.compact = self.dataset.compact
+        self.rollups = self.dataset.rollups
+        self.sketches = self.dataset.sketches
+        self.approximate = approximate and self.sketches is not None
+        if cache is not None:
+            cache.set_version(self.version)
+        self.query_hooks = []
+
+    def add_query_hook(self, hook):
+        """
+        Register a callable invoked after every `_query` with the query name, SQL and latency in seconds.
+
+        Args:
+            hook (callable): The hook, e.g. a QueryMetrics.
+        """
+        self.query_hooks.append(hook)
 
-    def _query(self, sql):
+    def cursor(self):
+        """
+        Borrow a cursor on the dashboard's data for a `with` block, so a query can run on it alongside
+        queries on other cursors.
+
+        Returns:
+            contextlib.AbstractContextManager: The context manager yielding the pooled cursor.
+        """
+        return self.dataset.cursor()
+
+    def _query(self, sql, params=None, name=None, cursor=None):
         """
         Execute an SQL query and return the result as a pandas DataFrame.
 
+        With a cache, results are shared between dashboards on the same dataset version, and are only
+        cached under the version they were read from, see `_execute_at`.
+
         Args:
             sql (str): The SQL query to execute.
+            params (list, optional): Values bound to the `?` placeholders in the query.
+            name (str, optional): The name reported to query hooks. Defaults to a digest of the SQL.
+            cursor (duckdb.DuckDBPyConnection, optional): The cursor to run the query on, from `cursor`.
+                Defaults to None, which borrows one from the pool for the query.
 
         Returns:
             pandas.DataFrame: The result of the SQL query.
         """
-        return self.con.execute(sql).df()
+        start = time.perf_counter()
+        if self.cache is None:
+            result = self._execute(sql, params, cursor)
+        else:
+            version = self.dataset.version
+            result = self.cache.get_or_compute(version, sql, params,
+                                               lambda: self._execute_at(version, sql, params, cursor))
+        if self.query_hooks:
+            seconds = time.perf_counter() - start
+            name = name or hashlib.sha1(sql.encode()).hexdigest()[:12]
+            for hook in self.query_hooks:
+                hook(name, sql, seconds)
+        return result
+
+    def _execute_at(self, version, sql, params=None, cursor=None):
+        """
+        Run an SQL query for the cache entry of a dataset version and return the result as a pandas DataFrame.
+
+        A loaded dataset holds its version in memory, but a scanned one reads the files there are when the
+        query runs, so its version is taken again afterwards. If the data moved on, the dataset is pointed
+        at the new files and the cache at the new version, so the result is never kept under `version`.
+        """
+        result = self._execute(sql, params, cursor)
+        if self.dataset.scan and dataset_version(self.dataset.data_path) != version:
+            self.dataset.rescan()
+            self.version = self.dataset.version
+            self.cache.set_version(self.version)
+        return result
+
+    def _execute(self, sql, params=None, cursor=None):
+        """
+        Run an SQL query on DuckDB and return the result as a pandas DataFrame.
+        """
+        if cursor is None:
+            with self.cursor() as cursor:
+                return self._execute(sql, params, cursor)
+        try:
+            return self._run(cursor, sql, params)
+        except duckdb.IOException:
+            # A scanned file was replaced by a newer version of the data since the view was created
+            if not self.dataset.scan:
+                raise
+            self.dataset.rescan()
+            return self._run(cursor, sql, params)
+
+    @staticmethod
+    def _run(cursor, sql, params):
+        """
+        Run an SQL query on a cursor and fetch the result as a pandas DataFrame.
+        """
+        if params is None:
+            return cursor.execute(sql).df()
+        return cursor.execute(sql, params).df()
 
     @staticmethod
     def get_week_most_open_houses_query():
@@ -56,19 +841,72 @@ class OpenHouseDashboard:
         return most_open_houses_week
 
     @staticmethod
-    def get_top_zip_codes_query(n=5):
+    def get_top_zip_codes_query(n=5, zip5=False):
+        # Compact data already holds 5-digit zip codes, which are grouped on as they are. Returns the SQL and
+        # the list of values bound to its placeholders, like the filtered queries.
+        zipcode = 'Zipcode' if zip5 else 'SUBSTRING(Zipcode, 1, 5)'
         top_5_zip_codes = f'''
         SELECT
-          SUBSTRING(Zipcode, 1, 5) AS Zipcode, COUNT(*) AS OpenHouseCount
+          {zipcode} AS Zipcode, COUNT(*) AS OpenHouseCount
         FROM
           openhouses
         GROUP BY
           1
         ORDER BY
           OpenHouseCount DESC
-        LIMIT {n}
+        LIMIT ?
         '''
-        return top_5_zip_codes
+        return top_5_zip_codes, [n]
+
+    @staticmethod
+    def get_distinct_listings_query(n=10, zip5=False):
+        # The exact counterpart of `get_distinct_listings_approximate`, scanning every record
+        zipcode = 'Zipcode' if zip5 else 'SUBSTRING(Zipcode, 1, 5)'
+        distinct_listings = f'''
+        SELECT
+          {zipcode} AS Zipcode, COUNT(DISTINCT ListingKey) AS DistinctListings
+        FROM
+          openhouses
+        GROUP BY
+          1
+        ORDER BY
+          DistinctListings DESC, Zipcode
+        LIMIT ?
+        '''
+        return distinct_listings, [n]
+
+    def get_top_zip_codes_approximate(self, n=5):
+        """
+        Answer the zip codes with the most open houses from the processor's Space-Saving sketch.
+
+        The answer is read from memory rather than computed from the data. Each `OpenHouseCount` is an upper
+        bound and `MinOpenHouseCount` a lower bound on the true count, so a zip code is certainly in the top
+        `n` when its lower bound is at least the upper bound of the zip code ranked after them.
+
+        Args:
+            n (int, optional): The number of zip codes. Defaults to 5.
+
+        Returns:
+            pandas.DataFrame: The `Zipcode`, `OpenHouseCount` and `MinOpenHouseCount` of the top zip codes.
+        """
+        return self.sketches.top_zipcodes.head(n).copy()
+
+    def get_distinct_listings_approximate(self, by='Zipcode', n=10):
+        """
+        Answer the number of distinct listings per zip code or week from the processor's HyperLogLog sketch.
+
+        The answer is read from memory rather than computed from the data. The estimates have a standard
+        error of `sketches.relative_error`, about 1.6%.
+
+        Args:
+            by (str, optional): `Zipcode` or `StartOfWeek`. Defaults to 'Zipcode'.
+            n (int, optional): The number of largest values returned, or None for all. Defaults to 10.
+
+        Returns:
+            pandas.DataFrame: The estimated `DistinctListings` per value, largest first.
+        """
+        distinct_listings = self.sketches.distinct_listings[by]
+        return (distinct_listings if n is None else distinct_listings.head(n)).copy()
 
     @staticmethod
     def get_daily_cumulative_total_query():
@@ -88,38 +926,322 @@ class OpenHouseDashboard:
         '''
         return daily_cumulative_total
 
-    def display_dashboard(self):
+    @staticmethod
+    def get_filter_clause(start_date=None, end_date=None, state=None, zip_prefix=None, month_column=False):
+        """
+        Build a WHERE clause for the dashboard filters, with `?` placeholders for the values to bind.
+
+        Every filter is a plain comparison on a column, which DuckDB pushes down into the Parquet scan, where
+        row groups whose min/max statistics exclude the values and hive partitions that do not match are
+        skipped. A zip code prefix becomes a range of zip codes rather than a LIKE for the same reason.
+
+        Args:
+            start_date (str or datetime.date, optional): The first OpenHouseDate included.
+            end_date (str or datetime.date, optional): The last OpenHouseDate included.
+            state (str, optional): The only State included.
+            zip_prefix (str, optional): The leading digits of the zip codes included.
+            month_column (bool, optional): Whether the data has the OpenHouseMonth partition column, which the
+                date range is also applied to so whole months of files are skipped. Defaults to False.
+
+        Returns:
+            tuple: The clause, empty without filters, and the list of values bound to its placeholders.
+        """
+        conditions, params = [], []
+        if start_date:
+            conditions.append('OpenHouseDate >= ?')
+            params.append(str(start_date))
+            if month_column:
+                conditions.append(f'{MONTH_COLUMN} >= ?')
+                params.append(str(start_date)[:7])
+        if end_date:
+            conditions.append('OpenHouseDate <= ?')
+            params.append(str(end_date))
+            if month_column:
+                conditions.append(f'{MONTH_COLUMN} <= ?')
+                params.append(str(end_date)[:7])
+        if state:
+            conditions.append('State = ?')
+            params.append(state)
+        if zip_prefix:
+            conditions.append('Zipcode >= ? AND Zipcode < ?')
+            params.extend([zip_prefix, zip_prefix[:-1] + chr(ord(zip_prefix[-1]) + 1)])
+        return ('WHERE ' + ' AND '.join(conditions) if conditions else ''), params
+
+    def get_week_most_open_houses_filtered_query(self, start_date=None, end_date=None, state=None, zip_prefix=None):
+        """
+        Build the week with the most open houses query restricted to the filters of `get_filter_clause`.
+
+        The daily rollup answers it when there is no zip code filter, as it only holds dates and states.
+
+        Returns:
+            tuple: The SQL and the list of values bound to its placeholders.
+        """
+        if self.rollups and not zip_prefix:
+            source, count, month_column = 'openhouses_daily', 'SUM(OpenHouseCount)', False
+        else:
+            source, count, month_column = 'openhouses', 'COUNT(*)', MONTH_COLUMN in self.columns
+        where, params = self.get_filter_clause(start_date, end_date, state, zip_prefix, month_column)
+        most_open_houses_week = f'''
+        SELECT
+          DATE_PART('week', CAST(OpenHouseDate AS DATE)) AS Week,
+          MIN(DATE_TRUNC('week', CAST(OpenHouseDate AS DATE))) AS StartOfWeek,
+          MIN(DATE_TRUNC('week', CAST(OpenHouseDate AS DATE)) + INTERVAL '6 days') AS EndOfWeek,
+          {count} AS OpenHouseCount
+        FROM
+          {source}
+        {where}
+        GROUP BY
+          Week
+        ORDER BY
+          OpenHouseCount DESC
+        LIMIT 1
+        '''
+        return most_open_houses_week, params
+
+    def get_top_zip_codes_filtered_query(self, n=5, start_date=None, end_date=None, state=None, zip_prefix=None):
+        """
+        Build the top zip codes query restricted to the filters of `get_filter_clause`, with `n` bound too.
+
+        The zip code rollup answers it when there is no date filter, as it only holds zip codes and states.
+
+        Returns:
+            tuple: The SQL and the list of values bound to its placeholders.
+        """
+        if self.rollups and not start_date and not end_date:
+            source, zipcode, count, month_column = 'openhouses_zipcode', 'Zipcode', 'SUM(OpenHouseCount)', False
+        else:
+            # Compact data already holds 5-digit zip codes, which are grouped on as they are
+            zipcode = 'Zipcode' if self.compact else 'SUBSTRING(Zipcode, 1, 5)'
+            source, count, month_column = 'openhouses', 'COUNT(*)', MONTH_COLUMN in self.columns
+        where, params = self.get_filter_clause(start_date, end_date, state, zip_prefix, month_column)
+        top_zip_codes = f'''
+        SELECT
+          {zipcode} AS Zipcode, {count} AS OpenHouseCount
+        FROM
+          {source}
+        {where}
+        GROUP BY
+          1
+        ORDER BY
+          OpenHouseCount DESC
+        LIMIT ?
+        '''
+        return top_zip_codes, [*params, n]
+
+    def get_daily_cumulative_total_filtered_query(self, start_date=None, end_date=None, state=None, zip_prefix=None):
+        """
+        Build the daily cumulative total query restricted to the filters of `get_filter_clause`, counting from
+        the first day included.
+
+        The daily rollup answers it when there is no zip code filter, as it only holds dates and states.
+
+        Returns:
+            tuple: The SQL and the list of values bound to its placeholders.
+        """
+        if self.rollups and not zip_prefix:
+            source, count, month_column = 'openhouses_daily', 'SUM(OpenHouseCount)', False
+        else:
+            source, count, month_column = 'openhouses', 'COUNT(*)', MONTH_COLUMN in self.columns
+        where, params = self.get_filter_clause(start_date, end_date, state, zip_prefix, month_column)
+        daily_cumulative_total = f'''
+        SELECT
+          OpenHouseDate,
+          SUM(CountPerDay) OVER (ORDER BY OpenHouseDate) AS daily_cumulative_total
+        FROM (
+          SELECT
+            OpenHouseDate,
+            {count} AS CountPerDay
+          FROM
+            {source}
+          {where}
+          GROUP BY
+            OpenHouseDate
+        )
+        '''
+        return daily_cumulative_total, params
+
+    @staticmethod
+    def get_week_most_open_houses_rollup_query():
+        most_open_houses_week = '''
+        SELECT
+          DATE_PART('week', CAST(StartOfWeek AS DATE)) AS Week,
+          MIN(DATE_TRUNC('week', CAST(StartOfWeek AS DATE))) AS StartOfWeek,
+          MIN(DATE_TRUNC('week', CAST(StartOfWeek AS DATE)) + INTERVAL '6 days') AS EndOfWeek,
+          SUM(OpenHouseCount) AS OpenHouseCount
+        FROM
+          openhouses_weekly
+        GROUP BY
+          Week
+        ORDER BY
+          OpenHouseCount DESC
+        LIMIT 1
+        '''
+        return most_open_houses_week
+
+    @staticmethod
+    def get_top_zip_codes_rollup_query(n=5):
+        top_5_zip_codes = '''
+        SELECT
+          Zipcode, SUM(OpenHouseCount) AS OpenHouseCount
+        FROM
+          openhouses_zipcode
+        GROUP BY
+          1
+        ORDER BY
+          OpenHouseCount DESC
+        LIMIT ?
+        '''
+        return top_5_zip_codes, [n]
+
+    @staticmethod
+    def get_daily_cumulative_total_rollup_query():
+        daily_cumulative_total = '''
+        SELECT
+          OpenHouseDate,
+          SUM(CountPerDay) OVER (ORDER BY OpenHouseDate) AS daily_cumulative_total
+        FROM (
+          SELECT
+            OpenHouseDate,
+            SUM(OpenHouseCount) AS CountPerDay
+          FROM
+            openhouses_daily
+          GROUP BY
+            OpenHouseDate
+        )
+        '''
+        return daily_cumulative_total
+
+    def panels(self, **filters):
+        """
+        Get the dashboard panels in page order, each an independent unit of a title, a query and a renderer.
+
+        In approximate mode the top zip codes come from the sketches, and distinct listings per zip code are
+        shown too. With filters the panels run the filtered queries with their values bound, as the sketches
+        cannot be filtered. Panels whose query binds values, like these and the top zip codes, hold a
+        callable returning the result in place of the SQL.
+
+        Args:
+            **filters: The filters of `get_filter_clause`, e.g. from `filter_controls`.
+
+        Returns:
+            list: A (name, title, sql, render) tuple per panel, where `render` draws the query result with Streamlit.
+        """
+        filters = {name: value for name, value in filters.items() if value}
+        if filters:
+            queries = {
+                'week_most_open_houses': self.get_week_most_open_houses_filtered_query(**filters),
+                'top_zip_codes': self.get_top_zip_codes_filtered_query(5, **filters),
+                'daily_cumulative_total': self.get_daily_cumulative_total_filtered_query(**filters),
+            }
+            most_open_houses_week, top_5_zip_codes, daily_cumulative_total = (
+                functools.partial(self._query, sql, params, name=name) for name, (sql, params) in queries.items()
+            )
+        elif self.rollups:
+            most_open_houses_week = self.get_week_most_open_houses_rollup_query()
+            top_5_zip_codes = functools.partial(self._query, *self.get_top_zip_codes_rollup_query(),
+                                                name='top_zip_codes')
+            daily_cumulative_total = self.get_daily_cumulative_total_rollup_query()
+        else:
+            most_open_houses_week = self.get_week_most_open_houses_query()
+            top_5_zip_codes = functools.partial(self._query, *self.get_top_zip_codes_query(zip5=self.compact),
+                                                name='top_zip_codes')
+            daily_cumulative_total = self.get_daily_cumulative_total_query()
+
+        def line_chart(df):
+            st.line_chart(df, y="daily_cumulative_total", x="OpenHouseDate")
+
+        panels = [
+            ('week_most_open_houses', 'Week with the Most Open Houses', most_open_houses_week, st.write),
+            ('top_zip_codes', 'Top-5 Zip Codes with the Most Open Houses', top_5_zip_codes, st.write),
+            ('daily_cumulative_total', 'Daily Cumulative Total of Open Houses Over Time', daily_cumulative_total,
+             line_chart),
+        ]
+        if self.approximate and not filters:
+            error = f'{self.sketches.relative_error:.1%}'
+            panels[1] = ('top_zip_codes', 'Top-5 Zip Codes with the Most Open Houses (approximate)',
+                         functools.partial(self.get_top_zip_codes_approximate, 5), st.write)
+            panels.append(('distinct_listings', f'Zip Codes with the Most Distinct Listings (approximate, ±{error})',
+                           functools.partial(self.get_distinct_listings_approximate, 'Zipcode', 5), st.write))
+        return panels
+
+    def filter_controls(self):
+        """
+        Lay out the date range, state and zip code prefix controls in the Streamlit sidebar.
+
+        Returns:
+            dict: The chosen filters for `display_dashboard`, leaving out the ones that select everything.
+        """
+        source = 'openhouses_daily' if self.rollups else 'openhouses'
+        bounds = self._query(f'SELECT MIN(OpenHouseDate) AS First, MAX(OpenHouseDate) AS Last FROM {source}',
+                             name='date_bounds')
+        states = self._query(f'SELECT DISTINCT State FROM {source} WHERE State IS NOT NULL ORDER BY State',
+                             name='states')
+        first, last = (pd.Timestamp(bounds[column].iloc[0]).date() for column in ('First', 'Last'))
+
+        dates = st.sidebar.date_input('Open house dates', value=(first, last), min_value=first, max_value=last)
+        state = st.sidebar.selectbox('State', ['All', *states['State']])
+        zip_prefix = st.sidebar.text_input('Zip code prefix', max_chars=5).strip()
+        filters = {}
+        # The range has a single date while its end is being picked
+        if len(dates) == 2:
+            if dates[0] > first:
+                filters['start_date'] = dates[0]
+            if dates[1] < last:
+                filters['end_date'] = dates[1]
+        if state != 'All':
+            filters['state'] = state
+        if zip_prefix:
+            filters['zip_prefix'] = zip_prefix
+        return filters
+
+    def display_dashboard(self, **filters):
         """
         Display the Open House Dashboard using Streamlit components.
+
+        Every panel is laid out with a placeholder first, then the panel queries run concurrently on a
+        thread pool, each on a cursor from the pool, and each panel is drawn as soon as its result arrives.
+        The page is complete after the slowest query rather than after all of them in turn, and a failed
+        query only takes down its own panel.
+
+        Args:
+            **filters: The filters of `get_filter_clause`, e.g. from `filter_controls`.
         """
         st.title('Open House Dashboard')
+        panels = self.panels(**filters)
+        placeholders = []
+        for _, title, _, _ in panels:
+            st.subheader(title)
+            placeholders.append(st.empty())
+            placeholders[-1].caption('Loading...')
 
-        # Week with the most open houses
-        most_open_houses_week = self.get_week_most_open_houses_query()
-        most_open_houses_week_df = self._query(most_open_houses_week)
-        # print(most_open_houses_week_df)
-        st.subheader('Week with the Most Open Houses')
-        st.write(most_open_houses_week_df)
-
-        # Top-5 zip codes with the most open houses
-        top_5_zip_codes = self.get_top_zip_codes_query()
-        top_5_zip_codes_df = self._query(top_5_zip_codes)
-        # print(top_5_zip_codes_df)
-        st.subheader('Top-5 Zip Codes with the Most Open Houses')
-        st.write(top_5_zip_codes_df)
-
-        # Daily cumulative total of open houses over time
-        daily_cumulative_total = self.get_daily_cumulative_total_query()
-        daily_cumulative_total_df = self._query(daily_cumulative_total)
-        # print(daily_cumulative_total_df)
-        st.subheader('Daily Cumulative Total of Open Houses Over Time')
-        st.line_chart(daily_cumulative_total_df, y="daily_cumulative_total", x="OpenHouseDate")
+        # Streamlit calls stay on this thread, the pool threads only run queries, each borrowing a cursor
+        # as it starts so panels wait on the cursor pool when other sessions are using it
+        with ThreadPoolExecutor(max_workers=len(panels)) as executor:
+            futures = {
+                (executor.submit(sql) if callable(sql) else executor.submit(self._query, sql, name=name)):
+                    (placeholder, render)
+                for (name, _, sql, render), placeholder in zip(panels, placeholders)
+            }
+            for future in as_completed(futures):
+                placeholder, render = futures[future]
+                try:
+                    result = future.result()
+                except Exception as error:
+                    placeholder.exception(error)
+                    continue
+                with placeholder:
+                    render(result)
 
     def close(self):
         """
-        Close the DuckDB connection.
+        Release the dataset back to its manager, or close it if the dashboard loaded it alone.
         """
-        self.con.close()
+        if not self.owned:
+            return
+        if self.manager is not None:
+            self.manager.release(self.dataset)
+        else:
+            self.dataset.close()
 
 
 if __name__ == '__main__':
@@ -127,6 +1249,19 @@ if __name__ == '__main__':
     here = os.path.abspath(os.path.dirname(__file__))
     parquet_short_path = 'data/processed_openhouses.parquet'
     full_path = os.path.abspath(os.path.join(here, '..', parquet_short_path))
-    dashboard = OpenHouseDashboard(full_path)
-    dashboard.display_dashboard()
+
+    @st.experimental_singleton
+    def shared_query_cache():
+        # One cache per server process, shared across sessions and reruns
+        return QueryCache()
+
+    @st.experimental_singleton
+    def shared_dataset_manager():
+        # One loaded dataset and cursor pool per server process, swapped when the processor writes a new version
+        return app_dataset_manager(data_path=full_path)
+
+    manager = shared_dataset_manager()
+    dashboard = OpenHouseDashboard(manager.data_path, manager.scan, cache=shared_query_cache(), manager=manager,
+                                   approximate=st.sidebar.checkbox('Approximate answers from sketches'))
+    dashboard.display_dashboard(**dashboard.filter_controls())
     dashboard.close()
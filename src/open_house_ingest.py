@@ -0,0 +1,312 @@
+"""
+Continuously ingest open house files dropped into a directory in micro-batches, merging the small files they leave.
+
+Producers write each file under a name starting with `.` or `_` and rename it once complete, so a file is
+never picked up half written.
+
+Usage (from the repository root):
+    python -m src.open_house_ingest data/drops data/output/openhouses --max-batch-age 60 --snapshot
+"""
+import argparse
+import os
+import threading
+import time
+
+from src.open_house_processor import TARGET_FILE_ROWS, OpenHouseProcessor, input_files
+
+# Subdirectories of the drop directory for the files of a micro-batch being committed, committed and rejected;
+# the leading underscore hides them from `input_files`
+CLAIMED_DIR = '_claimed'
+INGESTED_DIR = '_ingested'
+FAILED_DIR = '_failed'
+
+
+class MicroBatchIngestor:
+    """
+    A daemon upserting the files dropped into a directory into an incremental open house dataset.
+
+    Files are grouped into a micro-batch once `max_batch_files` files or `max_batch_bytes` bytes are
+    waiting, or the oldest has waited `max_batch_age` seconds, which bounds how stale the dataset gets.
+    A micro-batch is claimed by moving its files into a directory of its own, validated and deduplicated
+    by the OpenHouseProcessor and upserted as a new part file, after which the processor's manifest lists
+    the new version. Upserts are idempotent, so micro-batches still claimed after a crash are simply
+    committed again on the next start. Records arriving late are applied as long as they are newer than
+    the stored record of their key.
+
+    Each micro-batch leaves a small part file, so a background compactor merges small part files into
+    files of up to `target_file_rows` rows every `compact_interval` seconds, dropping superseded versions
+    of a key along the way, and dashboards keep scanning a few well-sized files.
+
+    Attributes:
+        drop_path (str): The directory files are dropped into.
+        output_path (str): The incremental Parquet dataset directory.
+        max_batch_files (int): The most files of a micro-batch.
+        max_batch_bytes (int): The bytes of waiting files that start a micro-batch.
+        max_batch_age (float): The seconds a file waits at most before its micro-batch starts.
+        poll_interval (float): The seconds between looks at the drop directory.
+        compact_interval (float): The seconds between compactions.
+        target_file_rows (int): The most rows of a part file written by the compactor.
+        processor_options (dict): Further OpenHouseProcessor options, like `compact` or `snapshot`.
+        batches (int): The number of micro-batches committed.
+        records (int): The number of records upserted.
+        failed (int): The number of micro-batches that could not be processed.
+        merged (int): The number of part files merged by the compactor.
+    """
+
+    def __init__(self, drop_path, output_path, max_batch_files=100, max_batch_bytes=1 << 28, max_batch_age=60.0,
+                 poll_interval=1.0, compact_interval=300.0, target_file_rows=TARGET_FILE_ROWS, **processor_options):
+        """
+        Initialize the MicroBatchIngestor.
+
+        Args:
+            drop_path (str): The directory files are dropped into.
+            output_path (str): The incremental Parquet dataset directory.
+            max_batch_files (int, optional): The most files of a micro-batch. Defaults to 100.
+            max_batch_bytes (int, optional): The bytes of waiting files that start a micro-batch, which also
+                caps its size unless a single file is larger. Defaults to 256 MiB.
+            max_batch_age (float, optional): The seconds a file waits at most. Defaults to 60.0.
+            poll_interval (float, optional): The seconds between looks at the drop directory. Defaults to 1.0.
+            compact_interval (float, optional): The seconds between compactions. Defaults to 300.0.
+            target_file_rows (int, optional): The most rows of a merged part file. Defaults to TARGET_FILE_ROWS.
+            **processor_options: Further OpenHouseProcessor options, like `compact`, `rollups` or `snapshot`.
+        """
+        self.drop_path = os.path.abspath(drop_path)
+        self.output_path = os.path.abspath(output_path)
+        self.max_batch_files = max_batch_files
+        self.max_batch_bytes = max_batch_bytes
+        self.max_batch_age = max_batch_age
+        self.poll_interval = poll_interval
+        self.compact_interval = compact_interval
+        self.target_file_rows = target_file_rows
+        self.processor_options = processor_options
+        self.batches = 0
+        self.records = 0
+        self.failed = 0
+        self.merged = 0
+        self._first_seen = {}
+        # Upserts and merges both rewrite the key index, so they take turns
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+
+    def processor(self, input_path):
+        """
+        Create the processor upserting a micro-batch, or merging part files, into the dataset.
+
+        Args:
+            input_path (str): The directory of the micro-batch's files.
+
+        Returns:
+            OpenHouseProcessor: The processor.
+        """
+        return OpenHouseProcessor(input_path, self.output_path, incremental=True, **self.processor_options)
+
+    def pending(self, now=None):
+        """
+        List the files waiting in the drop directory, noting when each was first seen.
+
+        Args:
+            now (float, optional): The current `time.monotonic()`. Defaults to None, which reads it.
+
+        Returns:
+            list: The sorted paths of the waiting files.
+        """
+        now = time.monotonic() if now is None else now
+        try:
+            paths = input_files(self.drop_path)
+        except FileNotFoundError:
+            paths = []
+        self._first_seen = {path: self._first_seen.get(path, now) for path in paths}
+        return paths
+
+    def poll(self, now=None, flush=False):
+        """
+        Commit a micro-batch of the waiting files if one is due.
+
+        Args:
+            now (float, optional): The current `time.monotonic()`. Defaults to None, which reads it.
+            flush (bool, optional): Whether to commit the waiting files even if no limit is reached.
+                Defaults to False.
+
+        Returns:
+            int: The number of records upserted, or None if no micro-batch was due.
+        """
+        now = time.monotonic() if now is None else now
+        paths = self.pending(now)
+        if not paths:
+            return None
+        sizes = [os.path.getsize(path) for path in paths]
+        due = (
+            flush
+            or len(paths) >= self.max_batch_files
+            or sum(sizes) >= self.max_batch_bytes
+            or now - min(self._first_seen.values()) >= self.max_batch_age
+        )
+        if not due:
+            return None
+
+        batch, size = [], 0
+        for path, path_size in zip(paths[:self.max_batch_files], sizes):
+            if batch and size + path_size > self.max_batch_bytes:
+                break
+            batch.append(path)
+            size += path_size
+        return self.ingest(batch)
+
+    def ingest(self, paths):
+        """
+        Claim files of the drop directory as a micro-batch and commit it.
+
+        Args:
+            paths (list): The paths of the files.
+
+        Returns:
+            int: The number of records upserted.
+        """
+        batch_path = os.path.join(self.drop_path, CLAIMED_DIR, f'batch-{time.time_ns()}')
+        os.makedirs(batch_path)
+        for path in paths:
+            os.rename(path, os.path.join(batch_path, os.path.basename(path)))
+            self._first_seen.pop(path, None)
+        return self.commit(batch_path)
+
+    def commit(self, batch_path):
+        """
+        Upsert the files of a claimed micro-batch and move them to the ingested directory, or to the
+        failed directory if they cannot be processed.
+
+        Args:
+            batch_path (str): The directory of the micro-batch's files.
+
+        Returns:
+            int: The number of records upserted.
+        """
+        batch_id = os.path.basename(batch_path)
+        files = len(os.listdir(batch_path))
+        processor = self.processor(batch_path)
+        try:
+            with self._lock:
+                processor.run()
+        except Exception as error:
+            self.failed += 1
+            os.makedirs(os.path.join(self.drop_path, FAILED_DIR), exist_ok=True)
+            os.replace(batch_path, os.path.join(self.drop_path, FAILED_DIR, batch_id))
+            print(f'Failed to ingest micro-batch `{batch_id}`: {type(error).__name__}: {error}')
+            return 0
+        os.makedirs(os.path.join(self.drop_path, INGESTED_DIR), exist_ok=True)
+        os.replace(batch_path, os.path.join(self.drop_path, INGESTED_DIR, batch_id))
+        records = processor.metrics.stages['write'].rows_out
+        self.batches += 1
+        self.records += records
+        print(f'Ingested micro-batch `{batch_id}` of {files} files with {records} new or changed records.')
+        return records
+
+    def recover(self):
+        """
+        Commit the micro-batches left claimed by an interrupted run, in the order they were claimed.
+
+        Returns:
+            int: The number of micro-batches committed again.
+        """
+        claimed = os.path.join(self.drop_path, CLAIMED_DIR)
+        batch_ids = sorted(os.listdir(claimed)) if os.path.isdir(claimed) else []
+        for batch_id in batch_ids:
+            if os.listdir(os.path.join(claimed, batch_id)):
+                self.commit(os.path.join(claimed, batch_id))
+            else:
+                os.rmdir(os.path.join(claimed, batch_id))
+        return len(batch_ids)
+
+    def compact(self):
+        """
+        Merge the small part files of the dataset, one merged file at a time so micro-batches are not held
+        up for long.
+
+        Returns:
+            int: The number of part files merged.
+        """
+        if not os.path.isdir(self.output_path):
+            return 0
+        merged = 0
+        while not self._stop.is_set():
+            with self._lock:
+                files = self.processor(self.drop_path).merge_small_files(self.target_file_rows, max_groups=1)
+            if not files:
+                break
+            merged += files
+        self.merged += merged
+        return merged
+
+    def _compact_loop(self):
+        while not self._stop.wait(self.compact_interval):
+            try:
+                self.compact()
+            except Exception as error:
+                print(f'Failed to merge part files: {type(error).__name__}: {error}')
+
+    def run(self):
+        """
+        Ingest the dropped files until `stop` is called, then commit the files still waiting.
+        """
+        os.makedirs(self.drop_path, exist_ok=True)
+        self.recover()
+        compactor = threading.Thread(target=self._compact_loop, name='openhouse-compactor', daemon=True)
+        compactor.start()
+        print(f'Watching `{self.drop_path}` for open house files to ingest into `{self.output_path}`.')
+        try:
+            while not self._stop.is_set():
+                self.poll()
+                self._stop.wait(self.poll_interval)
+        finally:
+            self._stop.set()
+            compactor.join()
+            while self.poll(flush=True) is not None:
+                pass
+
+    def stop(self):
+        """
+        Ask `run` to return once the waiting files are committed.
+        """
+        self._stop.set()
+
+    def stats(self):
+        """
+        Get the ingestion counters.
+
+        Returns:
+            dict: The counters.
+        """
+        return {
+            'batches': self.batches,
+            'records': self.records,
+            'failed': self.failed,
+            'merged': self.merged,
+            'pending': len(self._first_seen),
+        }
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('drop_path', help='The directory open house JSON files are dropped into.')
+    parser.add_argument('output_path', help='The incremental Parquet dataset directory.')
+    parser.add_argument('--max-batch-files', type=int, default=100)
+    parser.add_argument('--max-batch-bytes', type=int, default=1 << 28)
+    parser.add_argument('--max-batch-age', type=float, default=60.0, help='Seconds a file waits at most.')
+    parser.add_argument('--poll-interval', type=float, default=1.0)
+    parser.add_argument('--compact-interval', type=float, default=300.0)
+    parser.add_argument('--target-file-rows', type=int, default=TARGET_FILE_ROWS)
+    parser.add_argument('--compact', action='store_true', help='Write the compact schema.')
+    parser.add_argument('--rollups', action='store_true', help='Maintain the dashboard rollups.')
+    parser.add_argument('--sketches', action='store_true', help='Maintain the dashboard sketches.')
+    parser.add_argument('--snapshot', action='store_true', help='Maintain the dashboard snapshot.')
+    args = parser.parse_args()
+
+    ingestor = MicroBatchIngestor(
+        args.drop_path, args.output_path, args.max_batch_files, args.max_batch_bytes, args.max_batch_age,
+        args.poll_interval, args.compact_interval, args.target_file_rows,
+        compact=args.compact, rollups=args.rollups, sketches=args.sketches, snapshot=args.snapshot,
+    )
+    try:
+        ingestor.run()
+    except KeyboardInterrupt:
+        pass
+    print(ingestor.stats())
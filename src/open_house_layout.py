@@ -0,0 +1,134 @@
+"""
+The on-disk layout of the open house processor's output, shared by the processor and its readers.
+
+The dashboard is also run as a script from this directory (`streamlit run open_house_dashboard.py`), so this
+module imports nothing from the `src` package.
+"""
+import json
+import os
+
+import pyarrow.parquet as pq
+
+# Bookkeeping files kept inside an incremental output directory, the leading underscore hides them from readers
+WATERMARK_FILE = '_watermark.json'
+KEY_INDEX_FILE = '_key_index.parquet'
+MANIFEST_FILE = '_manifest.json'
+
+# Column derived from OpenHouseDate (`YYYY-MM`) that the partitioned writer can split the output on
+MONTH_COLUMN = 'OpenHouseMonth'
+
+# Column the compact schema splits off the zip code, leaving `Zipcode` with just 5 digits
+ZIP_PLUS4_COLUMN = 'ZipcodePlus4'
+
+# Sketches written to the rollup directory: Space-Saving counters of the most frequent zip codes, and sparse
+# HyperLogLog registers of the distinct ListingKeys per zip code and per week
+TOP_ZIPCODES_FILE = 'top_zipcodes.parquet'
+DISTINCT_LISTINGS_FILE = 'distinct_listings.parquet'
+
+# Sorted ListingKey to row group index written to the rollup directory, for point lookups by listing
+LISTING_INDEX_FILE = 'listing_index.parquet'
+
+# Schema metadata key of the rollups, sketches and snapshot holding the `data_fingerprint` of the data they
+# were computed from, so readers can tell they are stale
+DATA_FILES_KEY = 'data_files'
+
+# Uncompressed Arrow IPC snapshot of the columns the dashboard queries, which it memory-maps instead of
+# decoding the Parquet output
+SNAPSHOT_FILE = 'snapshot.arrow'
+
+
+def rollup_path(data_path):
+    """
+    Get the directory holding the rollups, sketches, indexes and snapshot written next to an output path,
+    a sibling named `<output>_rollups`.
+
+    Args:
+        data_path (str): The path to the cleaned open house Parquet file or dataset directory.
+
+    Returns:
+        str: The path to the rollup directory.
+    """
+    return f'{os.path.splitext(data_path)[0]}_rollups'
+
+
+def read_manifest(data_path):
+    """
+    Read the manifest an incremental dataset directory keeps of its live part files.
+
+    Args:
+        data_path (str): The path to a dataset directory.
+
+    Returns:
+        dict: The manifest, or None if the dataset has none.
+    """
+    path = os.path.join(data_path, MANIFEST_FILE)
+    if not os.path.exists(path):
+        return None
+    with open(path, 'r') as file:
+        return json.load(file)
+
+
+def parquet_files(data_path):
+    """
+    List the Parquet data files behind a dataset path.
+
+    An incremental dataset lists its live part files in its manifest, which is replaced in one step once
+    the files of a new version are in place, so the files of a version being written or retired are never
+    listed next to each other. Otherwise files and directories starting with `_` or `.` hold bookkeeping
+    (like the incremental key index) rather than open house records, and are skipped the same way pyarrow
+    skips them.
+
+    Args:
+        data_path (str): The path to a single Parquet file or a dataset directory.
+
+    Returns:
+        list: The sorted paths of the Parquet data files.
+    """
+    if not os.path.isdir(data_path):
+        return [data_path]
+    manifest = read_manifest(data_path)
+    if manifest is not None:
+        return sorted(os.path.join(data_path, file['name']) for file in manifest['files'])
+    files = []
+    for root, dirs, names in os.walk(data_path):
+        dirs[:] = [name for name in dirs if not name.startswith(('_', '.'))]
+        files.extend(os.path.join(root, name) for name in names
+                     if name.endswith('.parquet') and not name.startswith(('_', '.')))
+    return sorted(files)
+
+
+def data_fingerprint(data_path):
+    """
+    Fingerprint the Parquet data files behind a dataset path by their size and modification time.
+
+    Files are named relative to a dataset directory, so the fingerprint survives moving the output.
+
+    Args:
+        data_path (str): The path to a single Parquet file or a dataset directory.
+
+    Returns:
+        dict: The `[size, mtime_ns]` of each data file, keyed by its name.
+    """
+    fingerprint = {}
+    for path in parquet_files(data_path):
+        stat = os.stat(path)
+        name = os.path.relpath(path, data_path) if os.path.isdir(data_path) else os.path.basename(path)
+        fingerprint[name] = [stat.st_size, stat.st_mtime_ns]
+    return fingerprint
+
+
+def is_current(path, fingerprint):
+    """
+    Check a rollup, sketch or index file was computed from the data files with the given fingerprint.
+
+    Args:
+        path (str): The path to the Parquet rollup, sketch or index file.
+        fingerprint (dict): The `data_fingerprint` of the data files it should summarize.
+
+    Returns:
+        bool: Whether the file exists and records this fingerprint.
+    """
+    if not os.path.exists(path):
+        return False
+    written_for = (pq.read_schema(path).metadata or {}).get(DATA_FILES_KEY.encode())
+    return written_for is not None and json.loads(written_for) == fingerprint
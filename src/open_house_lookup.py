@@ -0,0 +1,154 @@
+"""
+Point lookups of single open houses and of the open houses of a listing in the processor's Parquet output.
+
+Usage (from the repository root):
+    python -m src.open_house_lookup data/output/processed_openhouses.parquet --key <OpenHouseKey>
+    python -m src.open_house_lookup data/output/processed_openhouses.parquet --listing <ListingKey>
+"""
+import argparse
+import os
+
+import numpy as np
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+
+from src.open_house_layout import LISTING_INDEX_FILE, data_fingerprint, is_current, rollup_path
+
+
+class OpenHouseLookup:
+    """
+    A class to look up open houses by OpenHouseKey or ListingKey in a cleaned open house Parquet file,
+    reading only the row groups that can hold the key.
+
+    For an OpenHouseKey those are the row groups whose min/max statistics bracket the key, a single one
+    when the processor clustered the file on OpenHouseKey with `lookups=True`. For a ListingKey they come
+    from the listing index written alongside, and every row group is read when the index is missing or
+    older than the file.
+
+    Attributes:
+        data_path (str): The path to the cleaned open house Parquet file.
+        file (pyarrow.parquet.ParquetFile): The open Parquet file.
+        key_ranges (list): The min and max OpenHouseKey of each row group, None where the file has no statistics.
+        listing_keys (numpy.ndarray): The sorted ListingKeys of the listing index, None without a usable index.
+        listing_row_groups (numpy.ndarray): The row group holding each entry of `listing_keys`.
+        row_groups_read (int): The number of row groups read by lookups so far.
+    """
+
+    def __init__(self, data_path):
+        """
+        Initialize the OpenHouseLookup, reading the file footer and the listing index once.
+
+        Args:
+            data_path (str): The path to the cleaned open house Parquet file.
+        """
+        self.data_path = data_path
+        self.file = pq.ParquetFile(data_path)
+        metadata = self.file.metadata
+        column = self.file.schema_arrow.get_field_index('OpenHouseKey')
+        self.key_ranges = []
+        for row_group in range(metadata.num_row_groups):
+            statistics = metadata.row_group(row_group).column(column).statistics
+            has_range = statistics is not None and statistics.has_min_max
+            self.key_ranges.append((statistics.min, statistics.max) if has_range else None)
+        self.listing_keys = None
+        self.listing_row_groups = None
+        self._read_listing_index()
+        self.row_groups_read = 0
+
+    def _read_listing_index(self):
+        """
+        Load the listing index, unless it is missing or was written for another version of the data file.
+        """
+        path = os.path.join(rollup_path(self.data_path), LISTING_INDEX_FILE)
+        if not is_current(path, data_fingerprint(self.data_path)):
+            return
+        index = pq.read_table(path)
+        self.listing_keys = index['ListingKey'].combine_chunks().to_numpy(zero_copy_only=False)
+        self.listing_row_groups = index['RowGroup'].combine_chunks().to_numpy()
+
+    def _key(self, column, key):
+        """
+        Convert a key to the type of its column, hex strings to bytes in the compact schema, or None if it
+        cannot be a value of the column.
+        """
+        column_type = self.file.schema_arrow.field(column).type
+        if not pa.types.is_fixed_size_binary(column_type):
+            return key
+        if isinstance(key, str):
+            try:
+                key = bytes.fromhex(key)
+            except ValueError:
+                return None
+        return key if len(key) == column_type.byte_width else None
+
+    def _read(self, row_groups, column, key):
+        """
+        Read the given row groups and keep the records whose `column` equals `key`.
+        """
+        row_groups = list(row_groups)
+        self.row_groups_read += len(row_groups)
+        table = self.file.read_row_groups(row_groups)
+        return table.filter(pc.equal(table[column], pa.scalar(key, table.schema.field(column).type)))
+
+    def get_open_house(self, key):
+        """
+        Look up the open house with an OpenHouseKey.
+
+        Args:
+            key (str or bytes): The OpenHouseKey, as a hex string or bytes in the compact schema.
+
+        Returns:
+            dict: The open house record, or None if there is none with this key.
+        """
+        key = self._key('OpenHouseKey', key)
+        if key is None:
+            return None
+        row_groups = [row_group for row_group, key_range in enumerate(self.key_ranges)
+                      if key_range is None or key_range[0] <= key <= key_range[1]]
+        records = self._read(row_groups, 'OpenHouseKey', key).to_pylist()
+        return records[0] if records else None
+
+    def get_listing_open_houses(self, listing_key):
+        """
+        Look up the open houses of a listing.
+
+        Args:
+            listing_key (str or bytes): The ListingKey, as a hex string or bytes in the compact schema.
+
+        Returns:
+            pandas.DataFrame: The listing's open house records ordered by start time, empty if it has none.
+        """
+        listing_key = self._key('ListingKey', listing_key)
+        if listing_key is None:
+            return self.file.schema_arrow.empty_table().to_pandas()
+        if self.listing_keys is None:
+            row_groups = range(self.file.num_row_groups)
+        else:
+            start = np.searchsorted(self.listing_keys, listing_key, side='left')
+            stop = np.searchsorted(self.listing_keys, listing_key, side='right')
+            row_groups = np.unique(self.listing_row_groups[start:stop]).tolist()
+        table = self._read(row_groups, 'ListingKey', listing_key)
+        return table.sort_by('OpenHouseStartTime').to_pandas()
+
+    def close(self):
+        """
+        Close the Parquet file.
+        """
+        self.file.close()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('data_path', help='The cleaned open house Parquet file.')
+    lookup_key = parser.add_mutually_exclusive_group(required=True)
+    lookup_key.add_argument('--key', help='An OpenHouseKey to look up.')
+    lookup_key.add_argument('--listing', help='A ListingKey to look up the open houses of.')
+    args = parser.parse_args()
+
+    lookup = OpenHouseLookup(args.data_path)
+    if args.key:
+        print(lookup.get_open_house(args.key))
+    else:
+        print(lookup.get_listing_open_houses(args.listing).to_string(index=False))
+    lookup.close()
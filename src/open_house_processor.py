@@ -1,46 +1,1332 @@
+import glob
+import io
+import itertools
 import json
 import os
+import re
+import resource
+import shutil
+import tempfile
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from contextlib import contextmanager
 
+import duckdb
+import numpy as np
 import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.dataset as ds
+import pyarrow.json as pj
+import pyarrow.parquet as pq
+
+from src.open_house_layout import (
+    DATA_FILES_KEY, DISTINCT_LISTINGS_FILE, KEY_INDEX_FILE, LISTING_INDEX_FILE, MANIFEST_FILE, MONTH_COLUMN,
+    SNAPSHOT_FILE, TOP_ZIPCODES_FILE, WATERMARK_FILE, ZIP_PLUS4_COLUMN, data_fingerprint, is_current, parquet_files,
+    read_manifest, rollup_path,
+)
+
+# Size of each text chunk pulled off disk while streaming the input array
+READ_CHUNK_SIZE = 1 << 20
+
+# Size of the blocks the Arrow engine's JSON reader parses on separate threads
+ARROW_BLOCK_SIZE = 1 << 24
+
+# Input file extensions that are decompressed while reading, and the Arrow codec for each
+INPUT_CODECS = {'.gz': 'gzip', '.bz2': 'bz2', '.lz4': 'lz4', '.zst': 'zstd'}
+
+# Threads reading, decompressing and parsing input files at once when the input has several
+READ_WORKERS = 4
+
+# DuckDB's memory limit in the duckdb engine, beyond which its sorts spill to the temp directory
+OUT_OF_CORE_MEMORY_LIMIT = '1GB'
+
+# Column numbering the records in input order while the duckdb engine sorts them, dropped from the output
+ROW_NUMBER_COLUMN = '_RowNumber'
+
+# Number of shards handed to each worker in parallel mode, more than one keeps the pool balanced
+SHARDS_PER_WORKER = 4
+
+# Rows a part file of an incremental output is merged up to by `merge_small_files`
+TARGET_FILE_ROWS = 1 << 20
+
+# Default number of rows per Parquet row group for the partitioned writer
+ROW_GROUP_SIZE = 1 << 17
+
+# Timestamp shapes accepted by default, UTC ISO-8601 with and without milliseconds
+ISO_8601_UTC_MILLIS = '%Y-%m-%dT%H:%M:%S.%fZ'
+ISO_8601_UTC = '%Y-%m-%dT%H:%M:%SZ'
+TIMESTAMP_FORMATS = (ISO_8601_UTC_MILLIS, ISO_8601_UTC)
+
+# Columns validated as timestamps, records failing any of them are dropped
+TIMESTAMP_COLUMNS = ['OpenHouseStartTime', 'OpenHouseEndTime', 'DateModified']
+
+# Compact schema: hex MD5 keys stored as 16 bytes, low-cardinality text as categoricals, ZIP+4 split off the zip code
+HEX_KEY_COLUMNS = ['OpenHouseKey', 'ListingKey']
+CATEGORY_COLUMNS = ['OpenHouseMethod', 'OpenHouseDate', 'State', 'Zipcode', ZIP_PLUS4_COLUMN]
+
+# Pre-aggregated open house counts and the columns each one is grouped by
+ROLLUPS = {
+    'daily': ['OpenHouseDate', 'State'],
+    'weekly': ['StartOfWeek', 'State'],
+    'zipcode': ['Zipcode', 'State'],
+}
+
+# Size of the zip code Space-Saving counters and precision of the HyperLogLog registers of the sketches
+SKETCH_CAPACITY = 1024
+HLL_PRECISION = 12
+
+# Columns of the dashboard's Arrow IPC snapshot
+SNAPSHOT_COLUMNS = ['OpenHouseDate', 'State', 'Zipcode', ZIP_PLUS4_COLUMN, 'ListingKey']
+
+
+def compute_rollups(df):
+    """
+    Count open houses per day, per ISO week (keyed by its Monday) and per 5-digit zip code, each by state.
+
+    Args:
+        df (pandas.DataFrame or pyarrow.Table): Cleaned open house records.
+
+    Returns:
+        dict: A DataFrame of `OpenHouseCount` per group for each rollup name in ROLLUPS.
+    """
+    if isinstance(df, pa.Table):
+        df = df.select(['OpenHouseDate', 'Zipcode', 'State']).to_pandas()
+    # Group on plain values, pandas would otherwise emit a group for every combination of categories
+    groups = pd.DataFrame({
+        'OpenHouseDate': df['OpenHouseDate'].astype(object),
+        'StartOfWeek': _start_of_week(df['OpenHouseDate']),
+        'Zipcode': df['Zipcode'].astype(object).str[:5],
+        'State': df['State'].astype(object),
+        'OpenHouseCount': 1,
+    })
+    return {
+        name: groups.groupby(columns, dropna=False, as_index=False)['OpenHouseCount'].sum()
+        for name, columns in ROLLUPS.items()
+    }
+
+
+def _start_of_week(open_house_dates):
+    """
+    Get the Monday starting the ISO week of each OpenHouseDate, as a `YYYY-MM-DD` string.
+    """
+    # There are only so many distinct dates, so each is parsed and formatted once
+    codes, uniques = pd.factorize(open_house_dates.astype(object))
+    dates = pd.to_datetime(pd.Series(uniques, dtype=object))
+    mondays = (dates - pd.to_timedelta(dates.dt.weekday, unit='D')).dt.strftime('%Y-%m-%d').to_numpy(dtype=object)
+    return pd.Series(np.append(mondays, None)[codes], index=open_house_dates.index, dtype=object)
+
+
+class SpaceSaving:
+    """
+    A Space-Saving summary of the most frequent values in a stream, holding at most `capacity` counters.
+
+    Each counter's count is an upper bound on how often its value was seen, and exceeds it by at most the
+    counter's error. A value without a counter was seen at most `floor` times, which never exceeds
+    `total / capacity`, so every value more frequent than that has a counter. Summaries of separate parts
+    of a stream merge into a summary of the whole with the same guarantees.
+
+    Attributes:
+        capacity (int): The most counters kept.
+        total (int): The number of values summarized.
+        floor (int): The most times a value without a counter can have been seen.
+        counters (pandas.DataFrame): The `Count` and `Error` of each counted value, indexed by value and
+            sorted by descending count.
+    """
+
+    def __init__(self, capacity=SKETCH_CAPACITY):
+        """
+        Initialize an empty SpaceSaving summary.
+
+        Args:
+            capacity (int, optional): The most counters kept. Defaults to SKETCH_CAPACITY.
+        """
+        self.capacity = capacity
+        self.total = 0
+        self.floor = 0
+        self.counters = pd.DataFrame({'Count': pd.Series(dtype=np.int64), 'Error': pd.Series(dtype=np.int64)},
+                                     index=pd.Index([], name='Value', dtype=object))
+
+    def update(self, values, removed=None):
+        """
+        Add a chunk of values to the summary, optionally taking off values that no longer count.
+
+        The chunk is counted exactly and merged in. Removed values are taken off the counters holding
+        them; the counts of values without a counter are upper bounds either way, so they are left.
+
+        Args:
+            values (array-like): The values to add. Missing values are skipped.
+            removed (array-like, optional): Values added before that are to be taken off again.
+        """
+        counts = pd.Series(values, dtype=object).value_counts()
+        total = int(counts.sum())
+        if removed is not None:
+            removed = pd.Series(removed, dtype=object).value_counts()
+            counts = counts.sub(removed, fill_value=0).astype(np.int64)
+            self.total -= int(removed.sum())
+            taken = (-counts[counts < 0]).reindex(self.counters.index, fill_value=0)
+            self.counters['Count'] = (self.counters['Count'] - taken).clip(lower=0)
+            self.counters['Error'] = np.minimum(self.counters['Error'], self.counters['Count'])
+            counts = counts[counts > 0]
+        exact = SpaceSaving(max(self.capacity, len(counts)))
+        exact.counters = pd.DataFrame({'Count': counts.to_numpy(np.int64), 'Error': 0},
+                                      index=pd.Index(counts.index, name='Value', dtype=object))
+        exact.total = total
+        self.merge(exact)
+
+    def merge(self, other):
+        """
+        Merge another summary into this one, keeping the `capacity` largest counters.
+
+        Args:
+            other (SpaceSaving): The summary of another part of the stream.
+        """
+        index = self.counters.index.union(other.counters.index)
+        merged = (self.counters.reindex(index, fill_value=self.floor)
+                  + other.counters.reindex(index, fill_value=other.floor))
+        merged = merged.rename_axis('Value').sort_values(['Count', 'Value'], ascending=[False, True])
+        dropped = merged['Count'].iloc[self.capacity:]
+        self.floor = max(self.floor + other.floor, int(dropped.max()) if len(dropped) else 0)
+        self.counters = merged.iloc[:self.capacity]
+        self.total += other.total
+
+    def to_arrow(self):
+        """
+        Convert the summary to an Arrow table of `Value`, `Count` and `Error`, with the capacity, total and
+        floor in its metadata.
+
+        Returns:
+            pyarrow.Table: The summary.
+        """
+        table = pa.Table.from_pandas(self.counters.reset_index(), preserve_index=False)
+        metadata = {'capacity': self.capacity, 'total': self.total, 'floor': self.floor}
+        return table.replace_schema_metadata({key: str(value) for key, value in metadata.items()})
+
+    @classmethod
+    def from_arrow(cls, table):
+        """
+        Restore a summary converted with `to_arrow`.
+
+        Args:
+            table (pyarrow.Table): The summary.
+
+        Returns:
+            SpaceSaving: The summary.
+        """
+        metadata = table.schema.metadata
+        summary = cls(int(metadata[b'capacity']))
+        summary.total = int(metadata[b'total'])
+        summary.floor = int(metadata[b'floor'])
+        counters = table.to_pandas()
+        summary.counters = counters.set_index(counters['Value'].astype(object).rename('Value'))[['Count', 'Error']]
+        return summary
+
+
+def _leading_zeros(words):
+    """
+    Count the leading zero bits of each uint64 word, by binary search on the top bits.
+    """
+    counts = np.zeros(len(words), dtype=np.int8)
+    for shift in (32, 16, 8, 4, 2, 1):
+        empty = (words >> np.uint64(64 - shift)) == 0
+        counts += np.where(empty, shift, 0).astype(np.int8)
+        words = np.where(empty, words << np.uint64(shift), words)
+    return counts + (words == 0)
+
+
+def hll_registers(values, groups, precision=HLL_PRECISION):
+    """
+    Build sparse HyperLogLog registers of the distinct values in each group.
+
+    Each value is hashed to 64 bits; the top `precision` bits pick one of the 2 ** precision registers and
+    the register keeps the highest rank (leading zeros plus one) seen in the rest. Only registers that
+    were set are returned, and registers of separate parts of the data merge by taking the highest rank,
+    so the distinct count of a group is estimated from a few bytes per distinct value at most, with a
+    standard error of 1.04 / sqrt(2 ** precision).
+
+    Args:
+        values (pandas.Series): The values to count, e.g. ListingKeys. Must not hold missing values.
+        groups (pandas.Series): The group of each value, e.g. its zip code.
+        precision (int, optional): The number of register bits. Defaults to HLL_PRECISION.
+
+    Returns:
+        pandas.DataFrame: The highest `Rank` of each `Register` set in each group `Value`.
+    """
+    return _max_ranks(*_hll_ranks(values, precision), groups, precision)
+
+
+def _hll_ranks(values, precision):
+    """
+    Hash values to the HyperLogLog register each one updates and the rank it offers that register.
+    """
+    hashes = pd.util.hash_array(np.asarray(values, dtype=object))
+    ranks = np.minimum(_leading_zeros(hashes << np.uint64(precision)), 64 - precision) + 1
+    return (hashes >> np.uint64(64 - precision)).astype(np.int64), ranks.astype(np.int8)
+
+
+def _max_ranks(registers, ranks, groups, precision):
+    """
+    Keep the highest rank per register of each group, sorted by group and register.
+    """
+    codes, uniques = pd.factorize(np.asarray(groups, dtype=object), sort=True)
+    counted = codes >= 0
+    # One integer key per group and register is much cheaper to group on than the pair
+    keys = (codes[counted].astype(np.int64) << precision) | registers[counted]
+    maxima = pd.Series(ranks[counted]).groupby(keys).max()
+    keys = maxima.index.to_numpy()
+    return pd.DataFrame({
+        'Value': uniques[keys >> precision],
+        'Register': (keys & ((1 << precision) - 1)).astype(np.int32),
+        'Rank': maxima.to_numpy(),
+    })
+
+
+def compute_sketches(df, capacity=SKETCH_CAPACITY, precision=HLL_PRECISION):
+    """
+    Summarize cleaned records into the sketches the dashboard answers approximate queries from.
+
+    Args:
+        df (pandas.DataFrame or pyarrow.Table): Cleaned open house records.
+        capacity (int, optional): The number of zip code counters kept. Defaults to SKETCH_CAPACITY.
+        precision (int, optional): The HyperLogLog register bits. Defaults to HLL_PRECISION.
+
+    Returns:
+        tuple: The SpaceSaving summary of 5-digit zip codes, and the `hll_registers` of distinct ListingKeys
+            per `Zipcode` and per `StartOfWeek`, told apart by their `Dimension`.
+    """
+    if isinstance(df, pa.Table):
+        df = df.select(['OpenHouseDate', 'Zipcode', 'ListingKey']).to_pandas()
+    zipcodes = df['Zipcode'].astype(object).str[:5]
+    top_zipcodes = SpaceSaving(capacity)
+    top_zipcodes.update(zipcodes)
+
+    listings = df['ListingKey'].astype(object)
+    counted = listings.notna().to_numpy()
+    # Each ListingKey is hashed once for both dimensions
+    ranks = _hll_ranks(listings[counted], precision)
+    groups = {'StartOfWeek': _start_of_week(df['OpenHouseDate']), 'Zipcode': zipcodes}
+    registers = pd.concat([
+        _max_ranks(*ranks, values[counted], precision).assign(Dimension=dimension)
+        for dimension, values in groups.items()
+    ], ignore_index=True)
+    return top_zipcodes, registers[['Dimension', 'Value', 'Register', 'Rank']]
+
+
+_WHITESPACE = re.compile(r'[ \t\n\r]*')
+
+
+def iter_json_array(file, chunk_size=READ_CHUNK_SIZE):
+    """
+    Incrementally parse a top-level JSON array, yielding one element at a time.
+
+    Only `chunk_size` characters plus the element currently being decoded are held in memory,
+    so the size of the file does not affect the memory used to read it.
+
+    Args:
+        file (io.TextIOBase): An open text file positioned at the start of the JSON array.
+        chunk_size (int): The number of characters to read from the file at a time.
+
+    Yields:
+        object: Each decoded element of the array, in file order.
+
+    Raises:
+        ValueError: If the file is not a well formed JSON array.
+    """
+    decoder = json.JSONDecoder()
+    buffer, pos, eof = '', 0, False
+    state = 'start'
+    while True:
+        pos = _WHITESPACE.match(buffer, pos).end()
+        if pos == len(buffer):
+            if eof:
+                raise ValueError('Unexpected end of input while reading JSON array')
+            chunk = file.read(chunk_size)
+            eof = not chunk
+            buffer, pos = chunk, 0
+            continue
+
+        char = buffer[pos]
+        if state == 'start':
+            if char != '[':
+                raise ValueError('Expected input to be a top-level JSON array')
+            pos += 1
+            state = 'first'
+        elif state in ('first', 'value'):
+            if state == 'first' and char == ']':
+                return
+            try:
+                element, end = decoder.raw_decode(buffer, pos)
+            except json.JSONDecodeError:
+                if eof:
+                    raise
+                # The element is split across chunks, pull in more and decode again
+                chunk = file.read(chunk_size)
+                eof = not chunk
+                buffer, pos = buffer[pos:] + chunk, 0
+                continue
+            yield element
+            pos = end
+            state = 'separator'
+        else:
+            if char == ']':
+                return
+            if char != ',':
+                raise ValueError(f'Expected `,` or `]` in JSON array but found `{char}`')
+            pos += 1
+            state = 'value'
+
+
+def input_files(input_path):
+    """
+    List the input files behind an input path, which is a single file, a directory or a glob pattern.
+
+    Files in a directory starting with `_` or `.` are skipped, like in the processor's own output.
+    Files are returned sorted, which is the order their records are read in, so when two records of
+    a key have the same DateModified the one from the earlier file wins.
+
+    Args:
+        input_path (str): The path to a file, a directory of files or a glob pattern like `drops/*.json.gz`.
+
+    Returns:
+        list: The sorted paths of the input files.
+
+    Raises:
+        FileNotFoundError: If a directory or glob pattern holds no files.
+    """
+    if os.path.isdir(input_path):
+        paths = [os.path.join(input_path, name) for name in os.listdir(input_path) if not name.startswith(('_', '.'))]
+    elif any(char in input_path for char in '*?['):
+        paths = glob.glob(input_path)
+    else:
+        return [input_path]
+    paths = sorted(path for path in paths if os.path.isfile(path))
+    if not paths:
+        raise FileNotFoundError(f'No input files found at `{input_path}`')
+    return paths
+
+
+def open_input(path):
+    """
+    Open an input file as text, decompressing it on the fly if its extension is one of INPUT_CODECS.
+
+    Args:
+        path (str): The path to the input file.
+
+    Returns:
+        io.TextIOBase: The open text file.
+    """
+    codec = INPUT_CODECS.get(os.path.splitext(path)[1])
+    if codec is None:
+        return open(path, 'r')
+    return io.TextIOWrapper(pa.input_stream(path, compression=codec), encoding='utf-8')
+
+
+def load_json_records(path):
+    """
+    Read every record of an input file holding a JSON array or newline delimited JSON, possibly compressed.
+
+    Args:
+        path (str): The path to the input file.
+
+    Returns:
+        list: The decoded records, in file order.
+    """
+    with open_input(path) as file:
+        text = file.read()
+    if text.lstrip().startswith('['):
+        return json.loads(text)
+    return [json.loads(line) for line in text.splitlines() if line.strip()]
+
+
+def iter_json_records(path, chunk_size=READ_CHUNK_SIZE):
+    """
+    Incrementally read the records of an input file holding a JSON array or newline delimited JSON,
+    possibly compressed, holding only about `chunk_size` characters in memory at a time.
+
+    Args:
+        path (str): The path to the input file.
+        chunk_size (int): The number of characters to read from the file at a time.
+
+    Yields:
+        object: Each decoded record, in file order.
+    """
+    with open_input(path) as file:
+        head = ''
+        while not head:
+            chunk = file.read(chunk_size)
+            if not chunk:
+                break
+            head = chunk.lstrip()
+    with open_input(path) as file:
+        if head.startswith('['):
+            yield from iter_json_array(file, chunk_size)
+        else:
+            for line in file:
+                if line.strip():
+                    yield json.loads(line)
+
+
+def read_input_buffer(path):
+    """
+    Read an input file into a writable uint8 array, decompressing it if its extension is one of INPUT_CODECS.
+
+    Args:
+        path (str): The path to the input file.
+
+    Returns:
+        numpy.ndarray: The uncompressed contents of the file.
+    """
+    codec = INPUT_CODECS.get(os.path.splitext(path)[1])
+    if codec is None:
+        return np.fromfile(path, dtype=np.uint8)
+    with pa.input_stream(path, compression=codec) as stream:
+        return np.frombuffer(bytearray(stream.read_buffer()), dtype=np.uint8)
+
+
+# Classes of the bytes `json_array_to_ndjson` looks at, every other byte is class 0
+_QUOTE, _BACKSLASH, _OPEN, _CLOSE, _COMMA, _NEWLINE = range(1, 7)
+_JSON_CLASSES = bytearray(256)
+for _chars, _class in [(b'"', _QUOTE), (b'\\', _BACKSLASH), (b'{[', _OPEN), (b'}]', _CLOSE), (b',', _COMMA),
+                       (b'\r\n', _NEWLINE)]:
+    for _char in _chars:
+        _JSON_CLASSES[_char] = _class
+_JSON_CLASSES = bytes(_JSON_CLASSES)
+
+
+def json_array_to_ndjson(buffer, chunk_size=READ_CHUNK_SIZE):
+    """
+    Rewrite a top-level JSON array of objects into newline delimited JSON, in place.
+
+    Arrow's JSON reader only reads one object per line. As raw newlines cannot appear inside JSON
+    strings, every newline can be blanked out, after which the array brackets become blanks and the
+    commas between its elements become newlines. The bytes are classified with `bytes.translate`, and
+    strings and nesting are tracked with numpy over just the quotes, brackets and commas, so the rewrite
+    never calls Python per character. Input that is not an array is left as it is.
+
+    Args:
+        buffer (numpy.ndarray): The writable uint8 contents of the JSON file.
+        chunk_size (int): The number of bytes examined at a time.
+
+    Returns:
+        numpy.ndarray: The same buffer, now newline delimited JSON.
+    """
+    head = bytes(buffer[:chunk_size]).lstrip()
+    if not head.startswith(b'['):
+        return buffer
+
+    in_string, depth, begin = 0, 0, 0
+    while begin < len(buffer):
+        end = min(begin + chunk_size, len(buffer))
+        # Never end a chunk inside a run of backslashes, so every escape is decided within one chunk
+        while end < len(buffer) and buffer[end - 1] == ord('\\'):
+            end += 1
+        chunk = buffer[begin:end]
+        classes = np.frombuffer(bytes(chunk).translate(_JSON_CLASSES), dtype=np.uint8)
+        positions = np.flatnonzero(classes != 0)
+        kinds = classes[positions]
+
+        quotes = kinds == _QUOTE
+        backslashes = positions[kinds == _BACKSLASH]
+        if len(backslashes):
+            # In a run of backslashes every other one, from the first, escapes the character after it
+            run_starts = np.r_[True, np.diff(backslashes) != 1]
+            run_offsets = backslashes - backslashes[run_starts][np.cumsum(run_starts) - 1]
+            quotes &= ~np.isin(positions, backslashes[run_offsets % 2 == 0] + 1)
+        outside = ((np.cumsum(quotes, dtype=np.int32) + in_string) & 1) == 0
+        nesting = (outside & (kinds == _OPEN)).astype(np.int32) - (outside & (kinds == _CLOSE))
+        depths = np.cumsum(nesting, dtype=np.int32) + depth
+
+        chunk[positions[kinds == _NEWLINE]] = ord(' ')
+        chunk[positions[((nesting == 1) & (depths == 1)) | ((nesting == -1) & (depths == 0))]] = ord(' ')
+        chunk[positions[outside & (kinds == _COMMA) & (depths == 1)]] = ord('\n')
+        if len(positions):
+            in_string, depth = int(not outside[-1]), int(depths[-1])
+        begin = end
+    return buffer
+
+
+# Fixed width fields understood by `parse_timestamps`, %f is exactly three digits of milliseconds
+_FORMAT_FIELDS = {
+    '%Y': ('year', 4),
+    '%m': ('month', 2),
+    '%d': ('day', 2),
+    '%H': ('hour', 2),
+    '%M': ('minute', 2),
+    '%S': ('second', 2),
+    '%f': ('millisecond', 3),
+}
+
+_DAYS_IN_MONTH = np.array([0, 31, 28, 31, 30, 31, 30, 31, 31, 30, 31, 30, 31])
+
+# Years a nanosecond pandas timestamp can hold in full
+_MIN_YEAR, _MAX_YEAR = 1678, 2261
+
+
+def _compile_format(fmt):
+    """
+    Split a timestamp format into its fixed width fields and literal characters.
+
+    Returns:
+        tuple: The total width, a list of (field, start, width) and a list of (position, code point).
+    """
+    fields, literals, pos, i = [], [], 0, 0
+    while i < len(fmt):
+        directive = fmt[i:i + 2]
+        if directive in _FORMAT_FIELDS:
+            name, width = _FORMAT_FIELDS[directive]
+            fields.append((name, pos, width))
+            pos += width
+            i += 2
+        elif fmt[i] == '%':
+            raise ValueError(f'Unsupported directive `{directive}` in timestamp format `{fmt}`')
+        else:
+            literals.append((pos, ord(fmt[i])))
+            pos += 1
+            i += 1
+    return pos, fields, literals
+
+
+def _code_points(values, width):
+    """
+    Lay string values out as a matrix of code points, one spare column wider than `width` so longer
+    values, which numpy truncates, still show up as too long. Missing values become `None` or `nan`.
+
+    Returns:
+        tuple: The (rows, width + 1) uint32 matrix and the length of each value, capped at width + 1.
+    """
+    codes = values.to_numpy(dtype=f'U{width + 1}')
+    codes = codes.view(np.uint32).reshape(len(codes), width + 1)
+    return codes, (codes != 0).sum(axis=1)
+
+
+def parse_timestamps(values, formats=TIMESTAMP_FORMATS):
+    """
+    Strictly parse timestamp strings that exactly match one of the given formats, all taken as UTC.
+
+    Unlike `pd.to_datetime`, nothing is inferred. A value is only accepted if it has exactly the
+    shape of a format (so `20:00` never passes for a full timestamp) and its fields form a real
+    date and time. The check runs on the code points of all values at once with numpy, without a
+    per-value Python call, so feeds mixing in malformed values never hit pandas' slow fallback.
+
+    Arrow string arrays are checked on the bytes of their data buffer, without building Python strings.
+
+    Args:
+        values (pandas.Series or pyarrow.ChunkedArray): The raw values, anything that is not a string is rejected.
+        formats (iterable): The accepted formats, tried in order. They may use the fixed width
+            directives %Y, %m, %d, %H, %M, %S and %f (exactly three digits of milliseconds)
+            with any literal characters in between. Defaults to TIMESTAMP_FORMATS.
+
+    Returns:
+        pandas.Series or pyarrow.ChunkedArray: The parsed UTC timestamps, NaT or null where a value was rejected.
+    """
+    compiled = [_compile_format(fmt) for fmt in formats]
+    max_width = max(width for width, _, _ in compiled)
+    if isinstance(values, pa.ChunkedArray):
+        chunks = []
+        for chunk in values.chunks:
+            parsed = _parse_code_points(*_arrow_code_points(chunk, max_width), compiled)
+            chunks.append(pa.array(parsed, mask=np.isnat(parsed), type=pa.timestamp('ns', tz='UTC')))
+        return pa.chunked_array(chunks, type=pa.timestamp('ns', tz='UTC'))
+
+    parsed = _parse_code_points(*_code_points(values, max_width), compiled)
+    return pd.Series(pd.to_datetime(parsed, utc=True), index=values.index)
+
+
+def _arrow_code_points(array, width):
+    """
+    Lay the values of an Arrow string array out as a matrix of bytes, like `_code_points`. Nulls and
+    values of any other type come out empty.
+    """
+    width += 1
+    if not pa.types.is_string(array.type):
+        return np.zeros((len(array), width), dtype=np.uint8), np.zeros(len(array), dtype=np.int64)
+    offsets = np.frombuffer(array.buffers()[1], dtype=np.int32)[array.offset:array.offset + len(array) + 1]
+    data = array.buffers()[2]
+    data = np.frombuffer(data, dtype=np.uint8) if data is not None and data.size else np.zeros(1, dtype=np.uint8)
+    lengths = np.minimum(np.diff(offsets), width)
+    if array.null_count:
+        lengths[~array.is_valid().to_numpy(zero_copy_only=False)] = 0
+    positions = np.arange(width)
+    codes = data.take(offsets[:-1, None] + positions, mode='clip')
+    codes[positions >= lengths[:, None]] = 0
+    return codes, lengths
+
+
+def _parse_code_points(codes, lengths, compiled):
+    """
+    Parse a matrix of code points against compiled formats, returning naive UTC datetime64 values, NaT where rejected.
+    """
+    parsed = np.full(len(codes), np.datetime64('NaT'), dtype='datetime64[ns]')
+    pending = np.ones(len(codes), dtype=bool)
+    for width, fields, literals in compiled:
+        rows = np.flatnonzero(pending & (lengths == width))
+        candidates = codes[rows, :width]
+        ok = np.ones(len(rows), dtype=bool)
+        for pos, code in literals:
+            ok &= candidates[:, pos] == code
+
+        positions = [start + i for _, start, size in fields for i in range(size)]
+        # Code points below `0` wrap around as unsigned, so a single comparison checks for a digit
+        digits = candidates[:, positions] - codes.dtype.type(ord('0'))
+        ok &= (digits <= 9).all(axis=1)
+        digits = digits.astype(np.int64)
+        parts = {name: np.zeros(len(rows), dtype=np.int64) for name, _ in _FORMAT_FIELDS.values()}
+        parts['month'] += 1
+        parts['day'] += 1
+        column = 0
+        for name, _, size in fields:
+            parts[name] = digits[:, column]
+            for i in range(1, size):
+                parts[name] = parts[name] * 10 + digits[:, column + i]
+            column += size
+
+        year, month, day = parts['year'], parts['month'], parts['day']
+        leap = (year % 4 == 0) & ((year % 100 != 0) | (year % 400 == 0))
+        ok &= (year >= _MIN_YEAR) & (year <= _MAX_YEAR) & (month >= 1) & (month <= 12)
+        month = np.where(ok, month, 1)
+        ok &= (day >= 1) & (day <= _DAYS_IN_MONTH[month] + (leap & (month == 2)))
+        ok &= (parts['hour'] < 24) & (parts['minute'] < 60) & (parts['second'] < 60)
+
+        # numpy's calendar turns months since the epoch into days, the time of day is added as nanoseconds
+        months = (year[ok] - 1970) * 12 + month[ok] - 1
+        dates = months.astype('datetime64[M]').astype('datetime64[D]') + (day[ok] - 1)
+        seconds = (parts['hour'][ok] * 60 + parts['minute'][ok]) * 60 + parts['second'][ok]
+        nanos = seconds * 10 ** 9 + parts['millisecond'][ok] * 10 ** 6
+        parsed[rows[ok]] = dates.astype('datetime64[ns]') + nanos.astype('timedelta64[ns]')
+        pending[rows[ok]] = False
+    return parsed
+
+
+# Value of each hex digit by code point, 255 for anything else (the last slot catches every code point past ASCII)
+_HEX_DIGITS = np.full(129, 255, dtype=np.uint8)
+for _value, _digit in enumerate('0123456789abcdef'):
+    _HEX_DIGITS[ord(_digit)] = _HEX_DIGITS[ord(_digit.upper())] = _value
+
+
+def parse_hex_keys(values, size=16):
+    """
+    Pack hex string keys, like the 32 character MD5 keys of the feed, into fixed size binary values.
+
+    The digits of all values are decoded at once on their code points with numpy. A value that is
+    not exactly `2 * size` hex digits is rejected.
+
+    Args:
+        values (pandas.Series): The hex keys.
+        size (int, optional): The number of bytes in a key. Defaults to 16.
+
+    Returns:
+        pandas.Series: The keys as an Arrow backed `fixed_size_binary` column, null where a value was rejected.
+    """
+    codes, lengths = _code_points(values, 2 * size)
+    digits = _HEX_DIGITS.take(codes[:, :2 * size], mode='clip')
+    ok = (lengths == 2 * size) & (digits < 16).all(axis=1)
+    packed = (digits[:, 0::2] << 4) | digits[:, 1::2]
+    packed[~ok] = 0
+    validity = None if ok.all() else pa.array(ok).buffers()[1]
+    keys = pa.FixedSizeBinaryArray.from_buffers(pa.binary(size), len(packed),
+                                                [validity, pa.py_buffer(packed.tobytes())])
+    return pd.Series(pd.arrays.ArrowExtensionArray(keys), index=values.index, name=values.name)
+
+
+def split_zipcodes(values):
+    """
+    Split zip codes of the form `12345` or `12345-6789` into the 5-digit zip code and the optional +4 code.
+
+    Args:
+        values (pandas.Series): The raw zip codes.
+
+    Returns:
+        tuple: The 5-digit zip codes and the +4 codes as pandas.Series of strings. A zip code of any other
+            shape gets null for both, a 5-digit zip code gets null for its +4 code.
+    """
+    codes, lengths = _code_points(values, 10)
+    digits = codes - np.uint32(ord('0'))
+    zip5 = (digits[:, :5] <= 9).all(axis=1)
+    plus4 = zip5 & (lengths == 10) & (codes[:, 5] == ord('-')) & (digits[:, 6:10] <= 9).all(axis=1)
+    zip5 &= (lengths == 5) | plus4
+
+    def column(start, end, ok):
+        strings = np.ascontiguousarray(codes[:, start:end]).view(f'U{end - start}').ravel().astype(object)
+        strings[~ok] = None
+        return pd.Series(strings, index=values.index)
+
+    return column(0, 5, zip5), column(6, 10, plus4)
+
+
+def compact_dtypes(df):
+    """
+    Convert cleaned records to the compact schema, in place.
+
+    The HEX_KEY_COLUMNS become 16 byte `fixed_size_binary` columns, the zip code is split into a 5-digit
+    `Zipcode` and a `ZipcodePlus4` column, and the CATEGORY_COLUMNS become categoricals, which Parquet
+    stores dictionary encoded. Values that do not fit the compact schema become null. Converting a frame
+    that is already compact is cheap, which restores the categoricals `pd.concat` turns back into strings.
+
+    Args:
+        df (pandas.DataFrame): Cleaned open house records.
+
+    Returns:
+        pandas.DataFrame: The same DataFrame, in the compact schema.
+    """
+    for column in HEX_KEY_COLUMNS:
+        if column in df and not isinstance(df[column].dtype, pd.ArrowDtype):
+            df[column] = parse_hex_keys(df[column])
+    if 'Zipcode' in df and ZIP_PLUS4_COLUMN not in df:
+        zip5, plus4 = split_zipcodes(df['Zipcode'])
+        df['Zipcode'] = zip5
+        df.insert(df.columns.get_loc('Zipcode') + 1, ZIP_PLUS4_COLUMN, plus4)
+    for column in CATEGORY_COLUMNS:
+        if column in df and not isinstance(df[column].dtype, pd.CategoricalDtype):
+            df[column] = df[column].astype('category')
+    return df
+
+
+def to_arrow(df):
+    """
+    Convert cleaned records to an Arrow table whose schema does not depend on the data.
+
+    Categoricals always get int32 dictionary indices, where pandas would pick the narrowest type for
+    each frame, so part files written at different times can be read and concatenated together. The
+    pandas schema metadata is dropped as pandas cannot read back its description of Arrow backed
+    columns, and every column still round trips through its Arrow type without it.
+
+    Args:
+        df (pandas.DataFrame): Cleaned open house records.
+
+    Returns:
+        pyarrow.Table: The records without the DataFrame index.
+    """
+    table = pa.Table.from_pandas(df, preserve_index=False)
+    fields = [pa.field(field.name, pa.dictionary(pa.int32(), field.type.value_type))
+              if pa.types.is_dictionary(field.type) else field for field in table.schema]
+    return table.cast(pa.schema(fields))
+
+
+def latest_per_key(data, key='OpenHouseKey', order_by='DateModified'):
+    """
+    Keep the row with the greatest `order_by` value for each `key`, in a single hashed pass.
+
+    Keys are hashed into group codes, the max per group is found with one scatter, and the first row
+    reaching it is kept, so ties go to the earliest row in input order. Nothing is sorted, and the
+    kept rows come back in input order. Rows with a null key are dropped.
+
+    Args:
+        data (pandas.DataFrame or pyarrow.Table): The records to reduce.
+        key (str, optional): The column identifying a record. Defaults to 'OpenHouseKey'.
+        order_by (str, optional): The timestamp column that decides the latest record. Defaults to 'DateModified'.
+
+    Returns:
+        pandas.DataFrame or pyarrow.Table: One row per key, of the same type as `data`.
+    """
+    if isinstance(data, pa.Table):
+        encoded = data[key].combine_chunks().dictionary_encode()
+        codes = pc.fill_null(encoded.indices, -1).to_numpy()
+        group_count = len(encoded.dictionary)
+        order = pc.cast(data[order_by].combine_chunks(), pa.int64())
+        order = pc.fill_null(order, np.iinfo(np.int64).min).to_numpy()
+    else:
+        codes, uniques = pd.factorize(data[key])
+        group_count = len(uniques)
+        # NaT views as the smallest int64, so a missing timestamp never beats a real one
+        order = data[order_by].to_numpy(dtype='datetime64[ns]').view(np.int64)
+
+    # Null keys have code -1, which lands in the spare last slot and is dropped below
+    latest = np.full(group_count + 1, np.iinfo(np.int64).min)
+    np.maximum.at(latest, codes, order)
+    candidates = np.flatnonzero((order == latest[codes]) & (codes >= 0))
+    # The first candidate of each key is its earliest row at the max, drop_duplicates keeps it by hashing
+    first = pd.Series(codes[candidates]).drop_duplicates(keep='first').index.to_numpy()
+    rows = candidates[first]
+
+    if isinstance(data, pa.Table):
+        return data.take(pa.array(rows))
+    return data.take(rows)
+
+
+def current_rss():
+    """
+    Get the resident set size of this process in bytes, falling back to the lifetime peak off Linux.
+
+    Returns:
+        int: The RSS in bytes.
+    """
+    try:
+        fd = os.open('/proc/self/statm', os.O_RDONLY)
+        try:
+            return int(os.read(fd, 256).split()[1]) * os.sysconf('SC_PAGE_SIZE')
+        finally:
+            os.close(fd)
+    except OSError:
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+class StageMetrics:
+    """
+    Counters for one stage of the pipeline, accumulated over every time the stage runs.
+
+    Attributes:
+        name (str): The stage name.
+        calls (int): The number of times the stage ran, e.g. once per batch or shard.
+        wall_seconds (float): The total wall time spent in the stage.
+        cpu_seconds (float): The total CPU time of the process spent in the stage.
+        peak_rss_bytes (int): The highest RSS sampled while the stage ran.
+        rows_in (int): The number of rows handed to the stage.
+        rows_out (int): The number of rows the stage produced.
+        dropped (collections.Counter): The number of rows the stage dropped, per reason.
+        rejected (collections.Counter): The number of values the stage rejected, per column.
+    """
+
+    def __init__(self, name):
+        """
+        Initialize empty StageMetrics.
+
+        Args:
+            name (str): The stage name.
+        """
+        self.name = name
+        self.calls = 0
+        self.wall_seconds = 0.0
+        self.cpu_seconds = 0.0
+        self.peak_rss_bytes = 0
+        self.rows_in = 0
+        self.rows_out = 0
+        self.dropped = Counter()
+        self.rejected = Counter()
+
+    def merge(self, other):
+        """
+        Add the counters of another run of the same stage, keeping the highest peak RSS.
+
+        Args:
+            other (StageMetrics): The counters to add.
+        """
+        self.calls += other.calls
+        self.wall_seconds += other.wall_seconds
+        self.cpu_seconds += other.cpu_seconds
+        self.peak_rss_bytes = max(self.peak_rss_bytes, other.peak_rss_bytes)
+        self.rows_in += other.rows_in
+        self.rows_out += other.rows_out
+        self.dropped.update(other.dropped)
+        self.rejected.update(other.rejected)
+
+    def to_dict(self):
+        """
+        Get the counters as a JSON serializable dictionary.
+
+        Returns:
+            dict: The stage counters.
+        """
+        return {
+            'calls': self.calls,
+            'wall_seconds': round(self.wall_seconds, 6),
+            'cpu_seconds': round(self.cpu_seconds, 6),
+            'peak_rss_bytes': self.peak_rss_bytes,
+            'rows_in': self.rows_in,
+            'rows_out': self.rows_out,
+            'dropped': dict(self.dropped),
+            'rejected': dict(self.rejected),
+        }
+
+
+class RunMetrics:
+    """
+    Per-stage instrumentation for a processor run, exported as a JSON report or a Prometheus textfile.
+
+    Attributes:
+        stages (dict): The StageMetrics of each stage, in the order the stages first ran.
+        sample_interval (float): Seconds between RSS samples while `sampling`.
+    """
+
+    def __init__(self, sample_interval=0.01):
+        """
+        Initialize empty RunMetrics.
+
+        Args:
+            sample_interval (float, optional): Seconds between RSS samples. Defaults to 0.01.
+        """
+        self.stages = {}
+        self.sample_interval = sample_interval
+        self._running = []
+        self._lock = threading.Lock()
+
+    def __getstate__(self):
+        # Only the counters are sent to and from worker processes
+        return {'stages': self.stages, 'sample_interval': self.sample_interval}
+
+    def __setstate__(self, state):
+        self.__init__(state['sample_interval'])
+        self.stages = state['stages']
+
+    @contextmanager
+    def sampling(self):
+        """
+        Sample the RSS on one background thread for the duration of a `with` block, e.g. a whole run,
+        raising the peak memory of every stage running at the time.
+        """
+        done = threading.Event()
+
+        def sample():
+            while not done.wait(self.sample_interval):
+                rss = current_rss()
+                with self._lock:
+                    for metrics in self._running:
+                        metrics.peak_rss_bytes = max(metrics.peak_rss_bytes, rss)
+
+        sampler = threading.Thread(target=sample, name='openhouse-rss-sampler', daemon=True)
+        sampler.start()
+        try:
+            yield
+        finally:
+            done.set()
+            sampler.join()
+
+    @contextmanager
+    def stage(self, name, rows_in=0):
+        """
+        Measure one run of a stage. The block sets `rows_out`, `dropped` and `rejected` on the yielded StageMetrics.
+
+        Wall and CPU time come from the block, peak memory from the RSS when it starts and ends, and from
+        the samples taken meanwhile if the stage runs within `sampling`.
+
+        Args:
+            name (str): The stage name.
+            rows_in (int, optional): The number of rows handed to the stage.
+
+        Yields:
+            StageMetrics: The counters of this run, merged into the stage's totals when the block exits.
+        """
+        metrics = StageMetrics(name)
+        metrics.calls = 1
+        metrics.rows_in = rows_in
+        metrics.peak_rss_bytes = current_rss()
+        with self._lock:
+            self._running.append(metrics)
+        wall, cpu = time.perf_counter(), time.process_time()
+        try:
+            yield metrics
+        finally:
+            metrics.wall_seconds = time.perf_counter() - wall
+            metrics.cpu_seconds = time.process_time() - cpu
+            with self._lock:
+                self._running.remove(metrics)
+            metrics.peak_rss_bytes = max(metrics.peak_rss_bytes, current_rss())
+            self.stages.setdefault(name, StageMetrics(name)).merge(metrics)
+
+    def merge(self, other):
+        """
+        Add the stage counters of another RunMetrics, e.g. one collected in a worker process.
+
+        Args:
+            other (RunMetrics): The metrics to add.
+        """
+        for name, metrics in other.stages.items():
+            self.stages.setdefault(name, StageMetrics(name)).merge(metrics)
+
+    def report(self):
+        """
+        Get the run report.
+
+        Returns:
+            dict: The counters of each stage, keyed by stage name.
+        """
+        return {'stages': {name: metrics.to_dict() for name, metrics in self.stages.items()}}
+
+    def write_json(self, path):
+        """
+        Atomically write the run report as JSON.
+
+        Args:
+            path (str): The JSON file to write.
+        """
+        with open(f'{path}.tmp', 'w') as file:
+            json.dump(self.report(), file, indent=2)
+        os.replace(f'{path}.tmp', path)
+
+    def write_prometheus(self, path, prefix='openhouse_processor'):
+        """
+        Atomically write the stage counters in the Prometheus text format, for the node exporter's textfile collector.
+
+        Args:
+            path (str): The `.prom` file to write.
+            prefix (str, optional): The metric name prefix. Defaults to 'openhouse_processor'.
+        """
+        gauges = [
+            ('stage_wall_seconds', 'Wall time spent in the stage.', 'wall_seconds'),
+            ('stage_cpu_seconds', 'CPU time spent in the stage.', 'cpu_seconds'),
+            ('stage_peak_rss_bytes', 'Peak resident memory while the stage ran.', 'peak_rss_bytes'),
+            ('stage_rows_in', 'Rows handed to the stage.', 'rows_in'),
+            ('stage_rows_out', 'Rows produced by the stage.', 'rows_out'),
+        ]
+        lines = []
+        for metric, help_text, attribute in gauges:
+            lines += [f'# HELP {prefix}_{metric} {help_text}', f'# TYPE {prefix}_{metric} gauge']
+            lines += [f'{prefix}_{metric}{{stage="{name}"}} {getattr(metrics, attribute)}'
+                      for name, metrics in self.stages.items()]
+        lines += [f'# HELP {prefix}_stage_rows_dropped Rows dropped by the stage, by reason.',
+                  f'# TYPE {prefix}_stage_rows_dropped gauge']
+        lines += [f'{prefix}_stage_rows_dropped{{stage="{name}",reason="{reason}"}} {count}'
+                  for name, metrics in self.stages.items() for reason, count in sorted(metrics.dropped.items())]
+        lines += [f'# HELP {prefix}_stage_values_rejected Values rejected by the stage, by column.',
+                  f'# TYPE {prefix}_stage_values_rejected gauge']
+        lines += [f'{prefix}_stage_values_rejected{{stage="{name}",column="{column}"}} {count}'
+                  for name, metrics in self.stages.items() for column, count in sorted(metrics.rejected.items())]
+        with open(f'{path}.tmp', 'w') as file:
+            file.write('\n'.join(lines) + '\n')
+        os.replace(f'{path}.tmp', path)
 
 
 class OpenHouseProcessor:
     """
-    A class to process open house data from a JSON file, clean and process the data,
+    A class to process open house data from JSON files, clean and process the data,
     and write the output to a Parquet file.
 
     Attributes:
-        input_path (str): The path to the input JSON file containing open house data.
+        input_path (str): The path to the input JSON file containing open house data, or a directory or
+            glob pattern of them. Files hold a JSON array or newline delimited JSON and may be compressed.
         output_path (str): The path to the output Parquet file to store cleaned data.
+        batch_size (int): If set, stream the input in batches of this many records instead of loading it whole.
+        workers (int): The number of processes used to clean and dedup shards of the input in parallel.
+        incremental (bool): If set, upsert only new and changed records into an output dataset directory.
+        late_records (str): How incremental runs treat records at or before the watermark, `compare` or `drop`.
+        partition_by (list): If set, write a hive partitioned dataset split on these columns.
+        row_group_size (int): The maximum number of rows per row group in the partitioned or clustered output.
+        compression (str): The compression codec used for the partitioned output.
+        use_dictionary (bool): Whether to dictionary encode columns in the partitioned output.
+        rollups (bool): Whether to also write pre-aggregated daily, weekly and zip code counts.
+        sketches (bool): Whether to also write the top zip code and distinct listing sketches.
+        lookups (bool): Whether to cluster the output on OpenHouseKey and index its ListingKeys for point lookups.
+        snapshot (bool): Whether to also write an Arrow IPC snapshot of the columns the dashboard queries.
+        timestamp_formats (tuple): The exact timestamp formats accepted, or None to let pandas infer them.
+        dedup (str): How the latest record per OpenHouseKey is found, `hash` or `sort`.
+        metrics_path (str): Where to write the JSON run report, if anywhere.
+        prometheus_path (str): Where to write the Prometheus textfile, if anywhere.
+        compact (bool): Whether the cleaned records use the compact schema of `compact_dtypes`.
+        engine (str): Whether records are cleaned as pandas DataFrames, as Arrow tables, or out of core by DuckDB.
+        read_workers (int): The number of threads reading, decompressing and parsing input files at once.
+        memory_limit (str): The memory limit of DuckDB in the duckdb engine.
+        temp_directory (str): Where the duckdb engine spills records, if not next to the output.
+        metrics (RunMetrics): The per-stage instrumentation of the current run.
+        rejections (collections.Counter): The number of values rejected per column by `process_data` in the
+            current run, the `rejected` counts of its validate stage.
     """
 
-    def __init__(self, input_path, output_path):
+    def __init__(self, input_path, output_path, batch_size=None, workers=1, incremental=False,
+                 partition_by=None, row_group_size=ROW_GROUP_SIZE, compression='snappy', use_dictionary=True,
+                 rollups=False, timestamp_formats=TIMESTAMP_FORMATS, dedup='hash', sketches=False,
+                 metrics_path=None, prometheus_path=None, compact=False, engine='pandas', read_workers=READ_WORKERS,
+                 memory_limit=OUT_OF_CORE_MEMORY_LIMIT, temp_directory=None, lookups=False, snapshot=False,
+                 late_records='compare'):
         """
         Initialize the OpenHouseProcessor with input and output paths.
 
         Args:
-            input_path (str): The path to the input JSON file containing open house data.
+            input_path (str): The path to the input JSON file containing open house data, or a directory or
+                glob pattern of them, see `input_files`. Each file holds a JSON array or newline delimited
+                JSON and is decompressed while reading if its extension is one of INPUT_CODECS.
             output_path (str): The path to the output Parquet file to store cleaned data.
+            batch_size (int, optional): The number of records per batch when streaming the input.
+                Defaults to None, which reads the whole file at once.
+            workers (int, optional): The number of processes used by `process_data_parallel`.
+                Defaults to 1, which processes the data serially.
+            incremental (bool, optional): Whether to upsert into the existing output with `upsert_data`.
+                Defaults to False, which rewrites the output from scratch.
+            partition_by (list, optional): Columns to partition the output on with `write_partitioned`, any of
+                `OpenHouseMonth` and `State`. Defaults to None, which writes a single Parquet file.
+            row_group_size (int, optional): The maximum number of rows per row group. Defaults to ROW_GROUP_SIZE.
+            compression (str, optional): The Parquet compression codec. Defaults to 'snappy'.
+            use_dictionary (bool, optional): Whether to dictionary encode columns. Defaults to True.
+            rollups (bool, optional): Whether to write rollups next to the output with `write_rollups`.
+                Defaults to False.
+            sketches (bool, optional): Whether to write sketches for approximate top zip codes and
+                distinct listings next to the output with `write_sketches`. Defaults to False.
+            timestamp_formats (tuple, optional): The formats `parse_timestamps` accepts for the timestamp
+                columns. Defaults to TIMESTAMP_FORMATS, UTC ISO-8601. None falls back to the format
+                inferring `pd.to_datetime`, which also accepts values like `20:00` as today's date.
+            dedup (str, optional): `hash` for the single pass `latest_per_key`, or `sort` to sort on
+                DateModified and drop duplicates. Defaults to 'hash'.
+            metrics_path (str, optional): A JSON file to write the per-stage run report to after `run`.
+            prometheus_path (str, optional): A `.prom` file to write the per-stage metrics to after `run`.
+            compact (bool, optional): Whether to convert the cleaned records to the compact schema with
+                `compact_dtypes`. Records whose OpenHouseKey is not a 32 digit hex key are dropped.
+                Defaults to False, which keeps every column as strings.
+            engine (str, optional): `pandas`, or `arrow` to read with Arrow's multithreaded JSON reader and
+                clean, dedup and write Arrow tables with `read_table` and `process_table`, which give the
+                same output. `duckdb` validates and dedups inputs larger than memory with
+                `process_out_of_core`, which also gives the same output. Defaults to 'pandas'.
+            read_workers (int, optional): The number of threads reading, decompressing and parsing input
+                files at once when the input has several. Defaults to READ_WORKERS.
+            memory_limit (str, optional): The memory DuckDB may use in the duckdb engine before spilling to
+                disk, such as '512MB'. Defaults to OUT_OF_CORE_MEMORY_LIMIT.
+            temp_directory (str, optional): The directory the duckdb engine spills records to. Defaults to
+                None, which spills next to the output.
+            lookups (bool, optional): Whether to write the output sorted on OpenHouseKey in row groups of
+                `row_group_size` with `write_clustered`, and index the row groups holding each ListingKey with
+                `write_listing_index`, so `OpenHouseLookup` reads a single row group per lookup. Defaults to False.
+            snapshot (bool, optional): Whether to write the columns the dashboard queries to the rollup
+                directory with `write_snapshot`, for dashboards to memory-map. Defaults to False.
+            late_records (str, optional): What `skip_applied` does with records at or before the watermark
+                in incremental runs. `compare` checks them against the key index and applies the ones whose
+                key is new or that are newer than the stored record, for inputs arriving out of order. `drop`
+                skips them without reading the index, for feeds that resend records already applied in
+                order. Defaults to 'compare'.
+
+        Raises:
+            ValueError: If both incremental and partitioned output are requested, lookups are requested for
+                either, `late_records` is neither `compare` nor `drop`, the arrow engine is combined with
+                batches, workers, the compact schema or inferred timestamps, or the duckdb engine with anything
+                but a plain Parquet file output.
         """
+        if incremental and partition_by:
+            raise ValueError('Incremental mode does not support partitioned output')
+        if lookups and (incremental or partition_by):
+            raise ValueError('Lookups need the output in a single Parquet file')
+        if late_records not in ('compare', 'drop'):
+            raise ValueError(f'Unknown late_records policy {late_records!r}, use `compare` or `drop`')
+        if engine == 'arrow' and (batch_size or workers > 1 or compact or timestamp_formats is None):
+            raise ValueError('The arrow engine reads the whole input on its own threads and does not support '
+                             'batches, workers, the compact schema or inferred timestamps')
+        if engine == 'duckdb' and (workers > 1 or compact or incremental or partition_by or rollups or sketches):
+            raise ValueError('The duckdb engine streams the records to a single Parquet file and does not support '
+                             'workers, the compact schema, incremental or partitioned output, rollups or sketches')
         self.input_path = os.path.abspath(input_path)
         self.output_path = os.path.abspath(output_path)
+        self.batch_size = batch_size
+        self.workers = workers
+        self.incremental = incremental
+        self.late_records = late_records
+        self.partition_by = list(partition_by or [])
+        self.row_group_size = row_group_size
+        self.compression = compression
+        self.use_dictionary = use_dictionary
+        self.rollups = rollups
+        self.sketches = sketches
+        self.timestamp_formats = timestamp_formats
+        self.dedup = dedup
+        self.metrics_path = metrics_path
+        self.prometheus_path = prometheus_path
+        self.compact = compact
+        self.engine = engine
+        self.read_workers = read_workers
+        self.memory_limit = memory_limit
+        self.temp_directory = temp_directory
+        self.lookups = lookups
+        self.snapshot = snapshot
+        self.metrics = RunMetrics()
+
+    @property
+    def rejections(self):
+        """
+        Get the number of values rejected per column in the current run, from its validate stage.
+        """
+        stage = self.metrics.stages.get('validate')
+        return stage.rejected if stage is not None else Counter()
 
     def read_data(self):
         """
-        Read the raw open house data from the input JSON file.
+        Read the raw open house data from the input JSON files.
 
-        Note, if the input is too large to handle with a single read, it is recommended to use
-        techniques like sharding or multiprocessing to read the data in parallel and combine the results.
-        Alternatively, you can consider using distributed computing frameworks like MapReduce to process
-        the large dataset efficiently.
+        Several files are read, decompressed and parsed concurrently by `read_workers` threads, and their
+        records are concatenated in file order.
 
         Returns:
             list: A list of dictionaries containing the open house data.
         """
-        with open(self.input_path, 'r') as file:
-            data = json.load(file)
+        paths = input_files(self.input_path)
+        with self.metrics.stage('read') as stage:
+            if len(paths) == 1:
+                data = load_json_records(paths[0])
+            else:
+                with ThreadPoolExecutor(max_workers=self.read_workers) as executor:
+                    data = list(itertools.chain.from_iterable(executor.map(load_json_records, paths)))
+            stage.rows_out = len(data)
         return data
 
+    def read_batches(self, batch_size=None):
+        """
+        Stream the raw open house data from the input JSON files in fixed size batches.
+
+        The files are parsed incrementally one after another, so peak memory is bounded by `batch_size`
+        rather than by the size of the input.
+
+        Args:
+            batch_size (int, optional): The number of records per batch. Defaults to None, which uses `batch_size`.
+
+        Yields:
+            pandas.DataFrame: A DataFrame holding up to `batch_size` raw records.
+        """
+        records = itertools.chain.from_iterable(iter_json_records(path) for path in input_files(self.input_path))
+        while True:
+            with self.metrics.stage('read') as stage:
+                batch = pd.DataFrame(itertools.islice(records, batch_size or self.batch_size))
+                stage.rows_out = len(batch)
+            if batch.empty:
+                return
+            yield batch
+
+    def read_table(self):
+        """
+        Read the raw open house data from the input JSON files into an Arrow table.
+
+        Each file is decompressed and rewritten in memory into newline delimited JSON with
+        `json_array_to_ndjson`, then parsed by Arrow's JSON reader, in blocks on its own threads and
+        without creating Python objects. Several files are read by `read_workers` threads at once and
+        their tables concatenated in file order.
+
+        Returns:
+            pyarrow.Table: The raw open house records.
+        """
+        paths = input_files(self.input_path)
+        with self.metrics.stage('read') as stage:
+            # Arrow infers dates such as OpenHouseDate as timestamps, so fields the first record holds as strings
+            # are read as strings. They come first in its order, which is also the column order pandas gives.
+            first = next(iter_json_records(paths[0]), {})
+            schema = pa.schema([(name, pa.string()) for name, value in first.items()
+                                if value is None or isinstance(value, str)])
+            if len(paths) == 1:
+                table = self._read_table_file(paths[0], schema)
+            else:
+                with ThreadPoolExecutor(max_workers=self.read_workers) as executor:
+                    tables = list(executor.map(self._read_table_file, paths, itertools.repeat(schema)))
+                table = pa.concat_tables(tables, promote=True)
+            stage.rows_out = table.num_rows
+        return table
+
+    @staticmethod
+    def _read_table_file(path, schema):
+        """
+        Read one input file into an Arrow table, with the given fields read as strings.
+        """
+        buffer = json_array_to_ndjson(read_input_buffer(path))
+        return pj.read_json(pa.BufferReader(pa.py_buffer(buffer)),
+                            read_options=pj.ReadOptions(block_size=ARROW_BLOCK_SIZE),
+                            parse_options=pj.ParseOptions(explicit_schema=schema))
+
+    def process_table(self, table):
+        """
+        Clean raw open house records held in an Arrow table, like `process_data` does for the pandas engine.
+
+        Timestamps are parsed by `parse_timestamps` on the Arrow buffers, invalid records are filtered
+        out and the latest record per key is kept with `latest_per_key`, all without converting to pandas.
+
+        Args:
+            table (pyarrow.Table): The raw open house records.
+
+        Returns:
+            pyarrow.Table: The valid records, one per OpenHouseKey, in the same order as `process_data`.
+        """
+        with self.metrics.stage('validate', rows_in=table.num_rows) as stage:
+            for column in TIMESTAMP_COLUMNS:
+                parsed = parse_timestamps(table[column], self.timestamp_formats)
+                table = table.set_column(table.schema.get_field_index(column), column, parsed)
+            required = ['OpenHouseKey', *TIMESTAMP_COLUMNS]
+            stage.rejected.update({column: table[column].null_count for column in required})
+            nulls = {column: table[column].is_null().to_numpy() for column in required}
+            table = table.filter(pa.array(self._count_drops(nulls, stage.dropped)))
+            stage.rows_out = table.num_rows
+        return self._dedup(table)
+
     def process_data(self, data):
         """
         Process the raw open house data by converting it to a pandas DataFrame,
@@ -52,47 +1338,962 @@ class OpenHouseProcessor:
         Returns:
             pandas.DataFrame: A cleaned DataFrame containing valid open house data records.
         """
-        # Convert data to DataFrame
-        df = pd.DataFrame(data)
-
-        # Drop records with null OpenHouseKey and invalid timestamps (convert timestamp then drop null types)
-        df['OpenHouseStartTime'] = pd.to_datetime(df['OpenHouseStartTime'], utc=True, errors='coerce')
-        df['OpenHouseEndTime'] = pd.to_datetime(df['OpenHouseEndTime'], utc=True, errors='coerce')
-        df.dropna(subset=['OpenHouseKey', 'OpenHouseStartTime', 'OpenHouseEndTime'], inplace=True)
+        with self.metrics.stage('validate', rows_in=len(data)) as stage:
+            df = self._validate(pd.DataFrame(data), stage)
+            if self.compact:
+                df = self._compact(df, stage)
+            stage.rows_out = len(df)
 
         # Keep only the latest record for each OpenHouseKey
-        df['DateModified'] = pd.to_datetime(df['DateModified'], utc=True)
-        df.sort_values('DateModified', ascending=False, inplace=True)
-        df.drop_duplicates('OpenHouseKey', keep='first', inplace=True)
+        return self._dedup(df)
+
+    def _validate(self, df, stage):
+        """
+        Parse the timestamp columns and drop invalid records, counting the rejected values of each column and
+        each dropped record under its first failed check on the validate stage's metrics.
+        """
+        dropped = stage.dropped
+        if self.timestamp_formats is None:
+            # Drop records with null OpenHouseKey and invalid timestamps (convert timestamp then drop null types)
+            df['OpenHouseStartTime'] = pd.to_datetime(df['OpenHouseStartTime'], utc=True, errors='coerce')
+            df['OpenHouseEndTime'] = pd.to_datetime(df['OpenHouseEndTime'], utc=True, errors='coerce')
+            self._count_drops({column: df[column].isna().to_numpy()
+                               for column in ['OpenHouseKey', 'OpenHouseStartTime', 'OpenHouseEndTime']}, dropped)
+            df.dropna(subset=['OpenHouseKey', 'OpenHouseStartTime', 'OpenHouseEndTime'], inplace=True)
+            df['DateModified'] = pd.to_datetime(df['DateModified'], utc=True)
+            return df
+
+        # Strictly parse every timestamp, then drop records with null OpenHouseKey or any rejected timestamp
+        for column in TIMESTAMP_COLUMNS:
+            df[column] = parse_timestamps(df[column], self.timestamp_formats)
+        required = ['OpenHouseKey', *TIMESTAMP_COLUMNS]
+        stage.rejected.update({column: int(df[column].isna().sum()) for column in required})
+        self._count_drops({column: df[column].isna().to_numpy() for column in required}, dropped)
+        df.dropna(subset=required, inplace=True)
+        return df
+
+    def _compact(self, df, stage):
+        """
+        Convert valid records to the compact schema, counting the values it rejects and dropping records
+        whose OpenHouseKey it rejected.
+        """
+        raw = {column: df[column].notna() for column in [*HEX_KEY_COLUMNS, 'Zipcode'] if column in df}
+        df = compact_dtypes(df)
+        stage.rejected.update({column: int((present & df[column].isna()).sum()) for column, present in raw.items()})
+        bad_key = df['OpenHouseKey'].isna()
+        stage.dropped['bad_key'] += int(bad_key.sum())
+        return df[~bad_key]
+
+    def _concat(self, frames):
+        """
+        Concatenate cleaned DataFrames, keeping the compact schema in compact mode.
+        """
+        df = pd.concat(frames)
+        return compact_dtypes(df) if self.compact else df
 
+    @staticmethod
+    def _count_drops(nulls, dropped):
+        """
+        Count the records with a null in any of the `nulls` masks, keyed by column, under a reason named
+        after the first null column, and return the mask of records without a null.
+        """
+        reasons = {
+            'OpenHouseKey': 'null_key',
+            'OpenHouseStartTime': 'bad_start_time',
+            'OpenHouseEndTime': 'bad_end_time',
+            'DateModified': 'bad_date_modified',
+        }
+        remaining = None
+        for column, null in nulls.items():
+            missing = null if remaining is None else remaining & null
+            dropped[reasons[column]] += int(missing.sum())
+            remaining = ~missing if remaining is None else remaining & ~missing
+        return remaining
+
+    def _dedup(self, df):
+        """
+        Run `keep_latest` as the dedup stage, counting the superseded records.
+        """
+        with self.metrics.stage('dedup', rows_in=len(df)) as stage:
+            df = self.keep_latest(df)
+            stage.rows_out = len(df)
+            stage.dropped['superseded'] += stage.rows_in - stage.rows_out
         return df
 
+    def keep_latest(self, df):
+        """
+        Reduce cleaned open house records to the latest record (using DateModified) for each OpenHouseKey.
+
+        Ties on DateModified go to the earliest record in input order with either dedup strategy, but
+        `hash` returns the records in input order while `sort` returns them newest first.
+
+        Args:
+            df (pandas.DataFrame or pyarrow.Table): Cleaned open house records with a parsed `DateModified` column.
+
+        Returns:
+            pandas.DataFrame or pyarrow.Table: One record per OpenHouseKey.
+        """
+        if self.dedup == 'hash':
+            return latest_per_key(df)
+        if isinstance(df, pa.Table):
+            # Arrow's sort is stable too, the first row of each key after it is the one drop_duplicates keeps
+            df = df.take(pc.sort_indices(df, sort_keys=[('DateModified', 'descending')]))
+            codes = df['OpenHouseKey'].combine_chunks().dictionary_encode().indices
+            _, first = np.unique(pc.fill_null(codes, -1).to_numpy(), return_index=True)
+            return df.take(pa.array(np.sort(first)))
+
+        # A stable sort keeps ties on DateModified in input order, so the earliest record among them wins
+        df = df.sort_values('DateModified', ascending=False, kind='mergesort')
+        return df.drop_duplicates('OpenHouseKey', keep='first')
+
+    def process_data_parallel(self, data):
+        """
+        Process the raw open house data in shards across a pool of `workers` processes.
+
+        Each worker cleans its shard and reduces it to the latest record per OpenHouseKey, then the
+        shard results are merged, in input order, keeping the newest DateModified for each key.
+        The output is identical to `process_data`, including the row order and index.
+
+        Args:
+            data (list): A list of dictionaries containing the raw open house data.
+
+        Returns:
+            pandas.DataFrame: A cleaned DataFrame containing valid open house data records.
+        """
+        shard_size = max(1, -(-len(data) // (self.workers * SHARDS_PER_WORKER)))
+        starts = range(0, len(data), shard_size)
+        shards = (data[start:start + shard_size] for start in starts)
+        with ProcessPoolExecutor(max_workers=self.workers) as executor:
+            results = list(executor.map(self._process_shard, starts, shards))
+        for _, metrics in results:
+            self.metrics.merge(metrics)
+        return self._dedup(self._concat(df for df, _ in results))
+
+    def _process_shard(self, start, shard):
+        """
+        Clean a shard of raw records, keeping the row labels the records would have in the full input,
+        and return it with the metrics collected in the worker.
+        """
+        self.metrics = RunMetrics(self.metrics.sample_interval)
+        with self.metrics.sampling():
+            df = self.process_data(shard)
+        df.index += start
+        return df, self.metrics
+
+    def process_batches(self, batches):
+        """
+        Process raw batches one at a time, folding each into the running set of latest records.
+
+        Only the current batch and one record per OpenHouseKey seen so far are held in memory.
+
+        Args:
+            batches (iterable): An iterable of raw open house DataFrames, e.g. from `read_batches`.
+
+        Returns:
+            tuple: The number of raw records consumed and the cleaned DataFrame of latest records.
+        """
+        raw_count = 0
+        latest = None
+        for batch in batches:
+            raw_count += len(batch)
+            cleaned = self.process_data(batch)
+            if latest is None:
+                latest = cleaned
+            else:
+                latest = self._dedup(self._concat([latest, cleaned]))
+        if latest is None:
+            latest = pd.DataFrame()
+        return raw_count, latest
+
+    def process_out_of_core(self):
+        """
+        Clean, dedup and write the open house data without ever holding more than a batch of it in memory.
+
+        Batches from `read_batches` are validated by `_validate`, like `process_data` does, and spilled to
+        Parquet files numbered in input order, which DuckDB reads as one by column name. DuckDB then sorts
+        the records on OpenHouseKey, DateModified descending and input order, so the first record of each
+        key is the one `keep_latest` keeps, and sorts those back into the order `keep_latest` returns them
+        in for the output file. Both sorts spill to disk once they outgrow `memory_limit`, and their results
+        are streamed in batches of `batch_size`.
+
+        Returns:
+            tuple: The number of raw records consumed and of cleaned records written.
+        """
+        batch_size = self.batch_size or ROW_GROUP_SIZE
+        directory = tempfile.mkdtemp(prefix='_open_house_',
+                                     dir=self.temp_directory or os.path.dirname(self.output_path))
+        con = duckdb.connect(config={'memory_limit': self.memory_limit, 'temp_directory': directory})
+        try:
+            raw_count, records_paths, schema = self._spill_batches(self.read_batches(batch_size), directory)
+            if schema is None:
+                pq.write_table(pa.table({}), self.output_path)
+                return raw_count, 0
+
+            latest_path = os.path.join(directory, 'latest.parquet')
+            spilled = sum(pq.ParquetFile(path).metadata.num_rows for path in records_paths)
+            with self.metrics.stage('dedup', rows_in=spilled) as stage:
+                records = con.execute(f'SELECT * FROM read_parquet(?, union_by_name=true) '
+                                      f'ORDER BY OpenHouseKey, DateModified DESC, {ROW_NUMBER_COLUMN}',
+                                      [records_paths])
+                stage.rows_out = self._write_first_per_key(records.fetch_record_batch(batch_size), latest_path)
+                stage.dropped['superseded'] += stage.rows_in - stage.rows_out
+
+            order = ROW_NUMBER_COLUMN if self.dedup == 'hash' else f'DateModified DESC, {ROW_NUMBER_COLUMN}'
+            if self.lookups:
+                order = 'OpenHouseKey'
+            with self.metrics.stage('write', rows_in=stage.rows_out) as write_stage:
+                # The timestamps were spilled as int64 nanoseconds, which DuckDB sorts without converting them
+                schema = pa.schema([pa.field(field.name, pa.timestamp('ns', tz='UTC'))
+                                    if field.name in TIMESTAMP_COLUMNS else field
+                                    for field in schema if field.name != ROW_NUMBER_COLUMN])
+                latest = con.execute(f'SELECT * FROM read_parquet(?) ORDER BY {order}', [latest_path])
+                with pq.ParquetWriter(self.output_path, schema) as writer:
+                    for batch in latest.fetch_record_batch(batch_size):
+                        writer.write_table(pa.Table.from_batches([batch]).select(schema.names).cast(schema),
+                                           row_group_size=self.row_group_size)
+                        write_stage.rows_out += batch.num_rows
+        finally:
+            con.close()
+            shutil.rmtree(directory)
+        print(f'Created file `{self.output_path}` with the cleaned results.')
+        return raw_count, write_stage.rows_out
+
+    def _spill_batches(self, batches, directory):
+        """
+        Validate raw batches and write the valid records of each to a Parquet file in `directory`, with their
+        position in the input and the timestamps as int64 nanoseconds, and return the number of raw records,
+        the paths of the files and the schema unifying theirs, None if there were no batches.
+
+        Like `process_data` on the whole input, the records get every field found in any batch, null where
+        they lack it. A field holding values of different types in different batches is an error.
+        """
+        raw_count = 0
+        paths, schemas = [], []
+        for batch in batches:
+            with self.metrics.stage('validate', rows_in=len(batch)) as stage:
+                df = self._validate(batch, stage)
+                stage.rows_out = len(df)
+            df[ROW_NUMBER_COLUMN] = df.index + raw_count
+            raw_count += stage.rows_in
+            table = pa.Table.from_pandas(df, preserve_index=False)
+            schema = pa.schema([(field.name, pa.int64() if pa.types.is_timestamp(field.type) else
+                                 pa.string() if pa.types.is_null(field.type) else field.type)
+                                for field in table.schema])
+            paths.append(os.path.join(directory, f'records-{len(paths):05d}.parquet'))
+            pq.write_table(table.cast(schema), paths[-1])
+            schemas.append(schema)
+        if not schemas:
+            return raw_count, paths, None
+        try:
+            return raw_count, paths, pa.unify_schemas(schemas)
+        except pa.ArrowInvalid as error:
+            raise ValueError(f'Input batches hold different types of the same field: {error}') from error
+
+    @staticmethod
+    def _write_first_per_key(batches, path):
+        """
+        Write the first record of each OpenHouseKey from batches sorted on the key to a Parquet file, carrying
+        the last key of each batch over to the next, and return the number of records written.
+        """
+        count = 0
+        previous = None
+        with pq.ParquetWriter(path, batches.schema) as writer:
+            for batch in batches:
+                if not batch.num_rows:
+                    continue
+                keys = batch.column('OpenHouseKey')
+                first = np.empty(batch.num_rows, dtype=bool)
+                first[0] = keys[0].as_py() != previous
+                first[1:] = pc.not_equal(keys[1:], keys[:-1]).to_numpy(zero_copy_only=False)
+                previous = keys[-1].as_py()
+                latest = batch.filter(pa.array(first))
+                writer.write_table(pa.Table.from_batches([latest]))
+                count += latest.num_rows
+        return count
+
     def write_data(self, df):
         """
         Write the cleaned open house data to a Parquet file.
 
         Note, we do not create an index on the output parquet file to keep
-        it smaller and more performant but if downstream processes will be
-        querying on unique keys like OpenHouseKey, we should consider setting.
+        it smaller and more performant. Downstream processes looking up
+        unique keys like OpenHouseKey should use the output of `lookups`,
+        see `write_clustered` and `write_listing_index`.
+
+        Args:
+            df (pandas.DataFrame or pyarrow.Table): The cleaned open house data.
+        """
+        if isinstance(df, pa.Table):
+            pq.write_table(df, self.output_path)
+        elif self.compact:
+            pq.write_table(to_arrow(df), self.output_path)
+        else:
+            df.to_parquet(self.output_path, index=False)
+        print(f'Created file `{self.output_path}` with the cleaned results.')
+
+    def _to_table(self, df, schema=None):
+        """
+        Convert cleaned records to an Arrow table for writing, with `to_arrow` in compact mode so part files
+        and slices share one schema, and otherwise with the pandas metadata `write_data` keeps too.
+        """
+        if self.compact:
+            return to_arrow(df)
+        return pa.Table.from_pandas(df, schema=schema, preserve_index=False)
+
+    def write_batches(self, df):
+        """
+        Write the cleaned open house data to a Parquet file in slices of `batch_size` rows.
+
+        Converting slice by slice avoids building an Arrow copy of the whole DataFrame at once.
 
         Args:
             df (pandas.DataFrame): The cleaned DataFrame containing open house data.
         """
-        df.to_parquet(self.output_path, index=False)
+        table = self._to_table(df.iloc[:self.batch_size])
+        with pq.ParquetWriter(self.output_path, table.schema) as writer:
+            writer.write_table(table)
+            for start in range(self.batch_size, len(df), self.batch_size):
+                writer.write_table(self._to_table(df.iloc[start:start + self.batch_size], table.schema))
         print(f'Created file `{self.output_path}` with the cleaned results.')
 
+    def write_clustered(self, df):
+        """
+        Write the cleaned open house data to a Parquet file sorted on OpenHouseKey, in row groups of
+        `row_group_size` rows.
+
+        Each key then falls within the min/max statistics of exactly one row group, which is all a
+        lookup by OpenHouseKey has to read.
+
+        Args:
+            df (pandas.DataFrame or pyarrow.Table): The cleaned open house data.
+        """
+        table = df if isinstance(df, pa.Table) else self._to_table(df)
+        table = table.take(pc.sort_indices(table['OpenHouseKey']))
+        pq.write_table(table, self.output_path, row_group_size=self.row_group_size)
+        print(f'Created file `{self.output_path}` clustered on OpenHouseKey with the cleaned results.')
+
+    def write_listing_index(self):
+        """
+        Write the sorted ListingKey to row group index of the output file to the rollup directory.
+
+        The index holds each distinct ListingKey of each row group, read back from the written file. Like the
+        rollups, it records the `data_fingerprint` of the file it describes, so readers can tell it is stale.
+        """
+        file = pq.ParquetFile(self.output_path)
+        tables = []
+        for row_group in range(file.num_row_groups):
+            keys = pc.drop_null(pc.unique(file.read_row_group(row_group, columns=['ListingKey'])['ListingKey']))
+            tables.append(pa.table({'ListingKey': keys, 'RowGroup': pa.array([row_group] * len(keys), pa.int32())}))
+        if tables:
+            index = pa.concat_tables(tables)
+        else:
+            index = pa.table({'ListingKey': pa.array([], file.schema_arrow.field('ListingKey').type),
+                              'RowGroup': pa.array([], pa.int32())})
+        index = index.take(pc.sort_indices(index, sort_keys=[('ListingKey', 'ascending'), ('RowGroup', 'ascending')]))
+
+        directory = rollup_path(self.output_path)
+        os.makedirs(directory, exist_ok=True)
+        path = os.path.join(directory, LISTING_INDEX_FILE)
+        self._write_summary(index, path)
+        print(f'Created listing index `{path}`.')
+
+    def write_snapshot(self):
+        """
+        Write an uncompressed Arrow IPC snapshot of the columns the dashboard queries to the rollup directory.
+
+        The columns are read back from the written output, whatever its layout, with dictionaries decoded
+        as the dashboard queries them as plain strings, so it can memory-map the snapshot and scan it
+        without decoding or copying. The snapshot records the `data_fingerprint` of the output it was
+        taken from, so readers can tell once it is stale and fall back to the Parquet output.
+        """
+        dataset = ds.dataset(self.output_path, format='parquet', partitioning='hive')
+        table = dataset.to_table(columns=[column for column in SNAPSHOT_COLUMNS if column in dataset.schema.names])
+        table = table.cast(pa.schema([pa.field(field.name, field.type.value_type)
+                                      if pa.types.is_dictionary(field.type) else field for field in table.schema]))
+        table = table.replace_schema_metadata({DATA_FILES_KEY: json.dumps(data_fingerprint(self.output_path))})
+
+        directory = rollup_path(self.output_path)
+        os.makedirs(directory, exist_ok=True)
+        path = os.path.join(directory, SNAPSHOT_FILE)
+        # Replacing the file rather than overwriting it leaves dashboards mapping the old one unaffected
+        with pa.OSFile(f'{path}.tmp', 'wb') as sink:
+            with pa.ipc.new_file(sink, table.schema) as writer:
+                writer.write_table(table)
+        os.replace(f'{path}.tmp', path)
+        print(f'Created snapshot `{path}`.')
+
+    def write_partitioned(self, df):
+        """
+        Write the cleaned open house data to a hive partitioned Parquet dataset at the output path.
+
+        Rows are sorted by OpenHouseDate then Zipcode within each partition and written with min/max
+        statistics, so readers like DuckDB can skip whole partitions from the directory names and
+        row groups from their statistics when filtering on date, state or zip code.
+
+        Args:
+            df (pandas.DataFrame or pyarrow.Table): The cleaned open house data.
+        """
+        # Arrow cannot sort dictionary columns, so decode them, the Parquet writer dictionary encodes them again
+        table = df if isinstance(df, pa.Table) else self._to_table(df)
+        table = table.cast(pa.schema([pa.field(field.name, field.type.value_type)
+                                      if pa.types.is_dictionary(field.type) else field for field in table.schema]))
+        if MONTH_COLUMN in self.partition_by:
+            table = table.append_column(MONTH_COLUMN, pc.utf8_slice_codeunits(table['OpenHouseDate'], 0, 7))
+        table = table.sort_by([(column, 'ascending') for column in [*self.partition_by, 'OpenHouseDate', 'Zipcode']])
+
+        # A full rewrite replaces every partition, so the dataset is written to a sibling directory and swapped
+        # in for the previous output, which stays whole until then and is removed afterwards
+        parent, name = os.path.split(self.output_path)
+        staging_path = os.path.join(parent, f'.{name}.{os.getpid()}.tmp')
+        if os.path.isdir(staging_path):
+            shutil.rmtree(staging_path)
+        os.makedirs(staging_path)
+        file_options = ds.ParquetFileFormat().make_write_options(
+            compression=self.compression, use_dictionary=self.use_dictionary, write_statistics=True
+        )
+        try:
+            ds.write_dataset(
+                table,
+                staging_path,
+                format='parquet',
+                partitioning=ds.partitioning(table.select(self.partition_by).schema, flavor='hive'),
+                file_options=file_options,
+                basename_template='part-{i}.parquet',
+                min_rows_per_group=self.row_group_size,
+                max_rows_per_group=self.row_group_size,
+            )
+        except Exception:
+            shutil.rmtree(staging_path)
+            raise
+        if not os.path.lexists(self.output_path):
+            os.replace(staging_path, self.output_path)
+        else:
+            # A directory cannot replace a non-empty one, so the previous output is first moved aside
+            previous_path = f'{staging_path}.old'
+            os.replace(self.output_path, previous_path)
+            os.replace(staging_path, self.output_path)
+            if os.path.isdir(previous_path):
+                shutil.rmtree(previous_path)
+            else:
+                os.remove(previous_path)
+        print(f'Created dataset `{self.output_path}` partitioned by {self.partition_by} with the cleaned results.')
+
+    def write_rollups(self, added, removed=None):
+        """
+        Write the daily, weekly and zip code rollups of the cleaned data to the rollup directory.
+
+        Without `removed` the rollups are rebuilt from `added`. With it, the counts of the added records
+        are applied to the stored rollups and the counts of the removed records are taken off, so an
+        incremental run only aggregates the records it changed. Either way the rollups record the
+        `data_fingerprint` of the output once it is written, and readers ignore rollups of other data.
+
+        Args:
+            added (pandas.DataFrame): The cleaned records to count.
+            removed (pandas.DataFrame, optional): Previously counted records that have been superseded.
+        """
+        directory = rollup_path(self.output_path)
+        os.makedirs(directory, exist_ok=True)
+        rollups = compute_rollups(added)
+        removed_rollups = compute_rollups(removed) if removed is not None else {}
+        for name, columns in ROLLUPS.items():
+            rollup = rollups[name]
+            path = os.path.join(directory, f'{name}.parquet')
+            if removed is not None:
+                parts = [rollup, removed_rollups[name].assign(OpenHouseCount=lambda r: -r['OpenHouseCount'])]
+                if os.path.exists(path):
+                    parts.append(pd.read_parquet(path))
+                rollup = pd.concat(parts).groupby(columns, dropna=False, as_index=False)['OpenHouseCount'].sum()
+                rollup = rollup[rollup['OpenHouseCount'] != 0]
+            self._write_summary(pa.Table.from_pandas(rollup, preserve_index=False), path)
+        print(f'Created rollups {list(ROLLUPS)} in `{directory}`.')
+
+    def rebuild_rollups(self):
+        """
+        Rebuild the rollups from the records of the output, as they are written.
+        """
+        output = self.read_output(['OpenHouseDate', 'Zipcode', 'State'])
+        if output is not None:
+            self.write_rollups(output)
+
+    def read_output(self, columns=None):
+        """
+        Read the records of the output back, from the live part files of an incremental dataset.
+
+        Args:
+            columns (list, optional): The columns to read. Defaults to None, which reads them all.
+
+        Returns:
+            pyarrow.Table: The records, or None if the output has no data files yet.
+        """
+        if not os.path.exists(self.output_path):
+            return None
+        if not os.path.isdir(self.output_path) or read_manifest(self.output_path) is None:
+            return ds.dataset(self.output_path, format='parquet', partitioning='hive').to_table(columns=columns)
+        tables = [pq.read_table(path, columns=columns) for path in parquet_files(self.output_path)]
+        return pa.concat_tables(tables, promote=True) if tables else None
+
+    def _write_summary(self, table, path):
+        """
+        Atomically write a rollup, sketch or index, recording the `data_fingerprint` of the output it summarizes.
+        """
+        # Schema metadata comes back with bytes keys, which the fingerprint replaces
+        fingerprint = json.dumps(data_fingerprint(self.output_path))
+        metadata = {**(table.schema.metadata or {}), DATA_FILES_KEY.encode(): fingerprint}
+        pq.write_table(table.replace_schema_metadata(metadata), f'{path}.tmp')
+        os.replace(f'{path}.tmp', path)
+
+    def _restamp_summaries(self, names):
+        """
+        Record the current `data_fingerprint` of the output in the rollup or sketch files of the given names.
+        """
+        for name in names:
+            path = os.path.join(rollup_path(self.output_path), name)
+            self._write_summary(pq.read_table(path), path)
+
+    def _summarizes_output(self, names):
+        """
+        Check the rollup or sketch files of the given names all summarize the output as it stands.
+        """
+        fingerprint = data_fingerprint(self.output_path)
+        return all(is_current(os.path.join(rollup_path(self.output_path), name), fingerprint) for name in names)
+
+    def write_sketches(self, added, removed=None):
+        """
+        Write the top zip code and distinct listing sketches of the cleaned data to the rollup directory.
+
+        Without `removed` the sketches are rebuilt from `added`. With it, the sketches of the added records
+        are merged into the stored ones and the removed records are taken off the zip code counters. The
+        distinct listing registers cannot forget a listing, so a record moving to another zip code or week
+        still counts towards its old one, which only matters for listings that actually move. Either way
+        the sketches record the `data_fingerprint` of the output once it is written, and readers ignore
+        sketches of other data.
+
+        Args:
+            added (pandas.DataFrame): The cleaned records to summarize.
+            removed (pandas.DataFrame, optional): Previously summarized records that have been superseded.
+        """
+        directory = rollup_path(self.output_path)
+        os.makedirs(directory, exist_ok=True)
+        top_path = os.path.join(directory, TOP_ZIPCODES_FILE)
+        registers_path = os.path.join(directory, DISTINCT_LISTINGS_FILE)
+        top_zipcodes, registers = compute_sketches(added)
+        if removed is not None and os.path.exists(top_path):
+            stored = SpaceSaving.from_arrow(pq.read_table(top_path))
+            stored.update(added['Zipcode'].astype(object).str[:5], removed['Zipcode'].astype(object).str[:5])
+            top_zipcodes = stored
+            registers = pd.concat([pd.read_parquet(registers_path), registers])
+            registers = registers.groupby(['Dimension', 'Value', 'Register'], as_index=False, sort=True)['Rank'].max()
+
+        registers = pa.Table.from_pandas(registers, preserve_index=False)
+        registers = registers.replace_schema_metadata({'precision': str(HLL_PRECISION)})
+        for table, path in ((top_zipcodes.to_arrow(), top_path), (registers, registers_path)):
+            self._write_summary(table, path)
+        print(f'Created sketches in `{directory}`.')
+
+    def rebuild_sketches(self):
+        """
+        Rebuild the sketches from the records of the output, as they are written.
+        """
+        output = self.read_output(['OpenHouseDate', 'Zipcode', 'ListingKey'])
+        if output is not None:
+            self.write_sketches(output)
+
+    def skip_applied(self, data, index=None):
+        """
+        Drop raw records an incremental run has already applied, before they are validated and deduped.
+
+        Records newer than the watermark always go on. Records at or before it are late: with
+        `late_records='compare'` they only go on if the key index does not hold their OpenHouseKey or holds
+        an older DateModified, the same comparison `upsert_data` makes, and with `drop` they are skipped.
+        Records whose DateModified does not parse go on, for the validate stage to reject and count. This
+        way a run validates and dedups the changes since the last run rather than the whole input.
+
+        Args:
+            data (pandas.DataFrame or pyarrow.Table): Raw open house records.
+            index (pandas.DataFrame, optional): The key index, if already read. Defaults to None, which
+                reads it once a late record needs comparing.
+
+        Returns:
+            pandas.DataFrame or pyarrow.Table: The records still to apply, DataFrames with a fresh index.
+        """
+        watermark, _ = self.read_watermark()
+        is_table = isinstance(data, pa.Table)
+        rows = data.num_rows if is_table else len(data)
+        with self.metrics.stage('skip', rows_in=rows) as stage:
+            stage.rows_out = rows
+            if watermark is None or not rows:
+                return data
+            raw = data['DateModified'].to_pandas() if is_table else data['DateModified']
+            if self.timestamp_formats is None:
+                modified = pd.to_datetime(raw, utc=True, errors='coerce')
+            else:
+                modified = parse_timestamps(raw.astype(object), self.timestamp_formats)
+            skip = (modified <= watermark).to_numpy()
+            if self.late_records == 'compare' and skip.any():
+                index = self.read_key_index() if index is None else index
+                keys = (data['OpenHouseKey'].to_pandas() if is_table else data['OpenHouseKey'])[skip]
+                if self.compact:
+                    keys = parse_hex_keys(keys.astype(object))
+                # The index holds plain key values, which compact keys are converted to for the lookup
+                current = index['DateModified'].reindex(keys.to_numpy(dtype=object))
+                skip[skip] = (modified[skip].to_numpy(dtype='datetime64[ns]')
+                              <= current.to_numpy(dtype='datetime64[ns]'))
+            stage.rows_out = rows - int(skip.sum())
+            stage.dropped['applied'] += int(skip.sum())
+            if is_table:
+                return data.filter(pa.array(~skip))
+            return data[~skip].reset_index(drop=True)
+
+    def upsert_data(self, df):
+        """
+        Upsert the cleaned open house data into the Parquet dataset directory at the output path.
+
+        The directory keeps a watermark (the max DateModified applied so far), which `run` has `skip_applied`
+        compare the raw records against before cleaning them, and a key index mapping each OpenHouseKey to
+        its DateModified and the part file holding it. A record is applied when its key is
+        new or it is newer than the stored record of its key, so the "latest record wins" rules of
+        `process_data` hold across runs, also for records arriving after newer records of other keys.
+        The new records land in a new part file and only the part files holding superseded keys are
+        rewritten, so the cost of a run follows the volume of changes rather than the size of the history.
+        Rewritten files get new part numbers rather than being overwritten, and the manifest lists the new
+        set of files only once they are all in place, so readers resolving the files through the manifest
+        see each record exactly once. Applying the same records twice changes nothing, so a run that
+        failed part way can be repeated.
+
+        Args:
+            df (pandas.DataFrame or pyarrow.Table): The cleaned open house data.
+
+        Returns:
+            int: The number of records upserted.
+        """
+        if isinstance(df, pa.Table):
+            df = df.to_pandas()
+        os.makedirs(self.output_path, exist_ok=True)
+        watermark, next_part = self.read_watermark()
+        index = self.read_key_index()
+        # The rollups and sketches only take this upsert's changes if they summarize the dataset as it stands,
+        # otherwise, like on the first run writing them, they are rebuilt from the whole dataset afterwards
+        rollups_current = self._summarizes_output([f'{name}.parquet' for name in ROLLUPS])
+        sketches_current = self._summarizes_output([TOP_ZIPCODES_FILE, DISTINCT_LISTINGS_FILE])
+
+        # The index holds plain key values, which compact keys are converted to for the lookup
+        current = index['DateModified'].reindex(df['OpenHouseKey'].to_numpy(dtype=object)).set_axis(df.index)
+        df = df[current.isna() | (df['DateModified'] > current)]
+        if df.empty:
+            print(f'No new records to upsert into `{self.output_path}`.')
+            if self.rollups and not rollups_current:
+                self.rebuild_rollups()
+            if self.sketches and not sketches_current:
+                self.rebuild_sketches()
+            return 0
+
+        # Files of the current version are never modified, the manifest drops them once their
+        # replacements are in place
+        file_name = f'part-{next_part:05d}.parquet'
+        new_table = self._to_table(df)
+        self._write_table(new_table, file_name)
+        next_part += 1
+        affected = index[index.index.isin(df['OpenHouseKey'].to_numpy(dtype=object))]
+        keys = pa.array(affected.index.to_numpy(), type=new_table.schema.field('OpenHouseKey').type)
+        removed = []
+        for affected_file in affected['File'].unique():
+            table = pq.read_table(os.path.join(self.output_path, affected_file))
+            superseded = pc.is_in(table['OpenHouseKey'], value_set=keys)
+            removed.append(table.filter(superseded))
+            table = table.filter(pc.invert(superseded))
+            if table.num_rows:
+                rewritten = f'part-{next_part:05d}.parquet'
+                self._write_table(table, rewritten)
+                next_part += 1
+                index.loc[index['File'] == affected_file, 'File'] = rewritten
+
+        added = pd.DataFrame(
+            {'DateModified': df['DateModified'].to_numpy(), 'File': file_name},
+            index=pd.Index(df['OpenHouseKey'].to_numpy(dtype=object), name='OpenHouseKey'),
+        )
+        index = pd.concat([index.drop(affected.index), added])
+        self._write_key_index(index)
+        removed = pa.concat_tables(removed, promote=True).to_pandas() if removed else df.iloc[:0]
+        watermark = df['DateModified'].max() if watermark is None else max(watermark, df['DateModified'].max())
+        self._write_watermark(watermark, next_part)
+        self.write_manifest(index)
+        if self.rollups and rollups_current:
+            self.write_rollups(df, removed)
+        elif self.rollups:
+            self.rebuild_rollups()
+        if self.sketches and sketches_current:
+            self.write_sketches(df, removed)
+        elif self.sketches:
+            self.rebuild_sketches()
+        print(f'Upserted {len(df)} records into `{self.output_path}`, replacing {len(affected)} existing records.')
+        return len(df)
+
+    def read_watermark(self):
+        """
+        Read the incremental state stored in the output dataset directory.
+
+        Returns:
+            tuple: The watermark as a UTC pandas.Timestamp (None before the first run) and the next part number.
+        """
+        path = os.path.join(self.output_path, WATERMARK_FILE)
+        if not os.path.exists(path):
+            return None, 0
+        with open(path, 'r') as file:
+            state = json.load(file)
+        return pd.Timestamp(state['watermark']), state['next_part']
+
+    def read_key_index(self):
+        """
+        Read the OpenHouseKey index stored in the output dataset directory.
+
+        Returns:
+            pandas.DataFrame: The `DateModified` and `File` of each stored OpenHouseKey, indexed by key.
+        """
+        path = os.path.join(self.output_path, KEY_INDEX_FILE)
+        if not os.path.exists(path):
+            return pd.DataFrame(
+                {'DateModified': pd.Series(dtype='datetime64[ns, UTC]'), 'File': pd.Series(dtype=object)},
+                index=pd.Index([], name='OpenHouseKey', dtype=object),
+            )
+        return pd.read_parquet(path).set_index('OpenHouseKey')
+
+    def _write_key_index(self, index):
+        """
+        Atomically write the OpenHouseKey index to the output dataset directory.
+        """
+        path = os.path.join(self.output_path, KEY_INDEX_FILE)
+        index.reset_index().to_parquet(f'{path}.tmp', index=False)
+        os.replace(f'{path}.tmp', path)
+
+    def _write_watermark(self, watermark, next_part):
+        """
+        Atomically write the incremental state to the output dataset directory.
+        """
+        path = os.path.join(self.output_path, WATERMARK_FILE)
+        with open(f'{path}.tmp', 'w') as file:
+            json.dump({'watermark': None if watermark is None else watermark.isoformat(), 'next_part': next_part}, file)
+        os.replace(f'{path}.tmp', path)
+
+    def read_manifest(self):
+        """
+        Read the manifest of the output dataset directory.
+
+        Returns:
+            dict: The manifest written by `write_manifest`, or None before the first upsert.
+        """
+        return read_manifest(self.output_path)
+
+    def write_manifest(self, index=None):
+        """
+        Atomically write the manifest of the output dataset directory, listing its live part files, then
+        remove the part files it leaves out.
+
+        The live part files are the ones the key index points at. Each upsert and merge writes its files
+        and the key index, then a new version of the manifest, so readers resolving the files through the
+        manifest switch from one complete set of files to the next. Files left out, superseded by this
+        version or left behind by an interrupted run, are removed afterwards.
+
+        Args:
+            index (pandas.DataFrame, optional): The key index just written. Defaults to None, which reads it.
+
+        Returns:
+            dict: The manifest written.
+        """
+        index = self.read_key_index() if index is None else index
+        previous = self.read_manifest()
+        watermark, _ = self.read_watermark()
+        files = self._live_files(index)
+        manifest = {
+            'version': previous['version'] + 1 if previous else 1,
+            'updated': pd.Timestamp.now(tz='UTC').isoformat(),
+            'watermark': None if watermark is None else watermark.isoformat(),
+            'rows': sum(file['rows'] for file in files),
+            'files': files,
+        }
+        path = os.path.join(self.output_path, MANIFEST_FILE)
+        with open(f'{path}.tmp', 'w') as file:
+            json.dump(manifest, file, indent=2)
+        os.replace(f'{path}.tmp', path)
+
+        live = {file['name'] for file in files}
+        for name in os.listdir(self.output_path):
+            if name.endswith('.parquet') and not name.startswith(('_', '.')) and name not in live:
+                os.remove(os.path.join(self.output_path, name))
+        return manifest
+
+    def _live_files(self, index):
+        """
+        List the part files the key index points at with their row counts and sizes.
+        """
+        files = []
+        for name in sorted(index['File'].unique()):
+            path = os.path.join(self.output_path, name)
+            files.append({'name': name, 'rows': pq.read_metadata(path).num_rows, 'bytes': os.path.getsize(path)})
+        return files
+
+    def merge_small_files(self, target_rows=TARGET_FILE_ROWS, max_groups=None):
+        """
+        Merge the small part files of the output dataset directory into files of up to `target_rows` rows.
+
+        Frequent small upserts leave many small part files, which slow down every scan of the dataset.
+        Live part files under `target_rows` rows are merged, in part number order, into new part files of
+        up to `target_rows` rows. Only the rows the key index points at are kept. The merged files and the
+        key index are written before the manifest lists the merged files in place of the small ones, so
+        readers resolving the files through the manifest see each record exactly once, and the small
+        files are removed once they are no longer listed.
+
+        Args:
+            target_rows (int, optional): The most rows of a merged part file. Defaults to TARGET_FILE_ROWS.
+            max_groups (int, optional): The most merged files to write, so a caller holding off upserts
+                meanwhile can merge a little at a time. Defaults to None, which merges every small file.
+
+        Returns:
+            int: The number of part files merged.
+        """
+        watermark, next_part = self.read_watermark()
+        index = self.read_key_index()
+        rollup_files = [f'{name}.parquet' for name in ROLLUPS]
+        rollups_current = self._summarizes_output(rollup_files)
+        sketch_files = [TOP_ZIPCODES_FILE, DISTINCT_LISTINGS_FILE]
+        sketches_current = self._summarizes_output(sketch_files)
+        small = [file for file in self._live_files(index) if file['rows'] < target_rows]
+        groups, group, group_rows = [], [], 0
+        for file in small:
+            if group and group_rows + file['rows'] > target_rows:
+                groups.append(group)
+                group, group_rows = [], 0
+            group.append(file['name'])
+            group_rows += file['rows']
+        groups = [group for group in groups + [group] if len(group) > 1][:max_groups]
+        if not groups:
+            print(f'No small part files to merge in `{self.output_path}`.')
+            return 0
+
+        for group in groups:
+            tables = []
+            for name in group:
+                table = pq.read_table(os.path.join(self.output_path, name))
+                current = index.reindex(table['OpenHouseKey'].to_pandas().to_numpy(dtype=object))
+                modified = table['DateModified'].to_pandas().values
+                live = (current['File'].to_numpy() == name) & (current['DateModified'].values == modified)
+                tables.append(table.filter(pa.array(live)))
+            file_name = f'part-{next_part:05d}.parquet'
+            # A part file whose records all lack a column's values, like the ZIP+4 of the compact schema,
+            # stores it as the null type, which is promoted to the type of the other files
+            self._write_table(pa.concat_tables(tables, promote=True), file_name)
+            next_part += 1
+            index.loc[index['File'].isin(group), 'File'] = file_name
+        self._write_key_index(index)
+        self._write_watermark(watermark, next_part)
+        self.write_manifest(index)
+        # Merging leaves the records as they were, so summaries of them are carried over to the merged files
+        if rollups_current:
+            self._restamp_summaries(rollup_files)
+        if sketches_current:
+            self._restamp_summaries(sketch_files)
+        if self.snapshot:
+            self.write_snapshot()
+        merged = sum(len(group) for group in groups)
+        print(f'Merged {merged} small part files into {len(groups)} in `{self.output_path}`.')
+        return merged
+
+    def _write_table(self, table, file_name):
+        """
+        Atomically write an Arrow table to a file in the output dataset directory.
+        """
+        path = os.path.join(self.output_path, file_name)
+        tmp_path = os.path.join(self.output_path, f'_{file_name}.tmp')
+        pq.write_table(table, tmp_path)
+        os.replace(tmp_path, path)
+
     def run(self):
         """
         Run the OpenHouseProcessor by reading the data, processing it, and writing the cleaned data to a Parquet file.
         """
-        data = self.read_data()
-        cleaned_data = self.process_data(data)
+        self.metrics = RunMetrics(self.metrics.sample_interval)
+        with self.metrics.sampling():
+            if self.engine == 'duckdb':
+                self._report(*self.process_out_of_core())
+                if self.lookups:
+                    with self.metrics.stage('lookups'):
+                        self.write_listing_index()
+                if self.snapshot:
+                    with self.metrics.stage('snapshot'):
+                        self.write_snapshot()
+                self.write_metrics()
+                return
+            if self.engine == 'arrow':
+                table = self.read_table()
+                raw_count = table.num_rows
+                if self.incremental:
+                    table = self.skip_applied(table)
+                cleaned_data = self.process_table(table)
+            elif self.batch_size:
+                batches = self.read_batches()
+                if self.incremental:
+                    index = self.read_key_index()
+                    batches = (self.skip_applied(batch, index) for batch in batches)
+                raw_count, cleaned_data = self.process_batches(batches)
+                # The batches were counted after skipping, the read stage counted them all
+                raw_count = self.metrics.stages['read'].rows_out
+            else:
+                data = self.read_data()
+                raw_count = len(data)
+                if self.incremental:
+                    data = self.skip_applied(pd.DataFrame(data))
+                if self.workers > 1:
+                    cleaned_data = self.process_data_parallel(data)
+                else:
+                    cleaned_data = self.process_data(data)
+            self._report(raw_count, len(cleaned_data))
+
+            with self.metrics.stage('write', rows_in=len(cleaned_data)) as stage:
+                stage.rows_out = len(cleaned_data)
+                if self.incremental:
+                    stage.rows_out = self.upsert_data(cleaned_data)
+                    stage.dropped['not_newer'] += stage.rows_in - stage.rows_out
+                elif self.partition_by:
+                    self.write_partitioned(cleaned_data)
+                elif self.lookups:
+                    self.write_clustered(cleaned_data)
+                elif self.batch_size:
+                    self.write_batches(cleaned_data)
+                else:
+                    self.write_data(cleaned_data)
+            if self.rollups and not self.incremental:
+                with self.metrics.stage('rollups', rows_in=len(cleaned_data)):
+                    self.write_rollups(cleaned_data)
+            if self.sketches and not self.incremental:
+                with self.metrics.stage('sketches', rows_in=len(cleaned_data)):
+                    self.write_sketches(cleaned_data)
+            if self.lookups:
+                with self.metrics.stage('lookups', rows_in=len(cleaned_data)):
+                    self.write_listing_index()
+            if self.snapshot:
+                with self.metrics.stage('snapshot'):
+                    self.write_snapshot()
+            self.write_metrics()
+
+    def write_metrics(self):
+        """
+        Write the per-stage metrics of the run to the configured JSON report and Prometheus textfile.
+        """
+        if self.metrics_path:
+            self.metrics.write_json(self.metrics_path)
+        if self.prometheus_path:
+            self.metrics.write_prometheus(self.prometheus_path)
+
+    def _report(self, raw_count, cleaned_count):
+        """
+        Print a summary of the record counts for a run.
+        """
         print(
-            f'\nInput file `{self.input_path}` produced {len(data)} raw records.\n'
-            f'Processing produced {len(cleaned_data)} cleaned records.\n'
+            f'\nInput file `{self.input_path}` produced {raw_count} raw records.\n'
+            f'Processing produced {cleaned_count} cleaned records.\n'
             f'Output file written in parquet to `{self.output_path}`.'
         )
-        self.write_data(cleaned_data)
+        if self.rejections:
+            print('Rejected values per column: ' + ', '.join(f'{k}={v}' for k, v in sorted(self.rejections.items())))
 
 
 if __name__ == '__main__':
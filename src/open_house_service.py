@@ -0,0 +1,344 @@
+"""
+Serve the dashboard's open house aggregates as JSON over HTTP, for product pages calling them at high rates.
+
+Usage (from the repository root):
+    python -m src.open_house_service data/processed_openhouses.parquet --port 8000
+    curl 'http://127.0.0.1:8000/top_zip_codes?n=10&state=CA&start_date=2023-03-01'
+"""
+import argparse
+import asyncio
+import datetime
+import json
+from concurrent.futures import ThreadPoolExecutor
+from http import HTTPStatus
+from urllib.parse import parse_qs, urlsplit
+
+from src.open_house_dashboard import DatasetManager, OpenHouseDashboard, QueryCache
+
+# Largest `n` a top zip codes request may ask for
+MAX_TOP_N = 1000
+
+# Longest request line and headers accepted before the connection is dropped
+MAX_HEADER_SIZE = 1 << 14
+
+
+class OpenHouseService:
+    """
+    An asyncio HTTP/JSON service answering the dashboard's aggregates, with its filters, on a shared dataset.
+
+    Every endpoint runs the dashboard's filtered query, so results match the dashboard's panels. The event
+    loop only parses requests and writes responses; queries run on a pool of `max_workers` threads, each
+    on a cursor of the DatasetManager's dataset, which is loaded once and swapped when the processor writes
+    a new version. Requests never look for a new version themselves; a background task started with the
+    server checks every `check_interval` seconds of the manager. Identical requests arriving while one is
+    running share its answer instead of queuing another query, and finished results are kept in a
+    QueryCache. Once `max_pending` distinct queries are in flight, further ones are turned away with 503
+    rather than queued without bound.
+
+    Endpoints (GET, filters `start_date`, `end_date`, `state` and `zip_prefix` on each query endpoint):
+        /week_most_open_houses: The week with the most open houses.
+        /top_zip_codes: The `n` zip codes with the most open houses, 5 by default.
+        /daily_cumulative_total: The running total of open houses per day.
+        /health: Whether the service is up.
+        /stats: The request, coalescing and cache counters.
+
+    Attributes:
+        data_path (str): The path to the cleaned open house data in Parquet format.
+        manager (DatasetManager): The manager of the dataset queries run on.
+        cache (QueryCache): The cache of query results.
+        max_workers (int): The most queries running at once.
+        max_pending (int): The most distinct queries in flight, running or waiting for a worker.
+        requests (int): The number of query requests received.
+        executed (int): The number of queries handed to the workers.
+        coalesced (int): The number of requests answered by a query already in flight.
+        rejected (int): The number of requests turned away because too many queries were in flight.
+    """
+
+    # Endpoints and the dashboard methods building their queries
+    QUERIES = {
+        '/week_most_open_houses': 'get_week_most_open_houses_filtered_query',
+        '/top_zip_codes': 'get_top_zip_codes_filtered_query',
+        '/daily_cumulative_total': 'get_daily_cumulative_total_filtered_query',
+    }
+
+    def __init__(self, data_path, scan=False, max_workers=4, max_pending=256, cache=None, manager=None):
+        """
+        Initialize the OpenHouseService. The data is loaded by the first query.
+
+        Args:
+            data_path (str): The path to the cleaned open house data in Parquet format.
+            scan (bool, optional): Whether DuckDB scans the Parquet data instead of loading it. Defaults to False.
+            max_workers (int, optional): The number of threads, and dataset cursors, running queries. Defaults to 4.
+            max_pending (int, optional): The most distinct queries in flight before requests get 503.
+                Defaults to 256.
+            cache (QueryCache, optional): A result cache, usually shared. Defaults to None, which creates one.
+            manager (DatasetManager, optional): A dataset manager, usually shared. Defaults to None, which
+                creates one for `data_path`.
+        """
+        self.data_path = data_path
+        self.manager = manager or DatasetManager(data_path, scan, max_cursors=max_workers)
+        self.cache = cache or QueryCache()
+        self.max_workers = max_workers
+        self.max_pending = max_pending
+        self.requests = 0
+        self.executed = 0
+        self.coalesced = 0
+        self.rejected = 0
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='openhouse-query')
+        self._in_flight = {}
+        self._refresher = None
+
+    @staticmethod
+    def parse_filters(path, query):
+        """
+        Validate the query string of a query endpoint into keyword arguments for its dashboard method.
+
+        Args:
+            path (str): The endpoint, one of QUERIES.
+            query (str): The URL query string.
+
+        Returns:
+            dict: The filters, and `n` for top zip codes.
+
+        Raises:
+            ValueError: If a parameter is unknown, repeated or malformed.
+        """
+        values = parse_qs(query, keep_blank_values=True, strict_parsing=bool(query))
+        allowed = {'start_date', 'end_date', 'state', 'zip_prefix'}
+        if path == '/top_zip_codes':
+            allowed.add('n')
+        unknown = set(values) - allowed
+        if unknown:
+            raise ValueError(f'Unknown parameters {sorted(unknown)}, expected some of {sorted(allowed)}.')
+        repeated = [name for name, value in values.items() if len(value) > 1]
+        if repeated:
+            raise ValueError(f'Parameters {sorted(repeated)} given more than once.')
+
+        filters = {name: value[0] for name, value in values.items() if value[0]}
+        for name in ('start_date', 'end_date'):
+            if name in filters:
+                filters[name] = datetime.date.fromisoformat(filters[name]).isoformat()
+        if 'zip_prefix' in filters and not (filters['zip_prefix'].isdigit() and len(filters['zip_prefix']) <= 5):
+            raise ValueError(f'zip_prefix must be 1 to 5 digits, got {filters["zip_prefix"]!r}.')
+        if 'n' in filters:
+            n = int(filters['n'])
+            if not 1 <= n <= MAX_TOP_N:
+                raise ValueError(f'n must be between 1 and {MAX_TOP_N}, got {n}.')
+            filters['n'] = n
+        return filters
+
+    async def answer(self, path, filters):
+        """
+        Answer a query endpoint, sharing the answer of an identical query already in flight.
+
+        Args:
+            path (str): The endpoint, one of QUERIES.
+            filters (dict): The arguments from `parse_filters`.
+
+        Returns:
+            bytes: The JSON response body.
+
+        Raises:
+            OverflowError: If `max_pending` distinct queries are already in flight.
+        """
+        self.requests += 1
+        key = (path, tuple(sorted(filters.items())))
+        future = self._in_flight.get(key)
+        if future is not None:
+            self.coalesced += 1
+        else:
+            if len(self._in_flight) >= self.max_pending:
+                self.rejected += 1
+                raise OverflowError(f'{len(self._in_flight)} queries are already in flight.')
+            self.executed += 1
+            future = asyncio.get_running_loop().run_in_executor(self._executor, self._run, path, filters)
+            self._in_flight[key] = future
+            future.add_done_callback(lambda _: self._in_flight.pop(key, None))
+        # A client hanging up must not cancel the query for the others waiting on it
+        return await asyncio.shield(future)
+
+    def _run(self, path, filters):
+        """
+        Run a query on a worker thread and serialize its result, on the version of the data loaded last.
+        """
+        dataset = self.manager.acquire(check=False)
+        try:
+            dashboard = OpenHouseDashboard(dataset.data_path, dataset.scan, cache=self.cache, dataset=dataset)
+            sql, params = getattr(dashboard, self.QUERIES[path])(**filters)
+            df = dashboard._query(sql, params, name=path.lstrip('/'))
+        finally:
+            self.manager.release(dataset)
+        rows = df.to_dict('records')
+        return json.dumps({'query': path.lstrip('/'), 'filters': filters, 'rows': rows}, default=_json_value).encode()
+
+    def stats(self):
+        """
+        Get the request, coalescing and cache counters of the service.
+
+        Returns:
+            dict: The counters.
+        """
+        return {
+            'requests': self.requests,
+            'executed': self.executed,
+            'coalesced': self.coalesced,
+            'rejected': self.rejected,
+            'in_flight': len(self._in_flight),
+            'cache': self.cache.stats(),
+        }
+
+    async def respond(self, method, target):
+        """
+        Route a request to its endpoint.
+
+        Args:
+            method (str): The HTTP method.
+            target (str): The request target, the path and query string.
+
+        Returns:
+            tuple: The HTTPStatus and the JSON response body.
+        """
+        url = urlsplit(target)
+        if url.path not in (*self.QUERIES, '/health', '/stats'):
+            return HTTPStatus.NOT_FOUND, _error(f'Unknown endpoint {url.path}.')
+        if method != 'GET':
+            return HTTPStatus.METHOD_NOT_ALLOWED, _error(f'{method} is not supported, use GET.')
+        if url.path == '/health':
+            return HTTPStatus.OK, b'{"status": "ok"}'
+        if url.path == '/stats':
+            return HTTPStatus.OK, json.dumps(self.stats()).encode()
+        try:
+            filters = self.parse_filters(url.path, url.query)
+        except ValueError as error:
+            return HTTPStatus.BAD_REQUEST, _error(str(error))
+        try:
+            return HTTPStatus.OK, await self.answer(url.path, filters)
+        except OverflowError as error:
+            return HTTPStatus.SERVICE_UNAVAILABLE, _error(str(error))
+        except Exception as error:
+            return HTTPStatus.INTERNAL_SERVER_ERROR, _error(f'{type(error).__name__}: {error}')
+
+    async def handle(self, reader, writer):
+        """
+        Serve the HTTP/1.1 requests of one connection, keeping it open between requests unless asked not to.
+
+        Args:
+            reader (asyncio.StreamReader): The connection's reader.
+            writer (asyncio.StreamWriter): The connection's writer.
+        """
+        try:
+            while True:
+                try:
+                    head = await reader.readuntil(b'\r\n\r\n')
+                except (asyncio.IncompleteReadError, asyncio.LimitOverrunError):
+                    return
+                request_line, *header_lines = head.decode('latin-1').split('\r\n')
+                headers = dict(line.split(':', 1) for line in header_lines if ':' in line)
+                headers = {name.strip().lower(): value.strip() for name, value in headers.items()}
+                try:
+                    method, target, version = request_line.split(' ')
+                except ValueError:
+                    status, body = HTTPStatus.BAD_REQUEST, _error('Malformed request line.')
+                    method, version = None, 'HTTP/1.0'
+                else:
+                    # Request bodies are not used, but are read so the next request on the connection parses
+                    if int(headers.get('content-length', 0)):
+                        await reader.readexactly(int(headers['content-length']))
+                    status, body = await self.respond(method, target)
+
+                connection = headers.get('connection', '').lower()
+                keep_alive = connection == 'keep-alive' if version == 'HTTP/1.0' else connection != 'close'
+                keep_alive = keep_alive and method is not None
+                writer.write(
+                    f'HTTP/1.1 {status.value} {status.phrase}\r\n'
+                    f'Content-Type: application/json\r\n'
+                    f'Content-Length: {len(body)}\r\n'
+                    f'Connection: {"keep-alive" if keep_alive else "close"}\r\n\r\n'.encode('latin-1') + body
+                )
+                await writer.drain()
+                if not keep_alive:
+                    return
+        except (ConnectionError, ValueError):
+            # A dropped connection, or a Content-Length that is not a number
+            return
+        finally:
+            writer.close()
+
+    async def start(self, host='127.0.0.1', port=8000):
+        """
+        Start listening for connections, and checking for new versions of the data.
+
+        Args:
+            host (str, optional): The interface to listen on. Defaults to '127.0.0.1'.
+            port (int, optional): The port to listen on, 0 for any free one. Defaults to 8000.
+
+        Returns:
+            asyncio.Server: The listening server.
+        """
+        if self._refresher is None or self._refresher.done():
+            self._refresher = asyncio.create_task(self._refresh_loop())
+        return await asyncio.start_server(self.handle, host, port, limit=MAX_HEADER_SIZE)
+
+    async def _refresh_loop(self):
+        """
+        Have the manager load new versions of the data on a thread of the loop's default executor, so a
+        load never holds up a request or takes a query worker.
+        """
+        loop = asyncio.get_running_loop()
+        while True:
+            await asyncio.sleep(self.manager.check_interval)
+            try:
+                await loop.run_in_executor(None, self.manager.refresh)
+            except Exception as error:
+                print(f'Failed to check `{self.data_path}` for a new version: {type(error).__name__}: {error}')
+
+    def close(self):
+        """
+        Stop checking for new versions and the query workers, and close the dataset.
+        """
+        if self._refresher is not None and not self._refresher.done():
+            self._refresher.cancel()
+        self._executor.shutdown(wait=True)
+        self.manager.close()
+
+
+def _json_value(value):
+    """
+    Serialize the values `json` does not know, dates and timestamps as ISO-8601.
+    """
+    return value.isoformat() if hasattr(value, 'isoformat') else str(value)
+
+
+def _error(message):
+    """
+    Build a JSON error body.
+    """
+    return json.dumps({'error': message}).encode()
+
+
+async def serve(service, host, port):
+    """
+    Run a service until the process is interrupted.
+    """
+    server = await service.start(host, port)
+    print(f'Serving `{service.data_path}` on http://{host}:{server.sockets[0].getsockname()[1]}')
+    async with server:
+        await server.serve_forever()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('data_path', help='The cleaned open house data in Parquet format.')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8000)
+    parser.add_argument('--scan', action='store_true', help='Scan the Parquet data instead of loading it.')
+    parser.add_argument('--workers', type=int, default=4, help='The number of queries running at once.')
+    args = parser.parse_args()
+
+    open_house_service = OpenHouseService(args.data_path, scan=args.scan, max_workers=args.workers)
+    try:
+        asyncio.run(serve(open_house_service, args.host, args.port))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        open_house_service.close()
@@ -0,0 +1,2 @@
+def pytest_configure(config):
+    config.addinivalue_line('markers', 'real_parquet: read real Parquet data instead of the mocked pandas reader')
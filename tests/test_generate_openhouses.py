@@ -0,0 +1,45 @@
+import json
+import os
+import tempfile
+import unittest
+
+import pandas as pd
+
+from benchmarks.generate_openhouses import generate_chunks, write_feed
+from src.open_house_processor import OpenHouseProcessor
+
+
+class TestGenerateOpenHouses(unittest.TestCase):
+
+    def test_generate_chunks_quirks(self):
+        # Test case: The feed is reproducible and carries the quirks of the real feed
+        first = pd.concat(generate_chunks(20000, seed=3, chunk_size=7000), ignore_index=True)
+        second = pd.concat(generate_chunks(20000, seed=3, chunk_size=7000), ignore_index=True)
+        whole = next(generate_chunks(20000, seed=3, chunk_size=20000))
+
+        pd.testing.assert_frame_equal(first, second)
+        pd.testing.assert_frame_equal(first, whole)
+        self.assertEqual([len(chunk) for chunk in generate_chunks(20000, seed=3, chunk_size=7000)], [7000, 7000, 6000])
+        self.assertEqual(len(first), 20000)
+        self.assertGreater(first['OpenHouseKey'].isna().sum(), 0)
+        self.assertGreater((first['OpenHouseStartTime'].str.len() == 5).sum(), 0)
+        self.assertGreater((first['Zipcode'].str.len() == 10).sum(), 0)
+        self.assertGreater(first['OpenHouseKey'].duplicated().sum(), 0)
+        self.assertTrue(first['ListingKey'].str.fullmatch('[0-9a-f]{32}').all())
+
+    def test_write_feed_is_processable(self):
+        # Test case: The written feed is a JSON array the processor reads and cleans
+        with tempfile.TemporaryDirectory() as tmp:
+            input_path = os.path.join(tmp, 'openhouses.json')
+            write_feed(input_path, 5000, seed=1, chunk_size=2000)
+            with open(input_path) as file:
+                data = json.load(file)
+            cleaned = OpenHouseProcessor(input_path, os.path.join(tmp, 'out.parquet')).process_data(data)
+
+        self.assertEqual(len(data), 5000)
+        self.assertTrue(cleaned['OpenHouseKey'].is_unique)
+        self.assertLess(len(cleaned), len(data))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,13 +1,26 @@
+import datetime
+import os
+import threading
+import time
 from unittest import mock
+import numpy as np
 import pandas as pd
 import pytest
 import duckdb
 
-from src.open_house_dashboard import OpenHouseDashboard
+from benchmarks.generate_openhouses import write_feed
+from src.open_house_dashboard import (
+    DatasetManager, OpenHouseDashboard, OpenHouseDataset, QueryCache, QueryMetrics, app_dataset_manager, prefers_scan
+)
+from src.open_house_processor import OpenHouseProcessor
 
 
 @pytest.fixture(autouse=True)
-def mock_read_parquet(monkeypatch):
+def mock_read_parquet(request, monkeypatch):
+    # Tests marked `real_parquet` load real data, which the mocked pandas reader is not installed for
+    if request.node.get_closest_marker('real_parquet'):
+        return
+
     def mock_read_parquet(*args, **kwargs):
         # Create a mock DataFrame for testing - data does not matter
         data = [
@@ -61,7 +74,7 @@ def test_top_5_zip_codes(mock_execute, dashboard):
     mock_execute.return_value.df.return_value = mocked_top_5_zip_codes
 
     # Call the method under test
-    result_df = dashboard._query(dashboard.get_top_zip_codes_query())
+    result_df = dashboard._query(*dashboard.get_top_zip_codes_query())
 
     # Assert the result
     assert result_df.equals(mocked_top_5_zip_codes)
@@ -99,13 +112,536 @@ def test_display_dashboard(mock_st, mock_execute, dashboard):
 
     # Assertions for queries in Duckdb invoked
     assert dashboard.get_week_most_open_houses_query() in [call[0][0] for call in mock_execute.call_args_list]
-    assert dashboard.get_top_zip_codes_query() in [call[0][0] for call in mock_execute.call_args_list]
+    assert dashboard.get_top_zip_codes_query()[0] in [call[0][0] for call in mock_execute.call_args_list]
     assert dashboard.get_daily_cumulative_total_query() in [call[0][0] for call in mock_execute.call_args_list]
 
     # Clean up
     dashboard.close()
 
 
+@mock.patch('src.open_house_dashboard.st')
+def test_display_dashboard_runs_panels_concurrently(mock_st, dashboard):
+    # Panels query concurrently and each renders as soon as its own query returns
+    delays = {'week_most_open_houses': 0.3, 'top_zip_codes': 0.1, 'daily_cumulative_total': 0.2}
+    sql_names = {
+        dashboard.get_week_most_open_houses_query(): 'week_most_open_houses',
+        dashboard.get_top_zip_codes_query(zip5=dashboard.compact)[0]: 'top_zip_codes',
+        dashboard.get_daily_cumulative_total_query(): 'daily_cumulative_total',
+    }
+    # Every query waits until all three are running, which breaks the barrier if they run one after another
+    running = threading.Barrier(len(delays), timeout=5)
+
+    def slow_execute(sql, params=None, cursor=None):
+        running.wait()
+        time.sleep(delays[sql_names[sql]])
+        return pd.DataFrame({'Panel': [sql_names[sql]]})
+
+    with mock.patch.object(dashboard, '_execute', side_effect=slow_execute):
+        dashboard.display_dashboard()
+
+    assert not running.broken
+    rendered = [call.args[0]['Panel'][0] for call in mock_st.mock_calls if call[0] in ('write', 'line_chart')]
+    assert rendered == ['top_zip_codes', 'daily_cumulative_total', 'week_most_open_houses']
+    assert mock_st.empty.call_count == 3
+
+
+@pytest.fixture
+def partitioned_data_path(tmp_path):
+    # Create a small hive partitioned dataset plus a bookkeeping file that must be skipped
+    data = pd.DataFrame({
+        'OpenHouseKey': ['1', '2', '3', '4'],
+        'OpenHouseDate': ['2023-01-01', '2023-01-02', '2023-01-02', '2023-01-09'],
+        'Zipcode': ['12345', '12345-6789', '23456', '12345'],
+    })
+    for state, rows in (('CA', data.iloc[:3]), ('NV', data.iloc[3:])):
+        partition = tmp_path / f'State={state}'
+        partition.mkdir()
+        rows.to_parquet(partition / 'part-0.parquet', index=False)
+    data.to_parquet(tmp_path / '_key_index.parquet', index=False)
+    return str(tmp_path)
+
+
+def test_scan_mode(partitioned_data_path):
+    # DuckDB scans the files directly, the mocked pandas reader is never used
+    dashboard = OpenHouseDashboard(partitioned_data_path, scan=True)
+
+    assert dashboard.df is None
+    top_zip_codes = dashboard._query(*dashboard.get_top_zip_codes_query(n=1))
+    assert top_zip_codes.to_dict('records') == [{'Zipcode': '12345', 'OpenHouseCount': 3}]
+    daily = dashboard._query(dashboard.get_daily_cumulative_total_query() + ' ORDER BY OpenHouseDate')
+    assert list(daily['daily_cumulative_total']) == [1, 3, 4]
+    states = dashboard._query('SELECT State, COUNT(*) AS n FROM openhouses GROUP BY State ORDER BY State')
+    assert states.to_dict('records') == [{'State': 'CA', 'n': 3}, {'State': 'NV', 'n': 1}]
+
+    dashboard.close()
+
+
+def test_app_scans_partitioned_data_and_prunes_partitions(partitioned_data_path, tmp_path):
+    # The app's manager scans a partitioned dataset, so a state filter never opens the other states' files
+    with open(os.path.join(partitioned_data_path, 'State=NV', 'part-0.parquet'), 'wb') as file:
+        file.write(b'not a parquet file')
+    manager = app_dataset_manager([partitioned_data_path])
+    assert manager.scan
+    dashboard = OpenHouseDashboard(manager.data_path, manager.scan, manager=manager)
+
+    top_zip_codes = dashboard._query(*dashboard.get_top_zip_codes_filtered_query(n=5, state='CA'))
+    assert top_zip_codes['OpenHouseCount'].tolist() == [2, 1]
+    with pytest.raises(duckdb.InvalidInputException):
+        dashboard._query(*dashboard.get_top_zip_codes_filtered_query(n=5))
+    dashboard.close()
+
+    # A small single file is loaded unless scanning is asked for
+    data_path = str(tmp_path / 'processed.parquet')
+    pd.DataFrame({'OpenHouseDate': ['2023-01-01'], 'Zipcode': ['12345']}).to_parquet(data_path, index=False)
+    assert not prefers_scan(data_path) and prefers_scan(data_path, threshold_bytes=0)
+    assert not app_dataset_manager([data_path]).scan
+    assert app_dataset_manager([data_path, '--scan', 'on']).scan
+    assert not app_dataset_manager(['--scan', 'off'], data_path=partitioned_data_path).scan
+
+
+def test_scan_mode_follows_replaced_files(tmp_path):
+    # A scan of a dataset without files yet returns nothing, and a scan outliving its files reads their replacements
+    data_path = tmp_path / 'processed'
+    data_path.mkdir()
+    dashboard = OpenHouseDashboard(str(data_path), scan=True)
+    assert dashboard._query(*dashboard.get_top_zip_codes_query()).empty
+    dashboard.close()
+
+    data = pd.DataFrame({'OpenHouseDate': ['2023-01-01', '2023-01-02'], 'Zipcode': ['12345', '23456']})
+    data.iloc[:1].to_parquet(data_path / 'part-00000.parquet', index=False)
+    data.iloc[1:].to_parquet(data_path / 'part-00001.parquet', index=False)
+    dashboard = OpenHouseDashboard(str(data_path), scan=True)
+    assert dashboard._query('SELECT COUNT(*) AS n FROM openhouses')['n'].tolist() == [2]
+
+    data.to_parquet(data_path / 'part-00002.parquet', index=False)
+    os.remove(data_path / 'part-00000.parquet')
+    os.remove(data_path / 'part-00001.parquet')
+    assert dashboard._query('SELECT COUNT(*) AS n FROM openhouses')['n'].tolist() == [2]
+    dashboard.close()
+
+
+def test_rollup_queries_match_fact_queries(tmp_path):
+    # Queries over the processor's rollups return the same results as the queries over raw rows
+    data = pd.DataFrame({
+        'OpenHouseDate': ['2023-01-01', '2023-01-02', '2023-01-02', '2023-01-09', '2024-01-03', '2023-01-10'],
+        'State': ['CA', 'CA', 'NV', 'CA', 'CA', None],
+        'Zipcode': ['12345', '12345-6789', '23456', '12345', None, '23456'],
+    })
+    data_path = str(tmp_path / 'processed.parquet')
+    data.to_parquet(data_path, index=False)
+    OpenHouseProcessor('unused.json', data_path).write_rollups(data)
+
+    dashboard = OpenHouseDashboard(data_path, scan=True)
+    assert dashboard.rollups
+
+    pairs = [
+        ((dashboard.get_week_most_open_houses_query(), None),
+         (dashboard.get_week_most_open_houses_rollup_query(), None)),
+        (dashboard.get_top_zip_codes_query(n=3), dashboard.get_top_zip_codes_rollup_query(n=3)),
+        ((dashboard.get_daily_cumulative_total_query(), None),
+         (dashboard.get_daily_cumulative_total_rollup_query(), None)),
+    ]
+    for (fact_query, fact_params), (rollup_query, rollup_params) in pairs:
+        order = ' ORDER BY 2 DESC, 1'
+        expected = dashboard._query(f'SELECT * FROM ({fact_query}){order}', fact_params)
+        actual = dashboard._query(f'SELECT * FROM ({rollup_query}){order}', rollup_params)
+        pd.testing.assert_frame_equal(actual, expected, check_dtype=False)
+
+    dashboard.close()
+
+
+def test_stale_rollups_and_sketches_are_ignored(tmp_path):
+    # Rollups and sketches of an earlier run are not queried once a run without them rewrote the data
+    data = pd.DataFrame({'OpenHouseDate': ['2023-01-01', '2023-01-02'], 'State': ['CA', 'CA'],
+                         'Zipcode': ['12345', '12345'], 'ListingKey': ['1', '2']})
+    data_path = str(tmp_path / 'processed.parquet')
+    data.to_parquet(data_path, index=False)
+    processor = OpenHouseProcessor('unused.json', data_path)
+    processor.write_rollups(data)
+    processor.write_sketches(data)
+    dashboard = OpenHouseDashboard(data_path, scan=True)
+    assert dashboard.rollups and dashboard.sketches is not None
+    dashboard.close()
+
+    data.iloc[:1].to_parquet(data_path, index=False)
+    dashboard = OpenHouseDashboard(data_path, scan=True, approximate=True)
+    assert not dashboard.rollups and dashboard.sketches is None and not dashboard.approximate
+    sql, params = dashboard.get_top_zip_codes_filtered_query()
+    assert dashboard._query(sql, params)['OpenHouseCount'].tolist() == [1]
+    dashboard.close()
+
+
+@pytest.mark.real_parquet
+def test_compact_schema_queries(tmp_path):
+    # Compact data, with its 5-digit zip codes and categoricals, gives the same answers as plain data
+    plain = pd.DataFrame({
+        'OpenHouseDate': ['2023-01-02', '2023-01-02', '2023-01-09', '2023-01-10'],
+        'State': ['CA', 'CA', 'NV', 'CA'],
+        'Zipcode': ['92630-1234', '92630', '89501', '89501'],
+    })
+    compact = plain.assign(Zipcode=plain['Zipcode'].str[:5], ZipcodePlus4=plain['Zipcode'].str[6:].replace('', None))
+    compact = compact.astype('category')
+    paths = {'plain': str(tmp_path / 'plain.parquet'), 'compact': str(tmp_path / 'compact.parquet')}
+    plain.to_parquet(paths['plain'], index=False)
+    compact.to_parquet(paths['compact'], index=False)
+
+    for scan in (False, True):
+        results = {}
+        for name, path in paths.items():
+            dashboard = OpenHouseDashboard(path, scan=scan)
+            assert dashboard.compact == (name == 'compact')
+            results[name] = [
+                dashboard._query(*OpenHouseDashboard.get_top_zip_codes_query(zip5=dashboard.compact)),
+                dashboard._query(OpenHouseDashboard.get_week_most_open_houses_query()),
+                dashboard._query(OpenHouseDashboard.get_daily_cumulative_total_query()),
+            ]
+            dashboard.close()
+        for compact_result, plain_result in zip(results['compact'], results['plain']):
+            pd.testing.assert_frame_equal(compact_result, plain_result)
+
+
+def test_query_cache_lru_and_invalidation():
+    cache = QueryCache(maxsize=2)
+    compute = mock.Mock(side_effect=lambda: pd.DataFrame({'n': [1]}))
+
+    cache.set_version('v1')
+    cache.get_or_compute('v1', 'SELECT 1', None, compute)
+    cache.get_or_compute('v1', 'SELECT 1', None, compute)
+    cache.get_or_compute('v1', 'SELECT ?', [2], compute)
+    cache.get_or_compute('v1', 'SELECT 1', None, compute)
+    cache.get_or_compute('v1', 'SELECT ?', [3], compute)  # Evicts the least recently used `SELECT ?` [2]
+    assert compute.call_count == 3
+    assert cache.stats() == {'hits': 2, 'misses': 3, 'coalesced': 0, 'evictions': 1, 'invalidations': 0, 'size': 2}
+
+    cache.set_version('v2')
+    cache.get_or_compute('v2', 'SELECT 1', None, compute)
+    assert compute.call_count == 4
+    assert cache.stats()['invalidations'] == 2
+
+
+def test_query_cache_runs_each_query_once_at_a_time():
+    # Lookups of a query already running wait for its result, which is only kept if its version is still current
+    cache = QueryCache()
+    cache.set_version('v1')
+    started, finish = threading.Event(), threading.Event()
+
+    def compute():
+        started.set()
+        finish.wait(5)
+        return pd.DataFrame({'n': [1]})
+
+    compute = mock.Mock(side_effect=compute)
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(cache.get_or_compute('v1', 'SELECT 1', None, compute)))
+               for _ in range(4)]
+    threads[0].start()
+    started.wait(5)
+    for thread in threads[1:]:
+        thread.start()
+    while cache.stats()['coalesced'] < 3:
+        time.sleep(0.01)
+    cache.set_version('v2')  # The data changes while the query runs
+    finish.set()
+    for thread in threads:
+        thread.join()
+
+    assert compute.call_count == 1
+    assert [result['n'].tolist() for result in results] == [[1]] * 4
+    assert cache.stats() == {'hits': 0, 'misses': 1, 'coalesced': 3, 'evictions': 0, 'invalidations': 0, 'size': 0}
+
+    failing = mock.Mock(side_effect=ValueError('boom'))
+    with pytest.raises(ValueError):
+        cache.get_or_compute('v2', 'SELECT 2', None, failing)
+    cache.get_or_compute('v2', 'SELECT 2', None, compute)
+    assert cache.stats()['size'] == 1
+
+
+def test_dashboards_share_cached_results(tmp_path):
+    # Dashboards on the same dataset version run each query once, a rewrite of the data runs it again
+    data_path = str(tmp_path / 'processed.parquet')
+    pd.DataFrame({'OpenHouseDate': ['2023-01-01'], 'Zipcode': ['12345']}).to_parquet(data_path, index=False)
+    cache = QueryCache()
+    sql, params = OpenHouseDashboard.get_top_zip_codes_query()
+
+    for _ in range(3):
+        dashboard = OpenHouseDashboard(data_path, scan=True, cache=cache)
+        assert dashboard._query(sql, params)['OpenHouseCount'].tolist() == [1]
+        dashboard.close()
+    assert cache.stats()['misses'] == 1
+    assert cache.stats()['hits'] == 2
+
+    pd.DataFrame({'OpenHouseDate': ['2023-01-01'] * 2, 'Zipcode': ['12345'] * 2}).to_parquet(data_path, index=False)
+    dashboard = OpenHouseDashboard(data_path, scan=True, cache=cache)
+    assert dashboard._query(sql, params)['OpenHouseCount'].tolist() == [2]
+    assert cache.stats()['misses'] == 2
+    dashboard.close()
+
+
+def test_scanned_results_are_cached_under_the_version_read(tmp_path):
+    # A scan reading a rewrite of the data never caches it under the version the dashboard started with
+    data_path = str(tmp_path / 'processed.parquet')
+    pd.DataFrame({'OpenHouseDate': ['2023-01-01'], 'Zipcode': ['12345']}).to_parquet(data_path, index=False)
+    cache = QueryCache()
+    dashboard = OpenHouseDashboard(data_path, scan=True, cache=cache)
+    first_version = dashboard.version
+    count = 'SELECT COUNT(*) AS n FROM openhouses'
+    assert dashboard._query(count)['n'].tolist() == [1]
+
+    pd.DataFrame({'OpenHouseDate': ['2023-01-01'] * 2, 'Zipcode': ['12345'] * 2}).to_parquet(data_path, index=False)
+    assert dashboard._query(*OpenHouseDashboard.get_top_zip_codes_query())['OpenHouseCount'].tolist() == [2]
+    assert dashboard.version != first_version and cache.version == dashboard.version
+    assert cache.stats()['size'] == 0
+    assert dashboard._query(count)['n'].tolist() == [2]
+    assert dashboard._query(count)['n'].tolist() == [2]
+    assert cache.stats()['hits'] == 1
+    dashboard.close()
+
+
+def test_query_hooks_record_latency(tmp_path):
+    # Every query, cached or not, is reported to the hooks and exported per query name
+    data_path = str(tmp_path / 'processed.parquet')
+    pd.DataFrame({'OpenHouseDate': ['2023-01-01'], 'Zipcode': ['12345']}).to_parquet(data_path, index=False)
+    metrics = QueryMetrics()
+    dashboard = OpenHouseDashboard(data_path, scan=True, cache=QueryCache())
+    dashboard.add_query_hook(metrics)
+    hook = mock.Mock()
+    dashboard.add_query_hook(hook)
+
+    for _ in range(2):
+        dashboard._query(*OpenHouseDashboard.get_top_zip_codes_query(), name='top_zip_codes')
+    dashboard._query('SELECT 1')
+    dashboard.close()
+
+    assert hook.call_count == 3
+    assert metrics.latencies['top_zip_codes']['count'] == 2
+    assert metrics.latencies['top_zip_codes']['max_seconds'] > 0
+    prom_path = tmp_path / 'dashboard.prom'
+    metrics.write_prometheus(str(prom_path))
+    assert 'openhouse_dashboard_query_seconds_count{query="top_zip_codes"} 2' in prom_path.read_text()
+
+
+@pytest.mark.real_parquet
+def test_dataset_manager_shares_and_swaps_versions(tmp_path):
+    # Dashboards share one load per version, and a running dashboard keeps its version until it closes
+    data_path = str(tmp_path / 'processed.parquet')
+    pd.DataFrame({'OpenHouseDate': ['2023-01-01'], 'Zipcode': ['12345']}).to_parquet(data_path, index=False)
+    manager = DatasetManager(data_path, check_interval=0)
+    sql, params = OpenHouseDashboard.get_top_zip_codes_query()
+
+    first = OpenHouseDashboard(data_path, manager=manager)
+    second = OpenHouseDashboard(data_path, manager=manager)
+    assert first.dataset is second.dataset
+    assert manager.loads == 1
+    second.close()
+
+    pd.DataFrame({'OpenHouseDate': ['2023-01-01'] * 2, 'Zipcode': ['12345'] * 2}).to_parquet(data_path, index=False)
+    third = OpenHouseDashboard(data_path, manager=manager)
+    assert manager.loads == 2
+    assert third._query(sql, params)['OpenHouseCount'].tolist() == [2]
+    assert first._query(sql, params)['OpenHouseCount'].tolist() == [1]
+    assert first.dataset.retired
+
+    first.close()
+    with pytest.raises(duckdb.ConnectionException):
+        first.con.execute('SELECT 1')
+    third.close()
+    assert third._query(sql, params)['OpenHouseCount'].tolist() == [2]  # The current version stays loaded
+    manager.close()
+
+
+def test_dataset_cursor_pool_is_bounded(tmp_path):
+    # Cursors are reused, and a request beyond the limit waits until one is returned
+    data_path = str(tmp_path / 'processed.parquet')
+    pd.DataFrame({'OpenHouseDate': ['2023-01-01'], 'Zipcode': ['12345']}).to_parquet(data_path, index=False)
+    dataset = OpenHouseDataset(data_path, scan=True, max_cursors=2)
+    borrowed = threading.Event()
+
+    def borrow():
+        with dataset.cursor() as cursor:
+            assert cursor.execute('SELECT COUNT(*) FROM openhouses').fetchone() == (1,)
+            borrowed.set()
+
+    with dataset.cursor() as first:
+        with dataset.cursor() as second:
+            thread = threading.Thread(target=borrow)
+            thread.start()
+            assert not borrowed.wait(0.1)
+        thread.join(1)
+        assert borrowed.is_set()
+    with dataset.cursor() as cursor:
+        assert cursor in (first, second)
+    dataset.close()
+
+
+@pytest.mark.real_parquet
+@mock.patch('src.open_house_dashboard.st')
+def test_approximate_answers_from_sketches(mock_st, tmp_path):
+    # Sketch answers bound the exact top zip codes and estimate distinct listings within the stated error
+    rng = np.random.default_rng(0)
+    size = 20000
+    data = pd.DataFrame({
+        'OpenHouseDate': pd.Series(pd.to_datetime('2023-01-02') + pd.to_timedelta(rng.integers(0, 60, size), unit='D'))
+        .dt.strftime('%Y-%m-%d'),
+        'Zipcode': (90000 + rng.zipf(1.8, size) % 50).astype(str),
+        'ListingKey': rng.integers(0, 8000, size).astype(str),
+    })
+    data_path = str(tmp_path / 'processed.parquet')
+    data.to_parquet(data_path, index=False)
+    OpenHouseProcessor('unused.json', data_path).write_sketches(data)
+
+    dashboard = OpenHouseDashboard(data_path, approximate=True)
+    assert dashboard.approximate
+    exact_top = dashboard._query(*dashboard.get_top_zip_codes_query(n=5))
+    approximate_top = dashboard.get_top_zip_codes_approximate(n=5)
+    assert approximate_top['Zipcode'].tolist() == exact_top['Zipcode'].tolist()
+    assert (approximate_top['MinOpenHouseCount'] <= exact_top['OpenHouseCount']).all()
+    assert (approximate_top['OpenHouseCount'] >= exact_top['OpenHouseCount']).all()
+
+    exact_distinct = dashboard._query(*dashboard.get_distinct_listings_query(n=100))
+    approximate_distinct = dashboard.get_distinct_listings_approximate(n=None).set_index('Zipcode')
+    estimates = approximate_distinct['DistinctListings'].reindex(exact_distinct['Zipcode']).to_numpy()
+    relative_errors = np.abs(estimates / exact_distinct['DistinctListings'].to_numpy() - 1)
+    assert relative_errors.max() < 4 * dashboard.sketches.relative_error
+    weeks = dashboard.get_distinct_listings_approximate(by='StartOfWeek', n=None)
+    assert len(weeks) == data['OpenHouseDate'].pipe(pd.to_datetime).dt.to_period('W').nunique()
+
+    timings = []
+    for _ in range(50):
+        start = time.perf_counter()
+        dashboard.get_top_zip_codes_approximate()
+        dashboard.get_distinct_listings_approximate()
+        timings.append(time.perf_counter() - start)
+    assert sorted(timings)[len(timings) // 2] < 0.001
+
+    dashboard.display_dashboard()
+    assert mock_st.empty.call_count == 4
+    dashboard.close()
+
+
+def test_filtered_queries_push_down_and_match_rollups(tmp_path):
+    # Filtered queries bind their values, push them into the Parquet scan and agree with the rollups
+    rng = np.random.default_rng(0)
+    size = 3000
+    data = pd.DataFrame({
+        'OpenHouseDate': pd.Series(pd.to_datetime('2023-01-02') + pd.to_timedelta(rng.integers(0, 90, size), unit='D'))
+        .dt.strftime('%Y-%m-%d'),
+        'State': rng.choice(['CA', 'NV', 'TX'], size),
+        'Zipcode': (90000 + rng.integers(0, 40, size) * 37).astype(str),
+    })
+    data['OpenHouseMonth'] = data['OpenHouseDate'].str[:7]
+    fact_path, rollup_data_path = str(tmp_path / 'fact'), str(tmp_path / 'rolled')
+    for path in (fact_path, rollup_data_path):
+        data.to_parquet(path, partition_cols=['OpenHouseMonth'], index=False)
+    OpenHouseProcessor('unused.json', rollup_data_path).write_rollups(data)
+    fact, rolled = OpenHouseDashboard(fact_path, scan=True), OpenHouseDashboard(rollup_data_path, scan=True)
+    assert rolled.rollups and not fact.rollups
+
+    filters = [
+        {'start_date': '2023-02-01', 'end_date': '2023-02-28'},
+        {'state': 'NV'},
+        {'zip_prefix': '901'},
+        {'start_date': '2023-01-15', 'state': 'CA', 'zip_prefix': '9'},
+    ]
+    for chosen in filters:
+        selected = data
+        if 'start_date' in chosen:
+            selected = selected[selected['OpenHouseDate'] >= chosen['start_date']]
+        if 'end_date' in chosen:
+            selected = selected[selected['OpenHouseDate'] <= chosen['end_date']]
+        if 'state' in chosen:
+            selected = selected[selected['State'] == chosen['state']]
+        if 'zip_prefix' in chosen:
+            selected = selected[selected['Zipcode'].str.startswith(chosen['zip_prefix'])]
+
+        sql, params = fact.get_top_zip_codes_filtered_query(n=3, **chosen)
+        assert not any(str(value) in sql for value in chosen.values())
+        top = fact._query(sql, params)
+        assert top['OpenHouseCount'].tolist() == selected['Zipcode'].value_counts().head(3).tolist()
+        daily = fact._query(*fact.get_daily_cumulative_total_filtered_query(**chosen))
+        assert daily['daily_cumulative_total'].max() == len(selected)
+
+        # Every zip code is compared, the top few can tie
+        for query, options in (('get_week_most_open_houses_filtered_query', {}),
+                               ('get_top_zip_codes_filtered_query', {'n': 100}),
+                               ('get_daily_cumulative_total_filtered_query', {})):
+            results = []
+            for dashboard in (fact, rolled):
+                sql, params = getattr(dashboard, query)(**options, **chosen)
+                results.append(dashboard._query(f'SELECT * FROM ({sql}) ORDER BY 2 DESC, 1', params))
+            pd.testing.assert_frame_equal(results[1], results[0], check_dtype=False)
+
+    sql, params = fact.get_top_zip_codes_filtered_query(state='NV', start_date='2023-02-01')
+    with fact.cursor() as cursor:
+        plan = cursor.execute(f'EXPLAIN {sql}', params).fetchall()[0][1]
+    scan = plan[plan.index('PARQUET_SCAN'):]
+    assert 'State=NV' in scan and 'OpenHouseDate>=2023-02-01' in scan
+    fact.close()
+    rolled.close()
+
+
+@mock.patch('src.open_house_dashboard.st')
+def test_filter_controls_drive_the_panels(mock_st, tmp_path):
+    # The sidebar controls become filters, and the panels run the filtered queries with bound values
+    data_path = str(tmp_path / 'processed.parquet')
+    pd.DataFrame({
+        'OpenHouseDate': ['2023-01-01', '2023-01-02', '2023-01-09', '2023-01-10'],
+        'State': ['CA', 'NV', 'CA', 'CA'],
+        'Zipcode': ['12345', '23456', '12345-6789', '23456'],
+    }).to_parquet(data_path, index=False)
+    dashboard = OpenHouseDashboard(data_path, scan=True)
+    mock_st.sidebar.date_input.return_value = (datetime.date(2023, 1, 2), datetime.date(2023, 1, 10))
+    mock_st.sidebar.selectbox.return_value = 'CA'
+    mock_st.sidebar.text_input.return_value = ''
+
+    filters = dashboard.filter_controls()
+    assert filters == {'start_date': datetime.date(2023, 1, 2), 'state': 'CA'}
+    assert mock_st.sidebar.selectbox.call_args[0][1] == ['All', 'CA', 'NV']
+
+    with mock.patch.object(dashboard, '_query', wraps=dashboard._query) as query:
+        dashboard.display_dashboard(**filters)
+    assert {call.kwargs['name'] for call in query.call_args_list} == {
+        'week_most_open_houses', 'top_zip_codes', 'daily_cumulative_total'}
+    top = [call.args[0] for call in mock_st.mock_calls if call[0] == 'write' and 'Zipcode' in call.args[0]][0]
+    assert top.sort_values('Zipcode').to_dict('records') == [{'Zipcode': '12345', 'OpenHouseCount': 1},
+                                                             {'Zipcode': '23456', 'OpenHouseCount': 1}]
+    dashboard.close()
+
+
+@pytest.mark.parametrize('compact', [False, True])
+@pytest.mark.real_parquet
+def test_snapshot_is_memory_mapped_until_stale(tmp_path, compact):
+    # A current snapshot is queried in place of the Parquet output, a stale one is ignored
+    input_path, output_path = str(tmp_path / 'openhouses.json'), str(tmp_path / 'processed.parquet')
+    write_feed(input_path, 2000, seed=0)
+    OpenHouseProcessor(input_path, output_path, compact=compact, snapshot=True).run()
+
+    dashboard, scanned = OpenHouseDashboard(output_path), OpenHouseDashboard(output_path, scan=True)
+    assert dashboard.df is None and dashboard.dataset.snapshot is not None
+    assert dashboard.compact == compact
+    queries = [
+        (dashboard.get_week_most_open_houses_query(), None),
+        dashboard.get_top_zip_codes_query(n=100, zip5=compact),
+        (dashboard.get_daily_cumulative_total_query(), None),
+        dashboard.get_distinct_listings_query(n=100, zip5=compact),
+    ]
+    # Zip codes can tie on their counts, so results are compared in a fixed order
+    for sql, params in queries:
+        expected = scanned._query(sql, params)
+        actual = dashboard._query(sql, params)
+        pd.testing.assert_frame_equal(actual.sort_values(list(expected.columns), ignore_index=True),
+                                      expected.sort_values(list(expected.columns), ignore_index=True))
+    with dashboard.cursor() as cursor:
+        assert cursor.execute('SELECT COUNT(*) FROM openhouses').fetchone() == (len(pd.read_parquet(output_path)),)
+    dashboard.close()
+
+    os.utime(output_path, ns=(0, 0))
+    reloaded = OpenHouseDashboard(output_path)
+    assert reloaded.dataset.snapshot is None and reloaded.df is not None
+    assert reloaded._query(*queries[2]).equals(scanned._query(*queries[2]))
+    reloaded.close()
+    scanned.close()
+
+
 if __name__ == '__main__':
     # Run the tests
     pytest.main()
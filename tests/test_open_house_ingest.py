@@ -0,0 +1,204 @@
+import json
+import os
+import shutil
+import threading
+import time
+from unittest import mock
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+import pytest
+
+from benchmarks.generate_openhouses import write_feed
+from src.open_house_dashboard import OpenHouseDashboard
+from src.open_house_ingest import CLAIMED_DIR, FAILED_DIR, INGESTED_DIR, MicroBatchIngestor
+from src.open_house_processor import OpenHouseProcessor
+
+
+@pytest.fixture
+def drops(tmp_path):
+    # 8 drop files of a 2000 record feed, whose DateModified values are not in file order
+    feed_path = tmp_path / 'feed.json'
+    write_feed(str(feed_path), 2000, seed=0)
+    records = json.loads(feed_path.read_text())
+    directory = tmp_path / 'drops'
+    directory.mkdir()
+    for i in range(8):
+        (directory / f'drop-{i:02d}.json').write_text(json.dumps(records[i::8]))
+    return str(directory)
+
+
+def _expected(drops, tmp_path, **options):
+    # The records of processing all the drops at once
+    output_path = str(tmp_path / 'full.parquet')
+    OpenHouseProcessor(drops, output_path, **options).run()
+    return pd.read_parquet(output_path).sort_values('OpenHouseKey', ignore_index=True)
+
+
+def _read(output_path):
+    return pd.read_parquet(output_path).sort_values('OpenHouseKey', ignore_index=True)
+
+
+def _assert_same_records(actual, expected):
+    # Each part file of the compact schema has its own dictionary, so categories come in another order
+    pd.testing.assert_frame_equal(actual, expected, check_categorical=False)
+
+
+def _scan_counts(output_path):
+    # The records and distinct keys a dashboard scanning the dataset sees
+    dashboard = OpenHouseDashboard(output_path, scan=True)
+    counts = dashboard._query('SELECT COUNT(*) AS n, COUNT(DISTINCT OpenHouseKey) AS keys FROM openhouses')
+    dashboard.close()
+    return tuple(counts.iloc[0].tolist())
+
+
+@pytest.mark.parametrize('options', [{}, {'compact': True}])
+def test_micro_batches_match_a_full_run_and_compact(drops, tmp_path, options):
+    # Test case: Micro-batches upsert the same records as one run, and compaction leaves one file with them
+    expected = _expected(drops, tmp_path, **options)
+    output_path = str(tmp_path / 'processed')
+    ingestor = MicroBatchIngestor(drops, output_path, max_batch_files=3, **options)
+    upserted = []
+    while (records := ingestor.poll(flush=True)) is not None:
+        upserted.append(records)
+
+    manifest = OpenHouseProcessor(drops, output_path, incremental=True).read_manifest()
+    _assert_same_records(_read(output_path), expected)
+    assert ingestor.batches == 3 and len(upserted) == 3 and ingestor.pending() == []
+    assert os.listdir(os.path.join(drops, CLAIMED_DIR)) == []
+    assert len(os.listdir(os.path.join(drops, INGESTED_DIR))) == 3
+    assert manifest['version'] == 3 and manifest['rows'] == len(expected) and len(manifest['files']) == 3
+    small_files = [file['name'] for file in manifest['files']]
+
+    assert ingestor.compact() == 3
+    manifest = OpenHouseProcessor(drops, output_path, incremental=True).read_manifest()
+    _assert_same_records(_read(output_path), expected)
+    assert len(manifest['files']) == 1 and manifest['files'][0]['name'] not in small_files
+    assert sorted(name for name in os.listdir(output_path) if not name.startswith('_')) == [
+        manifest['files'][0]['name']]
+    assert manifest['rows'] == len(expected)
+    assert ingestor.compact() == 0
+
+
+def test_compaction_drops_files_left_by_an_interrupted_upsert(drops, tmp_path):
+    # Test case: A stray copy of records the manifest does not list is never read, and is removed by the next merge
+    expected = _expected(drops, tmp_path)
+    output_path = str(tmp_path / 'processed')
+    ingestor = MicroBatchIngestor(drops, output_path, max_batch_files=4)
+    while ingestor.poll(flush=True) is not None:
+        pass
+    processor = OpenHouseProcessor(drops, output_path, incremental=True)
+    live = [file['name'] for file in processor.read_manifest()['files']]
+    _, next_part = processor.read_watermark()
+    shutil.copy(os.path.join(output_path, live[0]), os.path.join(output_path, 'part-00090.parquet'))
+    assert pd.read_parquet(output_path)['OpenHouseKey'].duplicated().any()
+    assert _scan_counts(output_path) == (len(expected), len(expected))
+    loaded = OpenHouseDashboard(output_path)
+    assert loaded.df is not None and len(loaded.df) == len(expected)
+    loaded.close()
+
+    assert ingestor.compact() == len(live)
+    merged = f'part-{next_part:05d}.parquet'
+    _assert_same_records(_read(output_path), expected)
+    assert set(processor.read_key_index()['File']) == {merged}
+    assert processor.read_watermark()[1] == next_part + 1
+    assert [file['name'] for file in processor.read_manifest()['files']] == [merged]
+    assert not os.path.exists(os.path.join(output_path, 'part-00090.parquet'))
+
+
+def test_readers_see_each_record_once_during_a_merge(drops, tmp_path):
+    # Test case: A reader at any step of a merge, merged file written or small files being removed, sees each key once
+    expected = _expected(drops, tmp_path)
+    output_path = str(tmp_path / 'processed')
+    ingestor = MicroBatchIngestor(drops, output_path, max_batch_files=3)
+    while ingestor.poll(flush=True) is not None:
+        pass
+    processor = ingestor.processor(drops)
+    counts = []
+
+    def then_read(write):
+        def wrapper(*args):
+            write(*args)
+            counts.append(_scan_counts(output_path))
+        return wrapper
+
+    def read_then(remove):
+        def wrapper(path):
+            counts.append(_scan_counts(output_path))
+            remove(path)
+        return wrapper
+
+    with mock.patch.object(processor, '_write_table', then_read(processor._write_table)), \
+            mock.patch.object(processor, '_write_key_index', then_read(processor._write_key_index)), \
+            mock.patch('os.remove', read_then(os.remove)):
+        assert processor.merge_small_files() == 3
+    assert len(counts) == 5  # Merged file and key index written, then each of the 3 small files removed
+    assert set(counts) == {(len(expected), len(expected))}
+
+
+def test_compaction_merges_part_files_with_a_null_only_column(drops, tmp_path):
+    # Test case: A micro-batch without any ZIP+4 stores the compact ZipcodePlus4 as nulls, and still merges
+    path = os.path.join(drops, 'drop-00.json')
+    with open(path) as file:
+        records = json.load(file)
+    with open(path, 'w') as file:
+        json.dump([dict(record, Zipcode=(record['Zipcode'] or '')[:5] or None) for record in records], file)
+    expected = _expected(drops, tmp_path, compact=True)
+    output_path = str(tmp_path / 'processed')
+    ingestor = MicroBatchIngestor(drops, output_path, max_batch_files=1, compact=True)
+    ingestor.poll(flush=True)
+    assert pa.types.is_null(pq.read_schema(os.path.join(output_path, 'part-00000.parquet')).field('ZipcodePlus4').type)
+    while ingestor.poll(flush=True) is not None:
+        pass
+
+    assert ingestor.compact() > 1
+    assert len(OpenHouseProcessor(drops, output_path, incremental=True).read_manifest()['files']) == 1
+    merged = pq.read_table(output_path)
+    assert pa.types.is_dictionary(merged.schema.field('ZipcodePlus4').type)
+    _assert_same_records(merged.to_pandas().sort_values('OpenHouseKey', ignore_index=True), expected)
+
+
+def test_micro_batch_limits(drops, tmp_path):
+    # Test case: Waiting files are committed once the oldest is old enough or enough bytes are waiting
+    ingestor = MicroBatchIngestor(drops, str(tmp_path / 'processed'), max_batch_age=60.0)
+    assert ingestor.poll(now=0.0) is None
+    assert ingestor.poll(now=59.0) is None and len(ingestor.pending(now=59.0)) == 8
+    assert ingestor.poll(now=60.0) > 0 and ingestor.pending() == []
+
+    batch_path = os.path.join(drops, INGESTED_DIR, os.listdir(os.path.join(drops, INGESTED_DIR))[0])
+    for name in os.listdir(batch_path):
+        shutil.copy(os.path.join(batch_path, name), os.path.join(drops, f'again-{name}'))
+    ingestor.max_batch_bytes = 2 * max(os.path.getsize(path) for path in ingestor.pending())
+    assert ingestor.poll() == 0  # The same records again change nothing
+    assert len(ingestor.pending()) == 6
+
+
+def test_run_recovers_claimed_batches_and_sets_aside_bad_files(drops, tmp_path):
+    # Test case: The daemon commits a batch left claimed, ingests dropped files and sets aside unreadable ones
+    expected = _expected(drops, tmp_path)
+    claimed = os.path.join(drops, CLAIMED_DIR, 'batch-0')
+    os.makedirs(claimed)
+    os.rename(os.path.join(drops, 'drop-00.json'), os.path.join(claimed, 'drop-00.json'))
+    with open(os.path.join(drops, '.bad.json'), 'w') as file:
+        file.write('not json')
+
+    output_path = str(tmp_path / 'processed')
+    ingestor = MicroBatchIngestor(drops, output_path, max_batch_files=1, max_batch_age=0.0, poll_interval=0.01,
+                                  compact_interval=0.05)
+    thread = threading.Thread(target=ingestor.run)
+    thread.start()
+    try:
+        os.rename(os.path.join(drops, '.bad.json'), os.path.join(drops, 'zz-bad.json'))
+        deadline = time.monotonic() + 30
+        while ingestor.batches + ingestor.failed < 9 and time.monotonic() < deadline:
+            time.sleep(0.05)
+    finally:
+        ingestor.stop()
+        thread.join()
+
+    _assert_same_records(_read(output_path), expected)
+    assert (ingestor.batches, ingestor.failed) == (8, 1)
+    assert os.listdir(os.path.join(drops, CLAIMED_DIR)) == []
+    failed_batch = os.listdir(os.path.join(drops, FAILED_DIR))[0]
+    assert os.listdir(os.path.join(drops, FAILED_DIR, failed_batch)) == ['zz-bad.json']
@@ -0,0 +1,89 @@
+import hashlib
+import json
+import os
+
+import pandas as pd
+import pytest
+
+from src.open_house_lookup import OpenHouseLookup
+from src.open_house_processor import OpenHouseProcessor
+
+
+def _md5(value):
+    return hashlib.md5(str(value).encode()).hexdigest()
+
+
+@pytest.fixture
+def input_path(tmp_path):
+    # 60 open houses of 17 listings, most updated several times
+    data = [
+        {
+            'OpenHouseMethod': 'In Person' if i % 3 else 'Virtual',
+            'OpenHouseEndTime': f'2023-06-{i % 28 + 1:02d}T10:00:00Z',
+            'ListingKey': _md5(f'listing-{i % 17}'),
+            'OpenHouseKey': _md5(i % 60),
+            'OpenHouseStartTime': f'2023-06-{i % 28 + 1:02d}T08:00:00Z',
+            'OpenHouseDate': f'2023-06-{i % 28 + 1:02d}',
+            'State': 'CA',
+            'Zipcode': f'926{i % 7:02d}-1234',
+            'DateModified': f'2023-06-18T12:{i // 60:02d}:00Z'
+        }
+        for i in range(200)
+    ]
+    path = tmp_path / 'openhouses.json'
+    path.write_text(json.dumps(data))
+    return str(path)
+
+
+@pytest.mark.parametrize('options', [{}, {'compact': True}, {'engine': 'duckdb', 'batch_size': 50}])
+def test_lookups_read_a_single_row_group(input_path, tmp_path, options):
+    # Test case: Key lookups read one row group and listing lookups only the row groups holding the listing
+    output_path = str(tmp_path / 'processed.parquet')
+    OpenHouseProcessor(input_path, output_path, lookups=True, row_group_size=8, **options).run()
+    expected = pd.read_parquet(output_path)
+    assert expected['OpenHouseKey'].is_monotonic_increasing
+
+    lookup = OpenHouseLookup(output_path)
+    assert lookup.file.num_row_groups == 8
+    for record in expected.to_dict('records'):
+        key = record['OpenHouseKey']
+        read = lookup.row_groups_read
+        assert lookup.get_open_house(key if isinstance(key, str) else key.hex()) == record
+        assert lookup.row_groups_read == read + 1
+    assert lookup.get_open_house(_md5('missing')) is None
+    assert lookup.get_open_house('not hex') is None
+    assert lookup.get_open_house(_md5('short')[:30]) is None
+    assert lookup.get_listing_open_houses(_md5('short')[:30]).empty
+
+    for listing_key in expected['ListingKey'].unique():
+        read = lookup.row_groups_read
+        actual = lookup.get_listing_open_houses(listing_key)
+        listing = expected[expected['ListingKey'] == listing_key]
+        pd.testing.assert_frame_equal(actual, listing.sort_values('OpenHouseStartTime', ignore_index=True))
+        assert lookup.row_groups_read - read == len(set(listing.index // 8))
+    lookup.close()
+
+
+def test_stale_listing_index_is_ignored(input_path, tmp_path):
+    # Test case: After the output is rewritten without lookups the index no longer matches and is not used
+    output_path = str(tmp_path / 'processed.parquet')
+    OpenHouseProcessor(input_path, output_path, lookups=True, row_group_size=8).run()
+    listing_key = _md5('listing-3')
+    assert OpenHouseLookup(output_path).listing_keys is not None
+
+    OpenHouseProcessor(input_path, output_path).run()
+    os.utime(output_path, ns=(0, 0))
+    lookup = OpenHouseLookup(output_path)
+    expected = pd.read_parquet(output_path)
+    assert lookup.listing_keys is None
+    pd.testing.assert_frame_equal(
+        lookup.get_listing_open_houses(listing_key),
+        expected[expected['ListingKey'] == listing_key].sort_values('OpenHouseStartTime', ignore_index=True),
+    )
+    assert lookup.get_open_house(expected['OpenHouseKey'][0]) == expected.iloc[0].to_dict()
+    lookup.close()
+
+
+def test_lookups_need_a_single_file(input_path, tmp_path):
+    with pytest.raises(ValueError):
+        OpenHouseProcessor(input_path, str(tmp_path / 'processed'), lookups=True, incremental=True)
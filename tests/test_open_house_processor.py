@@ -1,9 +1,21 @@
+import io
 import os
+import tempfile
+import threading
 import unittest
+import warnings
 import json
 from unittest.mock import patch, mock_open
+import numpy as np
 import pandas as pd
-from src.open_house_processor import OpenHouseProcessor
+import pyarrow as pa
+import pyarrow.parquet as pq
+from src.open_house_layout import data_fingerprint, is_current
+from src.open_house_processor import (
+    DISTINCT_LISTINGS_FILE, TOP_ZIPCODES_FILE, OpenHouseProcessor, SpaceSaving, compute_rollups, compute_sketches,
+    hll_registers, iter_json_array, json_array_to_ndjson, latest_per_key, parse_hex_keys, parse_timestamps,
+    rollup_path, split_zipcodes
+)
 
 
 class TestOpenHouseProcessor(unittest.TestCase):
@@ -125,6 +137,129 @@ class TestOpenHouseProcessor(unittest.TestCase):
         self.assertEqual(len(cleaned_data), 1)  # Only one record should remain
         self.assertEqual(cleaned_data.iloc[0]['OpenHouseMethod'], 'In-person')  # The valid record should be kept
 
+    def test_process_data_strict_timestamps(self):
+        # Test case: Only exact UTC ISO-8601 timestamps are accepted, rejections are counted per column
+        base = {
+            'OpenHouseMethod': 'In-person',
+            'ListingKey': '12345',
+            'OpenHouseDate': '2023-04-01',
+            'State': 'CA',
+            'Zipcode': '92630',
+            'OpenHouseStartTime': '2023-04-01T20:00:00.000Z',
+            'OpenHouseEndTime': '2023-04-01T23:00:00.000Z',
+            'DateModified': '2023-03-27T20:23:02.200Z',
+        }
+        data = [
+            {**base, 'OpenHouseKey': '1', 'OpenHouseStartTime': '20:00', 'OpenHouseEndTime': '23:00'},
+            {**base, 'OpenHouseKey': '1'},
+            {**base, 'OpenHouseKey': '2', 'OpenHouseEndTime': '2023-04-01T23:00:00+02:00'},
+            {**base, 'OpenHouseKey': '3', 'DateModified': '2023-02-30T20:23:02.200Z'},
+            {**base, 'OpenHouseKey': '4', 'OpenHouseStartTime': '2023-04-01T20:00:00Z'},
+        ]
+
+        processor = OpenHouseProcessor(self.input_path, self.output_path)
+        cleaned_data = processor.process_data(data)
+        legacy = OpenHouseProcessor(self.input_path, self.output_path, timestamp_formats=None)
+        legacy_data = legacy.process_data(data[:3])
+
+        self.assertEqual(sorted(cleaned_data['OpenHouseKey']), ['1', '4'])
+        self.assertEqual(cleaned_data.loc[1, 'OpenHouseStartTime'], pd.Timestamp('2023-04-01T20:00:00Z'))
+        self.assertEqual(processor.rejections, {'OpenHouseKey': 0, 'OpenHouseStartTime': 1, 'OpenHouseEndTime': 2,
+                                                'DateModified': 1})
+        # The inferring parser keeps the `20:00` record, dated today, because it comes first among the ties,
+        # and it raises on the impossible DateModified rather than dropping the record
+        self.assertNotEqual(legacy_data.loc[0, 'OpenHouseStartTime'], pd.Timestamp('2023-04-01T20:00:00Z'))
+        with self.assertRaises(Exception):
+            legacy.process_data(data)
+
+    def test_latest_per_key(self):
+        # Test case: Max DateModified per key, earliest row on ties, same rows for pandas and Arrow input
+        df = pd.DataFrame({
+            'OpenHouseKey': ['a', 'b', 'a', None, 'b', 'a', 'c'],
+            'DateModified': pd.to_datetime(['2023-01-01', '2023-01-05', '2023-01-03', '2023-02-01',
+                                            '2023-01-05', '2023-01-03', None], utc=True),
+            'Row': range(7),
+        })
+
+        latest = latest_per_key(df)
+        arrow_latest = latest_per_key(pa.Table.from_pandas(df, preserve_index=False))
+        # A slice, as `_compact` hands over, is sorted into a new frame rather than written through
+        keyed = df[df['OpenHouseKey'].notna()]
+        with warnings.catch_warnings():
+            warnings.simplefilter('error', pd.errors.SettingWithCopyWarning)
+            sorted_latest = OpenHouseProcessor(self.input_path, self.output_path, dedup='sort').keep_latest(keyed)
+
+        self.assertEqual(list(latest['Row']), [1, 2, 6])  # Input order, ties go to the earliest row
+        self.assertEqual(arrow_latest['Row'].to_pylist(), [1, 2, 6])
+        self.assertEqual(sorted(sorted_latest['Row']), [1, 2, 6])
+
+    def test_parse_timestamps(self):
+        # Test case: Shape, field ranges and custom formats
+        values = pd.Series(['2024-02-29T23:59:59.999Z', '2023-02-29T00:00:00.000Z', '2023-04-01T24:00:00.000Z',
+                            '2023-04-01T20:00:00.000Z ', '2023-04-01 20:00:00.000Z', None, 5, '2023-04-01'])
+
+        parsed = parse_timestamps(values)
+        custom = parse_timestamps(values, formats=['%Y-%m-%d'])
+
+        self.assertEqual(parsed[0], pd.Timestamp('2024-02-29T23:59:59.999Z'))
+        self.assertTrue(parsed[1:].isna().all())
+        self.assertEqual(custom[7], pd.Timestamp('2023-04-01T00:00:00Z'))
+        self.assertEqual(int(custom.notna().sum()), 1)
+        with self.assertRaises(ValueError):
+            parse_timestamps(values, formats=['%Y-%m-%dT%H:%M:%S%z'])
+
+    def test_parse_hex_keys(self):
+        # Test case: 32 hex digits in either case pack into 16 bytes, anything else is rejected
+        key = '757a9f8a402982a6c7cd81cc9b689bcc'
+        values = pd.Series([key, key.upper(), key[:-1], key + '0', key[:-1] + 'g', None, 12345])
+        keys = parse_hex_keys(values)
+        self.assertEqual(str(keys.dtype), 'fixed_size_binary[16][pyarrow]')
+        self.assertEqual(keys.to_numpy(dtype=object)[:2].tolist(), [bytes.fromhex(key)] * 2)
+        self.assertEqual(keys.isna().tolist(), [False, False, True, True, True, True, True])
+
+    def test_split_zipcodes(self):
+        # Test case: ZIP+4 codes are split off, malformed zip codes are rejected
+        zip5, plus4 = split_zipcodes(pd.Series(['92630', '94521-3711', '9452', '94521 3711', 'abcde', None]))
+        self.assertEqual(zip5.tolist(), ['92630', '94521', None, None, None, None])
+        self.assertEqual(plus4.tolist(), [None, '3711', None, None, None, None])
+
+    def test_process_data_compact(self):
+        # Test case: The compact schema keeps the same records as the default one in far less memory
+        def record(key, zipcode, modified):
+            return {
+                'OpenHouseMethod': 'In Person',
+                'OpenHouseEndTime': '2023-06-18T10:00:00.000Z',
+                'ListingKey': '757a9f8a402982a6c7cd81cc9b689bcc',
+                'OpenHouseKey': key,
+                'OpenHouseStartTime': '2023-06-18T08:00:00.000Z',
+                'OpenHouseDate': '2023-06-18',
+                'State': 'CA',
+                'Zipcode': zipcode,
+                'DateModified': modified
+            }
+
+        keys = [f'{i:032x}' for i in range(200)]
+        data = [record(key, '92630-1234' if i % 2 else '92630', '2023-06-18T12:00:00.000Z')
+                for i, key in enumerate(keys)]
+        data += [record(keys[0], '92610', '2023-06-19T12:00:00.000Z'), record('not-a-key', '92630', None),
+                 record('0' * 31 + 'x', '92630', '2023-06-18T12:00:00.000Z')]
+
+        default = OpenHouseProcessor(self.input_path, self.output_path).process_data(data)
+        default = default[default['OpenHouseKey'] != '0' * 31 + 'x']
+        processor = OpenHouseProcessor(self.input_path, self.output_path, compact=True)
+        compact = processor.process_data(data)
+
+        self.assertEqual(len(compact), 200)
+        self.assertEqual(compact['OpenHouseKey'].to_numpy(dtype=object).tolist(),
+                         [bytes.fromhex(key) for key in default['OpenHouseKey']])
+        self.assertEqual(compact.iloc[-1]['Zipcode'], '92610')  # keys[0] was superseded, so it is last
+        self.assertEqual(compact['ZipcodePlus4'].iloc[0], '1234')
+        self.assertTrue(pd.isna(compact['ZipcodePlus4'].iloc[1]))
+        self.assertEqual(compact['State'].dtype, 'category')
+        self.assertEqual(processor.metrics.stages['validate'].dropped['bad_key'], 1)
+        self.assertEqual(processor.rejections['OpenHouseKey'], 1)
+        self.assertLess(compact.memory_usage(deep=True).sum() * 3, default.memory_usage(deep=True).sum())
+
     def test_read_data(self):
         # Test case: Valid JSON data
         expected_data = [
@@ -229,6 +364,612 @@ class TestOpenHouseProcessor(unittest.TestCase):
         mock_process_data.assert_called_once_with(data)
         mock_write_data.assert_called_once_with(cleaned_data)
 
+    def test_iter_json_array_small_chunks(self):
+        # Test case: Elements split across chunk boundaries are decoded intact
+        expected_data = [{'OpenHouseKey': str(i), 'Zipcode': '92630-1234', 'Nested': {'a': [1, 2]}} for i in range(5)]
+        file = io.StringIO(json.dumps(expected_data, indent=2))
+
+        actual_data = list(iter_json_array(file, chunk_size=7))
+
+        self.assertEqual(actual_data, expected_data)
+        self.assertEqual(list(iter_json_array(io.StringIO(' [ ] '))), [])
+        with self.assertRaises(ValueError):
+            list(iter_json_array(io.StringIO('{"OpenHouseKey": "1"}')))
+        with self.assertRaises(ValueError):
+            list(iter_json_array(io.StringIO('[{"OpenHouseKey": "1"}')))
+
+    def test_json_array_to_ndjson(self):
+        # Test case: Only the array's own brackets and commas change, whatever the strings and nesting hold
+        records = [{'a': 'x,y]"}', 'b': [1, {'c': 2}]}, {'a': '\\', 'b': []}, {'a': '\\"[', 'b': None}]
+        for indent in (None, 2):
+            for chunk_size in (1, 3, 1 << 20):
+                raw = json.dumps(records, indent=indent).encode()
+                buffer = json_array_to_ndjson(np.frombuffer(raw, dtype=np.uint8).copy(), chunk_size)
+                lines = bytes(buffer).splitlines()
+                self.assertEqual(len(lines), 3)
+                self.assertEqual([json.loads(line) for line in lines], records)
+
+    def test_run_arrow_engine_matches_pandas(self):
+        # Test case: The arrow engine writes the same records, in the same order, as the pandas engine
+        data = [
+            {
+                'OpenHouseMethod': 'In Person' if i % 5 else 'Virtual, "live"',
+                'OpenHouseEndTime': '2023-06-18T10:00:00.000Z' if i % 7 else '10:00',
+                'ListingKey': str(i % 4),
+                'OpenHouseKey': str(i % 6) if i % 11 else None,
+                'OpenHouseStartTime': '2023-06-18T08:00:00Z' if i % 3 else '2023-06-18T08:00:00.000Z',
+                'OpenHouseDate': '2023-06-18',
+                'State': 'CA',
+                'Zipcode': '92630-1234' if i % 2 else '92630',
+                'DateModified': f'2023-06-18T12:00:0{i % 3}.000Z' if i % 13 else '2023-02-30T12:00:00.000Z'
+            }
+            for i in range(40)
+        ]
+
+        with tempfile.TemporaryDirectory() as tmp:
+            input_path = os.path.join(tmp, 'openhouses.json')
+            with open(input_path, 'w') as file:
+                json.dump(data, file, indent=2)
+            tables = {}
+            for dedup in ('hash', 'sort'):
+                for engine in ('pandas', 'arrow'):
+                    output_path = os.path.join(tmp, f'{engine}_{dedup}.parquet')
+                    processor = OpenHouseProcessor(input_path, output_path, engine=engine, dedup=dedup)
+                    processor.run()
+                    tables[engine, dedup] = pq.read_table(output_path).replace_schema_metadata(None)
+                    self.assertEqual(processor.rejections['DateModified'], 4)
+
+        self.assertEqual(tables['arrow', 'hash'].num_rows, 6)
+        for dedup in ('hash', 'sort'):
+            self.assertTrue(tables['arrow', dedup].equals(tables['pandas', dedup]))
+        with self.assertRaises(ValueError):
+            OpenHouseProcessor(self.input_path, self.output_path, engine='arrow', workers=2)
+
+    def test_run_duckdb_engine_matches_pandas(self):
+        # Test case: The out-of-core engine writes the same records, in the same order, as the pandas engine
+        data = [
+            {
+                'OpenHouseMethod': 'In Person' if i % 5 else None,
+                'OpenHouseEndTime': '2023-06-18T10:00:00.000Z' if i % 7 else '10:00',
+                'ListingKey': str(i % 4),
+                'OpenHouseKey': str(i % 6) if i % 11 else None,
+                'OpenHouseStartTime': '2023-06-18T08:00:00Z' if i % 3 else '2023-06-18T08:00:00.000Z',
+                'OpenHouseDate': '2023-06-18',
+                'State': 'CA',
+                'Zipcode': '92630-1234' if i % 2 else '92630',
+                'DateModified': f'2023-06-18T12:00:0{i % 3}.000Z' if i % 13 else '2023-02-30T12:00:00.000Z'
+            }
+            for i in range(40)
+        ]
+        # Later batches lack a field, and add one the first batches did not have
+        for i, record in enumerate(data):
+            if i >= 24:
+                del record['OpenHouseMethod']
+            if i >= 30:
+                record['Extra'] = f'extra-{i}'
+
+        with tempfile.TemporaryDirectory() as tmp:
+            input_path = os.path.join(tmp, 'openhouses.json')
+            with open(input_path, 'w') as file:
+                json.dump(data, file)
+            for dedup in ('hash', 'sort'):
+                expected = OpenHouseProcessor(input_path, os.path.join(tmp, 'pandas.parquet'), dedup=dedup)
+                expected.run()
+                # Batches of 4 records split most keys across batches, and before their latest record
+                processor = OpenHouseProcessor(input_path, os.path.join(tmp, 'duckdb.parquet'), dedup=dedup,
+                                               engine='duckdb', batch_size=4, memory_limit='64MB')
+                processor.run()
+                pd.testing.assert_frame_equal(pd.read_parquet(processor.output_path),
+                                              pd.read_parquet(expected.output_path).reset_index(drop=True))
+                self.assertEqual(processor.rejections, expected.rejections)
+                for name in ('validate', 'dedup'):
+                    self.assertEqual(processor.metrics.stages[name].dropped, expected.metrics.stages[name].dropped)
+            self.assertEqual(sorted(os.listdir(tmp)), ['duckdb.parquet', 'openhouses.json', 'pandas.parquet'])
+
+            # A field that is text in some batches and numbers in others cannot be unified
+            with open(input_path, 'w') as file:
+                json.dump([dict(record, Extra=i if i < 4 else str(i)) for i, record in enumerate(data)], file)
+            with self.assertRaisesRegex(ValueError, 'Extra'):
+                OpenHouseProcessor(input_path, os.path.join(tmp, 'duckdb.parquet'), engine='duckdb', batch_size=4).run()
+
+        with self.assertRaises(ValueError):
+            OpenHouseProcessor(self.input_path, self.output_path, engine='duckdb', incremental=True)
+
+    def test_run_multiple_compressed_inputs(self):
+        # Test case: A directory of plain, gzip and zstd files in array or NDJSON form reads like one file
+        data = [
+            {
+                'OpenHouseMethod': f'Method-{i}',
+                'OpenHouseEndTime': '2023-06-18T10:00:00Z' if i != 3 else '10:00',
+                'ListingKey': str(i % 3),
+                'OpenHouseKey': str(i % 5) if i != 7 else None,
+                'OpenHouseStartTime': '2023-06-18T08:00:00Z',
+                'OpenHouseDate': '2023-06-18',
+                'State': 'CA',
+                'Zipcode': '92630',
+                'DateModified': f'2023-06-18T12:00:0{i % 4}Z'
+            }
+            for i in range(24)
+        ]
+
+        with tempfile.TemporaryDirectory() as tmp:
+            single_path = os.path.join(tmp, 'openhouses.json')
+            with open(single_path, 'w') as file:
+                json.dump(data, file)
+            input_dir = os.path.join(tmp, 'drops')
+            os.makedirs(input_dir)
+            with open(os.path.join(input_dir, '0.json'), 'w') as file:
+                json.dump(data[:8], file, indent=2)
+            ndjson = ''.join(json.dumps(record) + '\n' for record in data[8:16]).encode()
+            with pa.output_stream(os.path.join(input_dir, '1.ndjson.gz'), compression='gzip') as stream:
+                stream.write(ndjson)
+            ndjson = ''.join(json.dumps(record) + '\n' for record in data[16:]).encode()
+            with pa.output_stream(os.path.join(input_dir, '2.json.zst'), compression='zstd') as stream:
+                stream.write(ndjson)
+            with open(os.path.join(input_dir, '_manifest.json'), 'w') as file:
+                file.write('not json')
+
+            expected = OpenHouseProcessor(single_path, os.path.join(tmp, 'single.parquet'))
+            expected.run()
+            self.assertEqual(OpenHouseProcessor(input_dir, self.output_path).read_data(), data)
+            for options in ({}, {'read_workers': 1}, {'batch_size': 5}, {'engine': 'arrow'}):
+                processor = OpenHouseProcessor(input_dir, os.path.join(tmp, 'multi.parquet'), **options)
+                processor.run()
+                pd.testing.assert_frame_equal(pd.read_parquet(processor.output_path).reset_index(drop=True),
+                                              pd.read_parquet(expected.output_path).reset_index(drop=True))
+            processor = OpenHouseProcessor(os.path.join(input_dir, '[12].*'), self.output_path)
+            self.assertEqual(processor.read_data(), data[8:])
+            with self.assertRaises(FileNotFoundError):
+                OpenHouseProcessor(os.path.join(tmp, '*.gz'), self.output_path).read_data()
+
+    def test_run_batches_matches_full_read(self):
+        # Test case: Streaming in small batches produces the same output as reading the whole file
+        records = []
+        for i in range(10):
+            records.append({
+                'OpenHouseMethod': f'Method-{i}',
+                'OpenHouseEndTime': '2023-06-18T10:00:00Z' if i != 3 else '10:00',
+                'ListingKey': '12345',
+                'OpenHouseKey': str(i % 4) if i != 5 else None,
+                'OpenHouseStartTime': '2023-06-18T08:00:00Z',
+                'OpenHouseDate': '2023-06-18',
+                'State': 'CA',
+                'Zipcode': '92630',
+                'DateModified': f'2023-06-18T12:00:{i:02d}Z'
+            })
+
+        with tempfile.TemporaryDirectory() as tmp:
+            input_path = os.path.join(tmp, 'openhouses.json')
+            with open(input_path, 'w') as file:
+                json.dump(records, file)
+
+            full = OpenHouseProcessor(input_path, os.path.join(tmp, 'full.parquet'))
+            full.run()
+            batched = OpenHouseProcessor(input_path, os.path.join(tmp, 'batched.parquet'), batch_size=3)
+            self.assertEqual(sum(len(batch) for batch in batched.read_batches()), len(records))
+            batched.run()
+
+            expected = pd.read_parquet(full.output_path).sort_values('OpenHouseKey', ignore_index=True)
+            actual = pd.read_parquet(batched.output_path).sort_values('OpenHouseKey', ignore_index=True)
+            pandas_metadata = pq.read_schema(batched.output_path).pandas_metadata
+
+        pd.testing.assert_frame_equal(actual, expected)
+        self.assertIsNotNone(pandas_metadata)
+        self.assertEqual(list(actual['OpenHouseMethod']), ['Method-8', 'Method-9', 'Method-6', 'Method-7'])
+
+    def test_process_data_parallel_matches_serial(self):
+        # Test case: Sharded processing across processes returns exactly the serial result, ties included
+        data = []
+        for i in range(40):
+            data.append({
+                'OpenHouseMethod': f'Method-{i}',
+                'OpenHouseEndTime': '2023-06-18T10:00:00Z' if i % 7 else '10:00',
+                'ListingKey': '12345',
+                'OpenHouseKey': str(i % 6) if i % 11 else None,
+                'OpenHouseStartTime': '2023-06-18T08:00:00Z',
+                'OpenHouseDate': '2023-06-18',
+                'State': 'CA',
+                'Zipcode': '92630',
+                'DateModified': f'2023-06-18T12:00:{i // 3:02d}Z'
+            })
+
+        processor = OpenHouseProcessor(self.input_path, self.output_path, workers=2)
+        expected = processor.process_data(data)
+        actual = processor.process_data_parallel(data)
+
+        pd.testing.assert_frame_equal(actual, expected)
+
+    def test_run_incremental_matches_full_reprocess(self):
+        # Test case: Upserting two drops gives the same records as processing them together
+        def record(key, method, modified, end_time='2023-06-18T10:00:00Z'):
+            return {
+                'OpenHouseMethod': method,
+                'OpenHouseEndTime': end_time,
+                'ListingKey': '12345',
+                'OpenHouseKey': key,
+                'OpenHouseStartTime': '2023-06-18T08:00:00Z',
+                'OpenHouseDate': '2023-06-18',
+                'State': 'CA',
+                'Zipcode': '92630',
+                'DateModified': modified
+            }
+
+        first = [record('1', 'In-person', '2023-06-18T12:00:00Z'), record('2', 'In-person', '2023-06-18T12:00:00Z'),
+                 record('3', 'In-person', '2023-06-18T12:00:00Z')]
+        second = [record('1', 'Virtual', '2023-06-19T12:00:00Z'), record('4', 'Virtual', '2023-06-19T12:00:00Z'),
+                  record('2', 'Virtual', '2023-06-19T13:00:00Z', end_time='not-a-time'), record(None, 'Virtual', '2023-06-19T13:00:00Z')]
+
+        with tempfile.TemporaryDirectory() as tmp:
+            input_path = os.path.join(tmp, 'openhouses.json')
+            output_path = os.path.join(tmp, 'processed')
+            processor = OpenHouseProcessor(input_path, output_path, incremental=True)
+            for drop in (first, second, second):
+                with open(input_path, 'w') as file:
+                    json.dump(drop, file)
+                processor.run()
+
+            watermark, next_part = processor.read_watermark()
+            index = processor.read_key_index()
+            actual = pd.read_parquet(output_path).sort_values('OpenHouseKey', ignore_index=True)
+            files = sorted(name for name in os.listdir(output_path) if not name.startswith('_'))
+            pandas_metadata = [pq.read_schema(os.path.join(output_path, name)).pandas_metadata for name in files]
+
+        expected = processor.process_data(first + second).sort_values('OpenHouseKey', ignore_index=True)
+        pd.testing.assert_frame_equal(actual, expected)
+        self.assertEqual(watermark, pd.Timestamp('2023-06-19T12:00:00Z'))
+        self.assertEqual(next_part, 3)  # The repeated drop had nothing newer and wrote nothing
+        self.assertEqual(sorted(index.index), ['1', '2', '3', '4'])
+        self.assertEqual(index.loc['1', 'File'], 'part-00001.parquet')
+        # The first drop's file lost key 1 and was rewritten as part 2
+        self.assertEqual(index.loc['2', 'File'], 'part-00002.parquet')
+        self.assertEqual(files, ['part-00001.parquet', 'part-00002.parquet'])
+        self.assertNotIn(None, pandas_metadata)
+
+    def test_run_incremental_late_records(self):
+        # Test case: Records at or before the watermark still upsert when their key is new or they are newer
+        def record(key, method, modified):
+            return {
+                'OpenHouseMethod': method,
+                'OpenHouseEndTime': '2023-06-18T10:00:00Z',
+                'ListingKey': '12345',
+                'OpenHouseKey': key,
+                'OpenHouseStartTime': '2023-06-18T08:00:00Z',
+                'OpenHouseDate': '2023-06-18',
+                'State': 'CA',
+                'Zipcode': '92630',
+                'DateModified': modified
+            }
+
+        first = [record('1', 'In-person', '2023-06-18T12:00:00Z'), record('2', 'In-person', '2023-06-19T12:00:00Z')]
+        late = [record('1', 'Virtual', '2023-06-18T13:00:00Z'), record('2', 'Virtual', '2023-06-18T13:00:00Z'),
+                record('3', 'Virtual', '2023-06-17T12:00:00Z')]
+
+        for options in ({}, {'batch_size': 2}, {'engine': 'arrow'}):
+            with tempfile.TemporaryDirectory() as tmp:
+                input_path = os.path.join(tmp, 'openhouses.json')
+                output_path = os.path.join(tmp, 'processed')
+                processor = OpenHouseProcessor(input_path, output_path, incremental=True, **options)
+                for drop in (first, late, late):
+                    with open(input_path, 'w') as file:
+                        json.dump(drop, file)
+                    processor.run()
+                actual = pd.read_parquet(output_path).sort_values('OpenHouseKey', ignore_index=True)
+                manifest = processor.read_manifest()
+
+            self.assertEqual(list(actual['OpenHouseMethod']), ['Virtual', 'In-person', 'Virtual'])
+            self.assertEqual(manifest['version'], 2)  # The repeated drop had nothing newer and wrote nothing
+            self.assertEqual(manifest['rows'], 3)
+            self.assertEqual(manifest['watermark'], '2023-06-19T12:00:00+00:00')
+            # The repeated drop was all applied already, so nothing of it was validated
+            self.assertEqual(processor.metrics.stages['skip'].dropped['applied'], 3)
+            self.assertEqual(processor.metrics.stages['validate'].rows_in, 0)
+
+    def test_run_incremental_drops_late_records(self):
+        # Test case: With the `drop` policy, records at or before the watermark are skipped without the key index
+        def record(key, modified):
+            return {
+                'OpenHouseMethod': 'In-person',
+                'OpenHouseEndTime': '2023-06-18T10:00:00Z',
+                'ListingKey': '12345',
+                'OpenHouseKey': key,
+                'OpenHouseStartTime': '2023-06-18T08:00:00Z',
+                'OpenHouseDate': '2023-06-18',
+                'State': 'CA',
+                'Zipcode': '92630',
+                'DateModified': modified
+            }
+
+        first = [record('1', '2023-06-18T12:00:00Z'), record('2', '2023-06-19T12:00:00Z')]
+        second = [record('1', '2023-06-18T13:00:00Z'), record('3', '2023-06-17T12:00:00Z'),
+                  record('4', '2023-06-20T12:00:00Z'), record('5', 'not-a-time')]
+
+        with tempfile.TemporaryDirectory() as tmp:
+            input_path = os.path.join(tmp, 'openhouses.json')
+            output_path = os.path.join(tmp, 'processed')
+            processor = OpenHouseProcessor(input_path, output_path, incremental=True, late_records='drop')
+            for drop in (first, second):
+                if drop is second:
+                    with patch.object(processor, 'read_key_index', side_effect=AssertionError('index read')):
+                        skipped = processor.skip_applied(pd.DataFrame(second))
+                with open(input_path, 'w') as file:
+                    json.dump(drop, file)
+                processor.run()
+            actual = pd.read_parquet(output_path).sort_values('OpenHouseKey', ignore_index=True)
+
+        self.assertEqual(list(actual['OpenHouseKey']), ['1', '2', '4'])
+        self.assertEqual(actual.loc[0, 'DateModified'], pd.Timestamp('2023-06-18T12:00:00Z'))
+        # Only the newer record goes on, and the one whose DateModified does not parse, for validation to reject
+        self.assertEqual(list(skipped['OpenHouseKey']), ['4', '5'])
+        self.assertEqual(processor.metrics.stages['validate'].dropped['bad_date_modified'], 1)
+        with self.assertRaises(ValueError):
+            OpenHouseProcessor(input_path, output_path, incremental=True, late_records='keep')
+
+    def test_write_partitioned(self):
+        # Test case: Output is split by month and state, sorted within partitions, with row group statistics
+        df = pd.DataFrame({
+            'OpenHouseKey': ['1', '2', '3', '4', '5'],
+            'OpenHouseDate': ['2023-04-02', '2023-03-31', '2023-04-01', '2023-04-01', '2023-04-03'],
+            'State': ['CA', 'CA', 'NV', 'CA', 'CA'],
+            'Zipcode': ['92630', '92630', '89501', '92610-1234', '92630'],
+        })
+
+        with tempfile.TemporaryDirectory() as tmp:
+            output_path = os.path.join(tmp, 'processed')
+            processor = OpenHouseProcessor(self.input_path, output_path, partition_by=['OpenHouseMonth', 'State'],
+                                           row_group_size=2, compression='zstd')
+            processor.write_partitioned(df)
+
+            partitions = sorted(os.path.relpath(root, output_path) for root, _, files in os.walk(output_path) if files)
+            metadata = pq.ParquetFile(os.path.join(output_path, 'OpenHouseMonth=2023-04', 'State=CA', 'part-0.parquet')).metadata
+            actual = pd.read_parquet(os.path.join(output_path, 'OpenHouseMonth=2023-04', 'State=CA'))
+
+        self.assertEqual(partitions, ['OpenHouseMonth=2023-03/State=CA', 'OpenHouseMonth=2023-04/State=CA',
+                                      'OpenHouseMonth=2023-04/State=NV'])
+        self.assertEqual(list(actual['OpenHouseKey']), ['4', '1', '5'])
+        self.assertEqual(metadata.num_row_groups, 2)
+        date_stats = metadata.row_group(0).column(1).statistics
+        self.assertEqual((date_stats.min, date_stats.max), ('2023-04-01', '2023-04-02'))
+        self.assertEqual(metadata.row_group(0).column(1).compression, 'ZSTD')
+
+    def test_write_partitioned_replaces_the_output_whole(self):
+        # Test case: A rewrite swaps in the new partitions, and a failed one leaves the previous output as it was
+        first = pd.DataFrame({'OpenHouseKey': ['1', '2'], 'OpenHouseDate': ['2023-04-01', '2023-05-01'],
+                              'State': ['CA', 'NV'], 'Zipcode': ['92630', '89501']})
+        second = first.iloc[:1].assign(State='TX')
+
+        with tempfile.TemporaryDirectory() as tmp:
+            output_path = os.path.join(tmp, 'processed')
+            processor = OpenHouseProcessor(self.input_path, output_path, partition_by=['State'])
+            processor.write_partitioned(first)
+            with patch('pyarrow.dataset.write_dataset', side_effect=OSError('disk full')):
+                with self.assertRaises(OSError):
+                    processor.write_partitioned(second)
+            after_failure = sorted(os.listdir(output_path))
+            processor.write_partitioned(second)
+            after_rewrite = sorted(os.listdir(output_path))
+            leftovers = sorted(os.listdir(tmp))
+
+        self.assertEqual(after_failure, ['State=CA', 'State=NV'])
+        self.assertEqual(after_rewrite, ['State=TX'])
+        self.assertEqual(leftovers, ['processed'])
+
+    def test_run_incremental_rollups(self):
+        # Test case: Rollups first written on a later incremental run, then maintained and merged, match the records
+        def record(key, date, zipcode, modified):
+            return {
+                'OpenHouseMethod': 'In-person',
+                'OpenHouseEndTime': '2023-06-18T10:00:00Z',
+                'ListingKey': '12345',
+                'OpenHouseKey': key,
+                'OpenHouseStartTime': '2023-06-18T08:00:00Z',
+                'OpenHouseDate': date,
+                'State': 'CA',
+                'Zipcode': zipcode,
+                'DateModified': modified
+            }
+
+        drops = [
+            [record('1', '2023-06-18', '92630', '2023-06-18T12:00:00Z'),
+             record('2', '2023-06-19', '92630-1234', '2023-06-18T12:00:00Z')],
+            [record('1', '2023-06-26', '92610', '2023-06-19T12:00:00Z'),
+             record('3', '2023-06-19', '92630', '2023-06-19T12:00:00Z')],
+            [record('2', '2023-06-20', '92630', '2023-06-20T12:00:00Z')],
+        ]
+
+        with tempfile.TemporaryDirectory() as tmp:
+            input_path = os.path.join(tmp, 'openhouses.json')
+            output_path = os.path.join(tmp, 'processed')
+            # The first run writes no rollups, so the second rebuilds them from every record rather than its own
+            for drop, rollups in zip(drops, (False, True, True)):
+                with open(input_path, 'w') as file:
+                    json.dump(drop, file)
+                OpenHouseProcessor(input_path, output_path, incremental=True, rollups=rollups).run()
+            processor = OpenHouseProcessor(input_path, output_path, incremental=True)
+            self.assertEqual(processor.merge_small_files(), 2)
+            paths = {name: os.path.join(rollup_path(output_path), f'{name}.parquet')
+                     for name in ('daily', 'weekly', 'zipcode')}
+            fingerprint = data_fingerprint(output_path)
+            self.assertTrue(all(is_current(path, fingerprint) for path in paths.values()))
+            actual = {name: pd.read_parquet(path) for name, path in paths.items()}
+            expected = compute_rollups(pd.read_parquet(output_path))
+
+        self.assertEqual(list(expected['zipcode']['OpenHouseCount']), [1, 2])
+        for name, rollup in expected.items():
+            columns = list(rollup.columns)
+            pd.testing.assert_frame_equal(actual[name].sort_values(columns, ignore_index=True),
+                                          rollup.sort_values(columns, ignore_index=True))
+
+    def test_space_saving_bounds(self):
+        # Test case: Counters bound the true counts from both sides however the stream is split and merged
+        values = pd.Series(np.random.default_rng(0).zipf(1.5, 5000) % 40).astype(str)
+        exact = values.value_counts()
+
+        streamed = SpaceSaving(capacity=8)
+        for start in range(0, len(values), 700):
+            streamed.update(values[start:start + 700])
+        halves = SpaceSaving(capacity=8), SpaceSaving(capacity=8)
+        halves[0].update(values[:2500])
+        halves[1].update(values[2500:])
+        halves[0].merge(halves[1])
+        restored = SpaceSaving.from_arrow(streamed.to_arrow())
+
+        for summary in (streamed, halves[0], restored):
+            counters = summary.counters
+            true_counts = exact.reindex(counters.index)
+            self.assertEqual(summary.total, len(values))
+            self.assertTrue((counters['Count'] >= true_counts).all())
+            self.assertTrue((counters['Count'] - counters['Error'] <= true_counts).all())
+            self.assertGreaterEqual(summary.floor, exact.drop(counters.index).max())
+            self.assertLessEqual(summary.floor, len(values) / 8)
+            self.assertEqual(list(counters.index[:3]), list(exact.index[:3]))
+        pd.testing.assert_frame_equal(restored.counters, streamed.counters)
+
+    def test_run_incremental_sketches(self):
+        # Test case: Sketches first written on a later incremental run, then maintained and merged, match the records
+        def record(key, listing, zipcode, modified):
+            return {
+                'OpenHouseMethod': 'In-person',
+                'OpenHouseEndTime': '2023-06-18T10:00:00Z',
+                'ListingKey': listing,
+                'OpenHouseKey': key,
+                'OpenHouseStartTime': '2023-06-18T08:00:00Z',
+                'OpenHouseDate': '2023-06-18',
+                'State': 'CA',
+                'Zipcode': zipcode,
+                'DateModified': modified
+            }
+
+        drops = [
+            [record(str(i), f'L{i % 30}', f'9{i % 3}630-1234', '2023-06-18T12:00:00Z') for i in range(60)],
+            [record(str(i), f'L{i % 30}', f'9{i % 3}630', '2023-06-19T12:00:00Z') for i in range(40, 90)],
+            [record(str(i), f'L{i % 30}', f'9{i % 3}630', '2023-06-20T12:00:00Z') for i in range(10)],
+        ]
+
+        with tempfile.TemporaryDirectory() as tmp:
+            input_path = os.path.join(tmp, 'openhouses.json')
+            output_path = os.path.join(tmp, 'processed')
+            # The first run writes no sketches, so the second rebuilds them from every record rather than its own
+            for drop, sketches in zip(drops, (False, True, True)):
+                with open(input_path, 'w') as file:
+                    json.dump(drop, file)
+                OpenHouseProcessor(input_path, output_path, incremental=True, sketches=sketches).run()
+            self.assertGreater(OpenHouseProcessor(input_path, output_path, incremental=True).merge_small_files(), 1)
+            fingerprint = data_fingerprint(output_path)
+            self.assertTrue(all(is_current(os.path.join(rollup_path(output_path), name), fingerprint)
+                                for name in (TOP_ZIPCODES_FILE, DISTINCT_LISTINGS_FILE)))
+            top_zipcodes = SpaceSaving.from_arrow(pq.read_table(os.path.join(rollup_path(output_path),
+                                                                              TOP_ZIPCODES_FILE)))
+            registers = pd.read_parquet(os.path.join(rollup_path(output_path), DISTINCT_LISTINGS_FILE))
+            expected_top, expected_registers = compute_sketches(pd.read_parquet(output_path))
+
+        self.assertEqual(top_zipcodes.total, 90)
+        self.assertEqual(list(top_zipcodes.counters['Count']), [30, 30, 30])
+        pd.testing.assert_frame_equal(top_zipcodes.counters, expected_top.counters)
+        pd.testing.assert_frame_equal(registers, expected_registers)
+        listings = pd.Series([f'L{i}' for i in range(30)])
+        self.assertEqual(len(hll_registers(listings, pd.Series(['all'] * 30))), 30)
+
+    def test_run_compact_modes_match(self):
+        # Test case: Batched, parallel and incremental runs in the compact schema agree with a plain run
+        data = [
+            {
+                'OpenHouseMethod': 'In Person',
+                'OpenHouseEndTime': '2023-06-18T10:00:00.000Z',
+                'ListingKey': f'{i % 7:032x}',
+                'OpenHouseKey': f'{i % 40:032x}',
+                'OpenHouseStartTime': '2023-06-18T08:00:00.000Z',
+                'OpenHouseDate': f'2023-06-{10 + i % 20}',
+                'State': ['CA', 'NV'][i % 2],
+                'Zipcode': f'9{i % 9:04d}' + ('-1234' if i % 3 else ''),
+                'DateModified': f'2023-06-18T12:{i % 60:02d}:00.000Z'
+            }
+            for i in range(100)
+        ]
+
+        with tempfile.TemporaryDirectory() as tmp:
+            input_path = os.path.join(tmp, 'openhouses.json')
+            with open(input_path, 'w') as file:
+                json.dump(data, file)
+            outputs = {}
+            for name, options in [('plain', {}), ('batches', {'batch_size': 30}), ('parallel', {'workers': 2}),
+                                  ('incremental', {'incremental': True})]:
+                output_path = os.path.join(tmp, name)
+                OpenHouseProcessor(input_path, output_path, compact=True, **options).run()
+                outputs[name] = pd.read_parquet(output_path).sort_values('OpenHouseKey', ignore_index=True)
+
+        self.assertEqual(len(outputs['plain']), 40)
+        self.assertEqual(outputs['plain']['Zipcode'].dtype, 'category')
+        for name in ('batches', 'parallel', 'incremental'):
+            pd.testing.assert_frame_equal(outputs[name], outputs['plain'], check_categorical=False)
+
+    def test_run_metrics(self):
+        # Test case: Each stage reports its rows in and out, why rows were dropped, and the report is exported
+        def record(key, start, end, modified):
+            return {
+                'OpenHouseMethod': 'In-person',
+                'OpenHouseEndTime': end,
+                'ListingKey': '12345',
+                'OpenHouseKey': key,
+                'OpenHouseStartTime': start,
+                'OpenHouseDate': '2023-06-18',
+                'State': 'CA',
+                'Zipcode': '92630',
+                'DateModified': modified
+            }
+
+        start, end, modified = '2023-06-18T08:00:00Z', '2023-06-18T10:00:00Z', '2023-06-18T12:00:00Z'
+        data = [
+            record('1', start, end, modified),
+            record('1', start, end, '2023-06-18T13:00:00Z'),
+            record(None, start, end, modified),
+            record('2', '08:00', end, modified),
+            record('3', start, 'later', modified),
+            record('4', start, end, modified),
+        ]
+
+        with tempfile.TemporaryDirectory() as tmp:
+            input_path = os.path.join(tmp, 'openhouses.json')
+            metrics_path = os.path.join(tmp, 'metrics.json')
+            prometheus_path = os.path.join(tmp, 'metrics.prom')
+            with open(input_path, 'w') as file:
+                json.dump(data, file)
+            processor = OpenHouseProcessor(input_path, os.path.join(tmp, 'processed.parquet'),
+                                           metrics_path=metrics_path, prometheus_path=prometheus_path)
+            threads = []
+
+            def thread(*args, **kwargs):
+                threads.append(kwargs.get('name'))
+                return start_thread(*args, **kwargs)
+
+            start_thread = threading.Thread
+            with patch('threading.Thread', side_effect=thread):
+                processor.run()
+            with open(metrics_path) as file:
+                report = json.load(file)
+            with open(prometheus_path) as file:
+                prometheus = file.read()
+            # Another run starts its counts over
+            processor.run()
+
+        stages = report['stages']
+        self.assertEqual(list(stages), ['read', 'validate', 'dedup', 'write'])
+        self.assertEqual((stages['read']['rows_in'], stages['read']['rows_out']), (0, 6))
+        self.assertEqual((stages['validate']['rows_in'], stages['validate']['rows_out']), (6, 3))
+        self.assertEqual(stages['validate']['dropped'], {'null_key': 1, 'bad_start_time': 1, 'bad_end_time': 1,
+                                                        'bad_date_modified': 0})
+        self.assertEqual((stages['dedup']['rows_in'], stages['dedup']['rows_out']), (3, 2))
+        self.assertEqual(stages['dedup']['dropped'], {'superseded': 1})
+        self.assertEqual(stages['write']['rows_out'], 2)
+        self.assertGreater(stages['read']['peak_rss_bytes'], 0)
+        self.assertEqual(threads.count('openhouse-rss-sampler'), 1)
+        self.assertEqual(stages['validate']['rejected'], {'OpenHouseKey': 1, 'OpenHouseStartTime': 1,
+                                                         'OpenHouseEndTime': 1, 'DateModified': 0})
+        self.assertEqual(processor.rejections, stages['validate']['rejected'])
+        self.assertIn('openhouse_processor_stage_rows_out{stage="validate"} 3', prometheus)
+        self.assertIn('openhouse_processor_stage_rows_dropped{stage="validate",reason="null_key"} 1', prometheus)
+        self.assertIn('openhouse_processor_stage_values_rejected{stage="validate",column="OpenHouseEndTime"} 1',
+                      prometheus)
+
     def tearDown(self):
         # Clean up the test output file
         import os
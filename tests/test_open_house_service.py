@@ -0,0 +1,153 @@
+import asyncio
+import json
+import time
+
+import pandas as pd
+import pytest
+
+from benchmarks.generate_openhouses import write_feed
+from benchmarks.load_service import request, run_load, service_process
+from src.open_house_dashboard import DatasetManager, OpenHouseDashboard
+from src.open_house_processor import OpenHouseProcessor
+from src.open_house_service import OpenHouseService
+
+
+@pytest.fixture(scope='module')
+def data_path(tmp_path_factory):
+    tmp_path = tmp_path_factory.mktemp('service')
+    input_path, output_path = str(tmp_path / 'openhouses.json'), str(tmp_path / 'processed.parquet')
+    write_feed(input_path, 2000, seed=0)
+    OpenHouseProcessor(input_path, output_path).run()
+    return output_path
+
+
+async def _serve(service, requests, later=()):
+    # Start the service on a free port and send each request on its own connection, all at once, and the
+    # `later` ones after the others have arrived
+    server = await service.start('127.0.0.1', 0)
+    port = server.sockets[0].getsockname()[1]
+
+    async def send(path, delay=0):
+        await asyncio.sleep(delay)
+        reader, writer = await asyncio.open_connection('127.0.0.1', port)
+        try:
+            return await request(reader, writer, '127.0.0.1', path)
+        finally:
+            writer.close()
+
+    try:
+        return await asyncio.gather(*(send(path) for path in requests), *(send(path, 0.2) for path in later))
+    finally:
+        server.close()
+        await server.wait_closed()
+
+
+def test_service_answers_like_the_dashboard(data_path):
+    # Query endpoints return the dashboard's filtered results, bad requests are rejected
+    service = OpenHouseService(data_path)
+    paths = [
+        '/week_most_open_houses',
+        '/top_zip_codes?n=3&state=CA&start_date=2023-03-01',
+        '/daily_cumulative_total?zip_prefix=9&end_date=2023-04-30',
+        '/top_zip_codes?n=0',
+        '/top_zip_codes?start_date=2023-02-30',
+        '/week_most_open_houses?n=3',
+        '/missing',
+        '/health',
+    ]
+    responses = asyncio.run(_serve(service, paths))
+    service.close()
+
+    dashboard = OpenHouseDashboard(data_path)
+    expected = [
+        dashboard.get_week_most_open_houses_filtered_query(),
+        dashboard.get_top_zip_codes_filtered_query(n=3, state='CA', start_date='2023-03-01'),
+        dashboard.get_daily_cumulative_total_filtered_query(zip_prefix='9', end_date='2023-04-30'),
+    ]
+    for (status, body), (sql, params) in zip(responses, expected):
+        df = dashboard._query(sql, params)
+        actual = pd.DataFrame(json.loads(body)['rows'])
+        for column in df.select_dtypes('datetime'):
+            actual[column] = pd.to_datetime(actual[column])
+        assert status == 200
+        pd.testing.assert_frame_equal(actual, df, check_dtype=False)
+    dashboard.close()
+    assert [status for status, _ in responses[3:]] == [400, 400, 400, 404, 200]
+    assert 'n must be between' in json.loads(responses[3][1])['error']
+
+
+def test_identical_requests_are_coalesced(data_path, monkeypatch):
+    # Concurrent identical requests run one query, and distinct queries beyond max_pending are turned away
+    service = OpenHouseService(data_path, max_pending=1)
+    run = service._run
+
+    def slow_run(path, filters):
+        time.sleep(0.5)
+        return run(path, filters)
+
+    monkeypatch.setattr(service, '_run', slow_run)
+    responses = asyncio.run(_serve(service, ['/top_zip_codes?n=5'] * 10, later=['/daily_cumulative_total']))
+    service.close()
+
+    assert [status for status, _ in responses] == [200] * 10 + [503]
+    assert len({body for _, body in responses[:10]}) == 1
+    assert (service.executed, service.coalesced, service.rejected) == (1, 9, 1)
+
+
+def test_run_load_reports_latency(data_path):
+    service = OpenHouseService(data_path)
+
+    async def load():
+        server = await service.start('127.0.0.1', 0)
+        try:
+            return await run_load('127.0.0.1', server.sockets[0].getsockname()[1], concurrency=4, duration=0.5)
+        finally:
+            server.close()
+            await server.wait_closed()
+
+    report = asyncio.run(load())
+    service.close()
+    assert report['requests'] > 0 and report['statuses'] == {'200': report['requests']}
+    assert 0 < report['p50_ms'] <= report['p99_ms'] <= report['max_ms']
+
+
+def test_run_load_against_a_service_process(data_path):
+    # The service runs in its own process, and is interrupted once the load is done
+
+    async def load():
+        async with service_process(data_path, workers=2) as port:
+            return await run_load('127.0.0.1', port, concurrency=4, duration=0.5)
+
+    report = asyncio.run(load())
+    assert report['requests'] > 0 and report['statuses'] == {'200': report['requests']}
+
+
+def test_new_versions_are_picked_up_off_the_request_path(tmp_path):
+    # Requests query the dataset loaded last, and the background check swaps in a rewrite of the data
+    data_path = str(tmp_path / 'processed.parquet')
+    pd.DataFrame({'OpenHouseDate': ['2023-01-01'], 'Zipcode': ['12345']}).to_parquet(data_path, index=False)
+    manager = DatasetManager(data_path, check_interval=0.05)
+    service = OpenHouseService(data_path, manager=manager)
+
+    async def counts():
+        server = await service.start('127.0.0.1', 0)
+        reader, writer = await asyncio.open_connection('127.0.0.1', server.sockets[0].getsockname()[1])
+        try:
+            answers = []
+            for rewrite in (False, True):
+                if rewrite:
+                    pd.DataFrame({'OpenHouseDate': ['2023-01-01'] * 2, 'Zipcode': ['12345'] * 2}).to_parquet(
+                        data_path, index=False)
+                    deadline = time.monotonic() + 5
+                    while manager.loads < 2 and time.monotonic() < deadline:
+                        await asyncio.sleep(0.05)
+                _, body = await request(reader, writer, '127.0.0.1', '/top_zip_codes?n=1')
+                answers.append(json.loads(body)['rows'][0]['OpenHouseCount'])
+            return answers
+        finally:
+            writer.close()
+            server.close()
+            await server.wait_closed()
+
+    assert asyncio.run(counts()) == [1, 2]
+    service.close()